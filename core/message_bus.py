@@ -10,20 +10,40 @@ This module implements a high-performance message bus with:
 """
 
 import asyncio
+import bisect
+import enum
 import json
 import time
-from collections import defaultdict, deque
+from collections import Counter, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
-from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Protocol,
+    Set,
+    Tuple,
+    Union,
+)
 import heapq
-import pickle
+import itertools
 import os
+import pickle
+import random
+import shutil
 from pathlib import Path
 
 # import structlog
 from asyncio import Queue, PriorityQueue
 
 from core.message_types import (
+    AgentRequest,
+    AgentResponse,
     StandardMessage,
     MessageStatus,
     MessagePriority,
@@ -31,9 +51,20 @@ from core.message_types import (
     ErrorMessage,
     create_message,
 )
+from core.message_process import ProcessDispatcher
+from core.message_wal import (
+    FsyncPolicy,
+    SegmentSpool,
+    WALError,
+    WALRecord,
+    WriteAheadLog,
+)
 
 # logger = structlog.get_logger(__name__)
 
+# WAL record flag: payload is encoded with core.message_codec (otherwise JSON)
+PAYLOAD_BINARY = 0x01
+
 
 class MessageBusError(Exception):
     """Base exception for message bus errors."""
@@ -59,6 +90,175 @@ class MessageCorruptionError(MessageBusError):
     pass
 
 
+class RequestTimeoutError(MessageBusError):
+    """Raised when no response arrives for a request in time."""
+
+    pass
+
+
+class FlowControlError(QueueOverflowError):
+    """Raised when a sender has no publish credits left."""
+
+    pass
+
+
+class CapacityWaiters:
+    """
+    FIFO of producers waiting for capacity.
+
+    Producers wait in arrival order; whoever frees capacity calls wake() to
+    let the longest-waiting producer re-check. A woken producer that loses
+    the race for the slot goes back to the front of the line.
+    """
+
+    def __init__(self) -> None:
+        self._waiters: deque = deque()
+
+    def __len__(self) -> int:
+        return len(self._waiters)
+
+    async def wait(self, has_capacity: Callable[[], bool], timeout: float) -> bool:
+        """
+        Wait until has_capacity() is true and no earlier producer is waiting.
+
+        Args:
+            has_capacity: Checks whether a slot is free
+            timeout: Maximum seconds to wait
+
+        Returns:
+            True if capacity is available, False if the wait timed out
+        """
+        if has_capacity() and not self._waiters:
+            return True
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        retry = False
+        while True:
+            waiter = loop.create_future()
+            if retry:
+                self._waiters.appendleft(waiter)
+            else:
+                self._waiters.append(waiter)
+
+            try:
+                await asyncio.wait_for(waiter, max(0.0, deadline - loop.time()))
+            except asyncio.TimeoutError:
+                self._discard(waiter)
+                return False
+            except asyncio.CancelledError:
+                self._discard(waiter)
+                if waiter.done() and not waiter.cancelled():
+                    # Pass the wakeup on rather than swallowing it
+                    self.wake()
+                raise
+
+            if has_capacity():
+                return True
+            retry = True
+
+    def wake(self, count: int = 1) -> None:
+        """Wake up to `count` waiting producers, oldest first."""
+        while count > 0 and self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                count -= 1
+
+    def _discard(self, waiter: asyncio.Future) -> None:
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+
+
+def _is_async_callable(callback: Callable) -> bool:
+    """Whether calling `callback` returns a coroutine (async functions and __call__ methods)."""
+    return asyncio.iscoroutinefunction(callback) or asyncio.iscoroutinefunction(
+        getattr(callback, "__call__", None)
+    )
+
+
+class CallbackExecutor:
+    """
+    Thread pool for sync subscriber callbacks, with a bounded backlog.
+
+    At most ``workers`` callbacks run at once and up to ``max_pending`` more
+    wait for a thread; beyond that, run() waits before submitting. Giving
+    slow sync agents pools of their own keeps them from tying up the threads
+    other subscribers (and the loop's default executor) depend on.
+    """
+
+    def __init__(self, name: str, workers: int = 4, max_pending: int = 100):
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        if max_pending < 0:
+            raise ValueError("max_pending must not be negative")
+
+        self.name = name
+        self.workers = workers
+        self.max_pending = max_pending
+        self.subscribers = 0  # subscriptions using this pool
+        self.submitted = 0  # calls running or waiting for a thread
+
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"bus-{name}")
+        self._slots = asyncio.Semaphore(workers + max_pending)
+
+    async def run(self, func: Callable[[Any], Any], arg: Any) -> Any:
+        """Call func(arg) on the pool, first waiting for room if the backlog is full."""
+        async with self._slots:
+            self.submitted += 1
+            try:
+                return await asyncio.get_running_loop().run_in_executor(self._pool, func, arg)
+            finally:
+                self.submitted -= 1
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "workers": self.workers,
+            "running": min(self.submitted, self.workers),
+            "waiting": max(0, self.submitted - self.workers),
+            "subscribers": self.subscribers,
+        }
+
+    def shutdown(self) -> None:
+        """Drop waiting calls; callbacks already running finish in the background."""
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+class OverflowPolicy(enum.Enum):
+    """
+    What dispatch does with a message for a subscriber whose mailbox is full.
+
+    BLOCK waits for room, so a slow subscriber pushes back on the dispatcher
+    (and, through the main queue, on publishers); nothing is lost (what stop()
+    can't deliver in time is dead-lettered). DROP_OLDEST
+    discards the longest-waiting message to make room, for subscribers that
+    only care about recent state. DEAD_LETTER sends the new message to the
+    DLQ, from where it can be replayed once the subscriber catches up.
+    """
+
+    BLOCK = "block"
+    DROP_OLDEST = "drop_oldest"
+    DEAD_LETTER = "dead_letter"
+
+
+class _Delivery:
+    """
+    Holds on a dispatched message: one for dispatch, one per mailbox copy.
+
+    The message is acked on the main queue when the last hold is released,
+    i.e. once every copy went through its callback or was handed to the
+    retry or DLQ path.
+    """
+
+    __slots__ = ("message", "holds")
+
+    def __init__(self, message: StandardMessage):
+        self.message = message
+        self.holds = 1
+
+
 class MessageSubscription:
     """Represents a subscription to message topics."""
 
@@ -69,9 +269,18 @@ class MessageSubscription:
         topics: Optional[Set[str]] = None,
         message_types: Optional[Set[str]] = None,
         priority_threshold: Optional[MessagePriority] = None,
+        max_batch: Optional[int] = None,
+        max_wait_ms: float = 50.0,
+        max_pending: int = 1000,
+        process_workers: Optional[int] = None,
+        ring_size: int = 1 << 20,
+        overflow: Union[OverflowPolicy, str] = OverflowPolicy.BLOCK,
+        concurrency: int = 1,
     ):
         self.subscriber_id = subscriber_id
         self.callback = callback
+        self.is_async = _is_async_callable(callback)  # sync callbacks run on `executor`
+        self.executor: Optional[CallbackExecutor] = None
         self.topics = topics or set()
         self.message_types = message_types or set()
         self.priority_threshold = priority_threshold
@@ -80,11 +289,42 @@ class MessageSubscription:
         self.error_count = 0
         self.last_message_time: Optional[datetime] = None
 
+        # Mailbox: dispatch leaves (enqueued_at, message, delivery) entries here, bounded by
+        # max_pending with `overflow` deciding what happens when it is full, and
+        # `concurrency` consumer tasks deliver them; batch subscriptions receive
+        # lists of up to max_batch messages
+        self.max_batch = max_batch
+        self.max_wait_ms = max_wait_ms
+        self.overflow = OverflowPolicy(overflow)
+        self.concurrency = concurrency
+        self.mailbox: asyncio.Queue = asyncio.Queue(maxsize=max_pending)
+        self.consumer_tasks: List[asyncio.Task] = []
+        self.batch_count = 0
+        self.overflow_count = 0  # messages dropped or dead-lettered because the mailbox was full
+
+        # Process delivery: a sync callback runs in worker processes fed from a
+        # shared-memory ring; outcomes are collected by process_task
+        self.process_pool: Optional[ProcessDispatcher] = (
+            ProcessDispatcher(callback, process_workers, ring_size) if process_workers else None
+        )
+        self.process_task: Optional[asyncio.Task] = None
+        # id(message) -> deliveries of the copies handed to the workers, released on their result
+        self.process_deliveries: Dict[int, List[_Delivery]] = {}
+
+    @property
+    def is_batch(self) -> bool:
+        """Whether this subscription receives messages in batches."""
+        return bool(self.max_batch)
+
     def matches(self, message: StandardMessage) -> bool:
         """Check if message matches subscription criteria."""
         if not self.is_active:
             return False
 
+        # Addressed messages go to their recipient only, regardless of filters
+        if message.recipient:
+            return message.recipient == self.subscriber_id
+
         # Check priority threshold
         if self.priority_threshold and message.priority > self.priority_threshold:
             return False
@@ -107,114 +347,1265 @@ class MessageSubscription:
         return True
 
 
-class PersistentQueue:
-    """Queue with optional persistence to disk."""
+class SubscriptionIndex:
+    """
+    Inverted routing index from message type and topic to subscriptions.
+
+    Maintained incrementally on subscribe/unsubscribe so matching a message
+    costs a few dict lookups and set operations instead of a scan over every
+    subscription.
+    """
+
+    def __init__(self) -> None:
+        self._by_type: Dict[str, Set[MessageSubscription]] = defaultdict(set)
+        self._any_type: Set[MessageSubscription] = set()
+        self._by_topic: Dict[str, Set[MessageSubscription]] = defaultdict(set)
+        self._any_topic: Set[MessageSubscription] = set()
+
+    def add(self, subscription: MessageSubscription) -> None:
+        """Index a subscription."""
+        if subscription.message_types:
+            for message_type in subscription.message_types:
+                self._by_type[message_type].add(subscription)
+        else:
+            self._any_type.add(subscription)
+
+        if subscription.topics:
+            for topic in subscription.topics:
+                self._by_topic[topic].add(subscription)
+        else:
+            self._any_topic.add(subscription)
+
+    def remove(self, subscription: MessageSubscription) -> None:
+        """Remove a subscription from the index."""
+        self._any_type.discard(subscription)
+        for message_type in subscription.message_types:
+            self._discard(self._by_type, message_type, subscription)
+
+        self._any_topic.discard(subscription)
+        for topic in subscription.topics:
+            self._discard(self._by_topic, topic, subscription)
+
+    def match(self, message: StandardMessage) -> List[MessageSubscription]:
+        """Get all active subscriptions matching a message."""
+        # Candidates by message type
+        message_type = message.type.value if hasattr(message.type, "value") else message.type
+        typed = self._by_type.get(message_type)
+        if typed:
+            candidates = typed | self._any_type
+        else:
+            candidates = set(self._any_type)
+
+        # Narrow down by topics (in metadata)
+        if self._by_topic and candidates:
+            topic_matched = set(self._any_topic)
+            message_topics = message.metadata.get("topics") or ()
+            if isinstance(message_topics, str):
+                message_topics = (message_topics,)
+            for topic in message_topics:
+                subscribed = self._by_topic.get(topic)
+                if subscribed:
+                    topic_matched |= subscribed
+            candidates &= topic_matched
+
+        return [
+            sub
+            for sub in candidates
+            if sub.is_active
+            and not (sub.priority_threshold and message.priority > sub.priority_threshold)
+        ]
+
+    @staticmethod
+    def _discard(
+        index: Dict[str, Set[MessageSubscription]],
+        key: str,
+        subscription: MessageSubscription,
+    ) -> None:
+        subscriptions = index.get(key)
+        if subscriptions is not None:
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del index[key]
+
+
+def _priority_name(priority: int) -> str:
+    """Get the MessagePriority name of a priority value (the number if it has none)."""
+    try:
+        return MessagePriority(priority).name
+    except ValueError:
+        return str(priority)
+
+
+class WaitTimeHistogram:
+    """Fixed-bucket histogram of how long messages waited in a queue."""
+
+    # Upper bounds of the buckets in milliseconds; a final bucket catches the rest
+    BOUNDS_MS = (1, 5, 10, 50, 100, 500, 1000, 5000, 10000, 60000)
+
+    def __init__(self) -> None:
+        self.counts = [0] * (len(self.BOUNDS_MS) + 1)
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+    def observe(self, wait_seconds: float) -> None:
+        """Record one wait time."""
+        wait_ms = max(0.0, wait_seconds * 1000)
+        self.counts[bisect.bisect_left(self.BOUNDS_MS, wait_ms)] += 1
+        self.total_ms += wait_ms
+        if wait_ms > self.max_ms:
+            self.max_ms = wait_ms
+
+    def percentile(self, percent: float) -> Optional[float]:
+        """Get an upper estimate (ms) of the wait below which `percent` of waits fall."""
+        count = self.count
+        if not count:
+            return None
+        rank = count * percent / 100
+        seen = 0
+        for bound, bucket in zip(self.BOUNDS_MS, self.counts):
+            seen += bucket
+            if seen >= rank:
+                return float(min(bound, round(self.max_ms, 3)))
+        return round(self.max_ms, 3)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Get a JSON-serializable summary."""
+        count = self.count
+        labels = [f"le_{bound}ms" for bound in self.BOUNDS_MS] + ["inf"]
+        return {
+            "count": count,
+            "avg_ms": round(self.total_ms / count, 3) if count else 0.0,
+            "p50_ms": self.percentile(50),
+            "p99_ms": self.percentile(99),
+            "max_ms": round(self.max_ms, 3),
+            "buckets": dict(zip(labels, self.counts)),
+        }
+
+
+class QueueBackend(Protocol):
+    """
+    Message storage that MessageBus programs against for its main queue and DLQ.
+
+    The bus owns routing, retries and flow control; a backend only stores
+    messages. Every message handed out by get(), get_many() or
+    evict_expired() is later ack()ed once the bus is done with it, or
+    nack()ed to return it for another get(). Durable backends keep such a
+    message until it is acked, so one that was handed out but never acked
+    is handed out again after a restart.
+
+    Backends subclass QueueBackend to inherit the defaults below: get_many()
+    built on get(), no TTL index (expired messages are then caught at
+    dispatch), no per-lane metrics, nothing to flush and close() = flush().
+    """
+
+    name: str
+    max_size: int
+
+    async def put(self, message: StandardMessage, timeout: Optional[float] = None) -> None:
+        """Store a message, waiting up to `timeout` for room (None = fail at once)."""
+        ...
+
+    async def put_many(self, messages: List[StandardMessage]) -> List[Optional[Exception]]:
+        """Store a batch; returns the per-message error (None if stored) in input order."""
+        ...
+
+    async def get(self) -> Optional[StandardMessage]:
+        """Get the next message, or None if there is none."""
+        ...
+
+    async def get_many(self, limit: int) -> List[StandardMessage]:
+        """Get up to `limit` messages in dequeue order."""
+        messages: List[StandardMessage] = []
+        while len(messages) < limit:
+            message = await self.get()
+            if message is None:
+                break
+            messages.append(message)
+        return messages
+
+    async def ack(self, message: StandardMessage) -> None:
+        """Acknowledge a message handed out by get() or evict_expired(); it is gone for good."""
+        pass
+
+    async def nack(self, message: StandardMessage) -> None:
+        """Return a message handed out by get() for a later get()."""
+        ...
+
+    async def size(self) -> int:
+        """Get the number of stored messages."""
+        ...
+
+    def __len__(self) -> int:
+        """Get the number of stored messages without waiting (may be approximate)."""
+        ...
+
+    async def wait_not_empty(self, timeout: Optional[float] = None) -> bool:
+        """Wait up to `timeout` (None = forever) for a message; False if the wait timed out."""
+        ...
+
+    async def clear(self) -> None:
+        """Remove every stored message."""
+        ...
+
+    async def flush(self) -> None:
+        """Make everything stored so far durable."""
+        pass
+
+    async def close(self) -> None:
+        """Flush and release files or connections; a later call reopens them."""
+        await self.flush()
+
+    def next_expiry(self) -> Optional[float]:
+        """Get the time by which the earliest expiring message can be evicted, if any."""
+        return None
+
+    async def evict_expired(
+        self, now: Optional[float] = None, limit: int = 1000
+    ) -> List[StandardMessage]:
+        """Remove and return up to `limit` messages whose TTL has passed, to be acked like get()."""
+        return []
+
+    def lane_sizes(self) -> Dict[str, int]:
+        """Get the number of stored messages per priority lane."""
+        return {}
+
+    def wait_times(self) -> Dict[int, WaitTimeHistogram]:
+        """Get wait-time histograms of dequeued messages, by priority value."""
+        return {}
+
+
+class DequeuePolicy(enum.Enum):
+    """How PersistentQueue chooses the priority lane to serve next."""
+
+    STRICT = "strict"  # always the highest non-empty priority
+    WEIGHTED = "weighted"  # smooth weighted round-robin across non-empty lanes
+
+
+# Default lane weights for DequeuePolicy.WEIGHTED (share of dequeues under contention)
+DEFAULT_LANE_WEIGHTS: Dict[int, int] = {
+    MessagePriority.CRITICAL: 16,
+    MessagePriority.HIGH: 8,
+    MessagePriority.NORMAL: 4,
+    MessagePriority.LOW: 2,
+    MessagePriority.DEFERRED: 1,
+}
+
+
+def _weighted_pick(
+    waiting: List[int], weights: Dict[int, int], credit: Dict[int, int], commit: bool
+) -> int:
+    """
+    Choose a lane by smooth weighted round-robin.
+
+    Every waiting lane earns its weight in credit, the richest lane is served
+    and pays back the total.
+
+    Args:
+        waiting: Priorities of the non-empty lanes, highest priority first
+            (which wins ties)
+        weights: Lane weights by priority (missing = 1)
+        credit: Round-robin state, updated in place if `commit`
+        commit: Record the choice
+
+    Returns:
+        Priority value of the chosen lane
+    """
+    best = None
+    best_credit = 0
+    total = 0
+    for priority in waiting:
+        weight = weights.get(priority, 1)
+        total += weight
+        earned = credit[priority] + weight
+        if best is None or earned > best_credit:
+            best, best_credit = priority, earned
+        if commit:
+            credit[priority] = earned
+
+    if commit:
+        credit[best] -= total
+    return best
+
+
+class PersistentQueue(QueueBackend):
+    """
+    Priority queue with optional persistence to disk via an append-only write-ahead log.
+
+    Each priority level has its own FIFO lane (a deque), so enqueue and
+    dequeue are O(1) and messages of equal priority keep arrival order.
+
+    With strict priority, a steady stream of high priority traffic starves
+    the lower lanes. ``aging_interval`` counters that: every that many
+    seconds a message has waited counts as one priority level gained, so
+    a LOW message queued more than 2 intervals before a HIGH one is
+    served first.
+    The WEIGHTED policy never starves a lane and ignores aging.
+
+    Messages with a TTL are also indexed by expiry second, so
+    evict_expired() finds expired messages without scanning the lanes.
+    Evicted messages are tombstoned in their lane and skipped on dequeue;
+    they stop counting against capacity right away.
+
+    A message handed out by get() or evict_expired() stays in the log until
+    it is acked, so one that was in flight at a crash is recovered. nack()
+    puts it back under its original log record.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_size: int = 10000,
+        persist_path: Optional[Path] = None,
+        fsync_policy: FsyncPolicy = FsyncPolicy.BATCHED,
+        policy: DequeuePolicy = DequeuePolicy.STRICT,
+        lane_weights: Optional[Dict[int, int]] = None,
+        aging_interval: Optional[float] = None,
+    ):
+        if aging_interval is not None and aging_interval <= 0:
+            raise ValueError("aging_interval must be positive")
 
-    def __init__(self, name: str, max_size: int = 10000, persist_path: Optional[Path] = None):
         self.name = name
         self.max_size = max_size
         self.persist_path = persist_path
-        self._queue: List[Tuple[float, float, StandardMessage]] = []
+        self.policy = policy
+        self.aging_interval = aging_interval
+        self.lane_weights = dict(DEFAULT_LANE_WEIGHTS)
+        if lane_weights:
+            self.lane_weights.update({int(p): w for p, w in lane_weights.items()})
+        if any(weight < 1 for weight in self.lane_weights.values()):
+            raise ValueError("Lane weights must be at least 1")
+
+        # Priority value -> FIFO of (enqueue time, seq, message or not-yet-hydrated WAL record)
+        self._lanes: Dict[int, deque] = {}
+        self._lane_order: List[int] = []  # priority values, highest priority first
+        for priority in MessagePriority:
+            self._lane(priority)
+        self._credit: Dict[int, int] = defaultdict(int)  # weighted round-robin state
+        self._count = 0  # live messages (excludes tombstones)
+        self._wait_times: Dict[int, WaitTimeHistogram] = defaultdict(WaitTimeHistogram)
+
+        # Expiry index: second -> seqs expiring in it, a heap of those seconds,
+        # and seq -> (second, priority, message or record)
+        self._expiry_buckets: Dict[int, Set[int]] = {}
+        self._expiry_seconds: List[int] = []
+        self._expiring: Dict[int, Tuple[int, int, Union[StandardMessage, WALRecord]]] = {}
+        self._dead: Dict[int, int] = {}  # seq -> priority of evicted, still-laned entries
+        self._putters = CapacityWaiters()  # producers waiting for capacity
+        # id(message) -> (message, seqs) of logged messages handed out but not yet acked
+        self._inflight: Dict[int, Tuple[StandardMessage, List[int]]] = {}
+
         self._lock = asyncio.Lock()
+        self._not_empty = asyncio.Event()
+        self._seq = 0
 
-        # Load persisted messages if path exists
-        if persist_path and persist_path.exists():
-            self._load_from_disk()
+        # Write-ahead log (persist_path is the segment directory)
+        self._wal: Optional[WriteAheadLog] = None
+        if persist_path:
+            self._wal = WriteAheadLog(persist_path, fsync_policy=fsync_policy)
+            self._recover()
+
+    async def put(self, message: StandardMessage, timeout: Optional[float] = None) -> None:
+        """
+        Add message to the lane of its priority.
+
+        Args:
+            message: Message to enqueue
+            timeout: Seconds to wait for capacity when the queue is full, in
+                FIFO order with other waiting producers (None = fail at once)
+
+        Raises:
+            QueueOverflowError: If the queue is full (after waiting `timeout`)
+        """
+        if timeout is not None and not await self._putters.wait(
+            lambda: self._count < self.max_size, timeout
+        ):
+            raise QueueOverflowError(
+                f"Queue {self.name} is at capacity ({self.max_size}) after waiting {timeout:.3g}s"
+            )
 
-    async def put(self, message: StandardMessage) -> None:
-        """Add message to queue with priority ordering."""
         async with self._lock:
-            if len(self._queue) >= self.max_size:
+            if self._count >= self.max_size:
                 raise QueueOverflowError(f"Queue {self.name} is at capacity ({self.max_size})")
+            self._enqueue(message)
+        await self._durable()
+
+    async def put_many(self, messages: List[StandardMessage]) -> List[Optional[Exception]]:
+        """
+        Add a batch of messages under a single lock acquisition and log write.
+
+        Messages beyond the remaining capacity are rejected individually.
 
-            # Use negative priority for min heap (lower priority value = higher priority)
-            priority_value = float(
-                message.priority if isinstance(message.priority, int) else message.priority.value
+        Returns:
+            Per-message error (None if enqueued), in input order
+        """
+        async with self._lock:
+            available = max(0, self.max_size - self._count)
+            accepted = messages[:available]
+            errors: List[Optional[Exception]] = [None] * len(accepted)
+            errors.extend(
+                QueueOverflowError(f"Queue {self.name} is at capacity ({self.max_size})")
+                for _ in messages[available:]
             )
+            if not accepted:
+                return errors
+
             timestamp = time.time()
-            heapq.heappush(self._queue, (priority_value, timestamp, message))
+            priorities = [int(m.priority) for m in accepted]
+            expiries = [self._expires_at(m) for m in accepted]
+
+            # Log the whole batch before making it visible
+            if self._wal:
+                seqs = self._wal.append_enqueue_many(
+                    [
+                        (m.to_bytes(), p, timestamp, e)
+                        for m, p, e in zip(accepted, priorities, expiries)
+                    ],
+                    PAYLOAD_BINARY,
+                )
+            else:
+                seqs = range(self._seq + 1, self._seq + 1 + len(accepted))
+                self._seq += len(accepted)
+
+            for message, priority, seq, expires_at in zip(accepted, priorities, seqs, expiries):
+                self._append(priority, timestamp, seq, message, expires_at)
+            self._not_empty.set()
 
-            # Persist if enabled
-            if self.persist_path:
-                await self._persist_to_disk()
+        await self._durable()
+        return errors
 
     async def get(self) -> Optional[StandardMessage]:
-        """Get highest priority message from queue."""
+        """Get the next message according to the dequeue policy."""
+        async with self._lock:
+            return self._take()
+
+    def _take(self) -> Optional[StandardMessage]:
+        """Dequeue the next live message; the lock must be held."""
+        while self._count:
+            priority = self._select_lane(commit=True)
+            timestamp, seq, message = self._popleft(priority)
+            self._wait_times[priority].observe(time.time() - timestamp)
+            if not self._count:
+                self._not_empty.clear()
+
+            if isinstance(message, WALRecord):
+                message = self._hydrate(message)
+                if message is None:
+                    # Unreadable: there is nothing to hand out or take back
+                    self._wal.append_ack(seq)
+                    continue
+
+            if self._wal:
+                self._hold(message, seq)
+            return message
+
+        return None
+
+    async def ack(self, message: StandardMessage) -> None:
+        """Acknowledge a message handed out by get() or evict_expired(), logging its removal."""
+        # Synchronous, so it never interleaves with a locked mutation
+        seq = self._release(message)
+        if seq is not None:
+            self._wal.append_ack(seq)
+
+    async def nack(self, message: StandardMessage) -> None:
+        """
+        Return a message handed out by get() to the back of its lane.
+
+        The message was admitted once, so it is taken back even if that
+        briefly puts the queue over max_size. A logged message keeps its
+        record; anything else is logged anew.
+        """
+        async with self._lock:
+            seq = self._release(message)
+            if seq is not None:
+                priority, expires_at = int(message.priority), self._expires_at(message)
+                self._append(priority, time.time(), seq, message, expires_at)
+                self._not_empty.set()
+                return
+            self._enqueue(message)
+        await self._durable()
+
+    async def wait_not_empty(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until the queue holds at least one message.
+
+        Args:
+            timeout: Maximum seconds to wait (None = wait forever)
+
+        Returns:
+            True if the queue is non-empty, False if the wait timed out
+        """
+        if self._not_empty.is_set():
+            return True
+
+        try:
+            await asyncio.wait_for(self._not_empty.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    async def peek(self) -> Optional[StandardMessage]:
+        """Peek at the message get() would return next, without removing it."""
         async with self._lock:
-            if not self._queue:
-                return None
+            return self._peek()
+
+    def _peek(self) -> Optional[StandardMessage]:
+        """Get the next live message without removing it; the lock must be held."""
+        while self._count:
+            priority = self._select_lane(commit=False)
+            entries = self._lanes[priority]
+            timestamp, seq, message = entries[0]
+            if not isinstance(message, WALRecord):
+                return message
+
+            # Hydrate in place; the lane position is unchanged
+            message = self._hydrate(message)
+            if message is not None:
+                entries[0] = (timestamp, seq, message)
+                return message
+
+            self._popleft(priority)
+            self._wal.append_ack(seq)
+
+        self._not_empty.clear()
+        return None
+
+    async def size(self) -> int:
+        """Get current queue size."""
+        # Reading a counter never interleaves with a mutation on the event loop
+        return self._count
+
+    def __len__(self) -> int:
+        return self._count
+
+    def lane_sizes(self) -> Dict[str, int]:
+        """Get the number of queued messages per priority lane."""
+        dead = Counter(self._dead.values())
+        return {
+            _priority_name(priority): len(self._lanes[priority]) - dead[priority]
+            for priority in self._lane_order
+        }
+
+    def next_expiry(self) -> Optional[float]:
+        """Get the time by which the earliest expiring message can be evicted, if any."""
+        seconds = self._expiry_seconds
+        while seconds and seconds[0] not in self._expiry_buckets:
+            heapq.heappop(seconds)
+        return float(seconds[0] + 1) if seconds else None
+
+    async def evict_expired(
+        self, now: Optional[float] = None, limit: int = 1000
+    ) -> List[StandardMessage]:
+        """
+        Remove messages whose TTL has passed.
+
+        Expiry is tracked per second, so a message is evicted within a second
+        after it expires.
+
+        Args:
+            now: Current time (defaults to time.time())
+            limit: Maximum number of messages to evict in this call
+
+        Returns:
+            The evicted messages (unreadable persisted ones are dropped)
+        """
+        if now is None:
+            now = time.time()
+
+        evicted: List[StandardMessage] = []
+        removed = 0
+        async with self._lock:
+            seconds = self._expiry_seconds
+            while seconds and seconds[0] + 1 <= now and removed < limit:
+                second = seconds[0]
+                bucket = self._expiry_buckets.get(second)
+                while bucket and removed < limit:
+                    seq = bucket.pop()
+                    _, priority, message = self._expiring.pop(seq)
+                    self._tombstone(priority, seq)
+                    removed += 1
+
+                    if isinstance(message, WALRecord):
+                        message = self._hydrate(message)
+                        if message is None:
+                            self._wal.append_ack(seq)
+                            continue
+                    if self._wal:
+                        self._hold(message, seq)
+                    evicted.append(message)
+
+                if not bucket:
+                    self._expiry_buckets.pop(second, None)
+                    heapq.heappop(seconds)
+
+            if not self._count:
+                self._not_empty.clear()
+
+        return evicted
+
+    def wait_times(self) -> Dict[int, WaitTimeHistogram]:
+        """Get the wait-time histograms of dequeued messages, by priority value."""
+        return dict(self._wait_times)
+
+    async def clear(self) -> None:
+        """Clear all messages from queue."""
+        async with self._lock:
+            for lane in self._lanes.values():
+                lane.clear()
+            self._credit.clear()
+            self._expiry_buckets.clear()
+            self._expiry_seconds.clear()
+            self._expiring.clear()
+            self._dead.clear()
+            self._inflight.clear()
+            self._count = 0
+            self._putters.wake(self.max_size)
+            self._not_empty.clear()
+            if self._wal:
+                self._wal.clear()
+
+    async def flush(self) -> None:
+        """Flush pending log records to stable storage."""
+        # The fsync runs on the log's I/O thread; the lock stays free meanwhile
+        if self._wal:
+            await self._wal.wait_synced()
+
+    async def close(self) -> None:
+        """Sync and close the log's files; the next write or read reopens them."""
+        if self._wal:
+            await self._wal.wait_synced()
+            async with self._lock:
+                self._wal.close()
+
+    async def _durable(self) -> None:
+        """Under FsyncPolicy.ALWAYS, wait until what was just logged is on disk (lock not held)."""
+        if self._wal and self._wal.fsync_policy == FsyncPolicy.ALWAYS:
+            await self._wal.wait_synced()
+
+    def _enqueue(self, message: StandardMessage) -> None:
+        """Log a message and add it to its lane (caller holds the lock)."""
+        priority = int(message.priority)
+        timestamp = time.time()
+        expires_at = self._expires_at(message)
+
+        # Log before making the message visible
+        if self._wal:
+            seq = self._wal.append_enqueue(
+                message.to_bytes(), priority, timestamp, expires_at, PAYLOAD_BINARY
+            )
+        else:
+            self._seq += 1
+            seq = self._seq
+
+        self._append(priority, timestamp, seq, message, expires_at)
+        self._not_empty.set()
+
+    def _hold(self, message: StandardMessage, seq: int) -> None:
+        """Keep the log record of a handed-out message until it is acked."""
+        held = self._inflight.get(id(message))
+        if held is None:
+            self._inflight[id(message)] = (message, [seq])
+        else:
+            # The same object was queued more than once
+            held[1].append(seq)
+
+    def _release(self, message: StandardMessage) -> Optional[int]:
+        """Stop tracking one in-flight copy of a message; returns its seq (None if untracked)."""
+        held = self._inflight.get(id(message))
+        if held is None:
+            return None
+        seqs = held[1]
+        seq = seqs.pop()
+        if not seqs:
+            del self._inflight[id(message)]
+        return seq
+
+    @staticmethod
+    def _expires_at(message: StandardMessage) -> float:
+        """Get the absolute expiry time of a message (0 = never)."""
+        if message.ttl is None:
+            return 0.0
+        return message.timestamp.timestamp() + message.ttl
+
+    @staticmethod
+    def _decode(payload: bytes, flags: int) -> StandardMessage:
+        """Decode a logged message payload."""
+        if flags & PAYLOAD_BINARY:
+            return StandardMessage.from_bytes(payload)
+        return create_message(json.loads(payload))
+
+    def _hydrate(self, record: WALRecord) -> Optional[StandardMessage]:
+        """Load and decode the message of a recovered record (None if unreadable)."""
+        try:
+            return self._decode(self._wal.read_payload(record.seq), record.flags)
+        except Exception:
+            # logger.exception("Failed to restore message", seq=record.seq)
+            return None
+
+    def _lane(self, priority: int) -> deque:
+        """Get the lane of a priority value, creating it for values outside MessagePriority."""
+        lane = self._lanes.get(priority)
+        if lane is None:
+            lane = self._lanes[int(priority)] = deque()
+            self._lane_order = sorted(self._lanes)
+        return lane
+
+    def _append(
+        self,
+        priority: int,
+        timestamp: float,
+        seq: int,
+        message: Union[StandardMessage, WALRecord],
+        expires_at: float,
+    ) -> None:
+        """Add an entry to its lane and, if it has a TTL, to the expiry index."""
+        self._lane(priority).append((timestamp, seq, message))
+        self._count += 1
+
+        if expires_at:
+            second = int(expires_at)
+            bucket = self._expiry_buckets.get(second)
+            if bucket is None:
+                bucket = self._expiry_buckets[second] = set()
+                heapq.heappush(self._expiry_seconds, second)
+            bucket.add(seq)
+            self._expiring[seq] = (second, priority, message)
+
+    def _popleft(self, priority: int) -> Tuple[float, int, Union[StandardMessage, WALRecord]]:
+        """Remove the head entry of a lane, keeping the expiry index in step."""
+        lane = self._lanes[priority]
+        entry = lane.popleft()
+        self._count -= 1
+        if self._putters:
+            self._putters.wake()
+
+        expiring = self._expiring.pop(entry[1], None)
+        if expiring is not None:
+            bucket = self._expiry_buckets[expiring[0]]
+            bucket.discard(entry[1])
+            if not bucket:
+                del self._expiry_buckets[expiring[0]]
+
+        self._drop_dead_head(lane)
+        return entry
+
+    def _tombstone(self, priority: int, seq: int) -> None:
+        """Mark a laned entry as evicted; it is skipped once it reaches the lane head."""
+        self._dead[seq] = priority
+        self._count -= 1
+        if self._putters:
+            self._putters.wake()
+        self._drop_dead_head(self._lanes[priority])
+
+    def _drop_dead_head(self, lane: deque) -> None:
+        """Pop tombstoned entries off a lane head so non-empty lanes start with a live entry."""
+        if self._dead:
+            while lane and lane[0][1] in self._dead:
+                del self._dead[lane.popleft()[1]]
+
+    def _select_lane(self, commit: bool) -> int:
+        """
+        Choose the priority lane to serve next; the queue must not be empty.
+
+        Args:
+            commit: Record the choice in the weighted round-robin state
+
+        Returns:
+            Priority value of the chosen lane
+        """
+        if self.policy == DequeuePolicy.STRICT:
+            if self.aging_interval is not None:
+                return self._select_aged_lane()
+            for priority in self._lane_order:
+                if self._lanes[priority]:
+                    return priority
+
+        lanes = self._lanes
+        waiting = [priority for priority in self._lane_order if lanes[priority]]
+        return _weighted_pick(waiting, self.lane_weights, self._credit, commit)
+
+    def _select_aged_lane(self) -> int:
+        """
+        Choose the lane whose head has the best effective priority after aging.
+
+        Effective priority is ``priority - waited / aging_interval``. Lane heads
+        are their oldest messages, so ranking by ``enqueued_at + priority *
+        aging_interval`` (earliest first) is equivalent and needs no clock read.
+        """
+        interval = self.aging_interval
+        best = None
+        best_rank = 0.0
+        for priority in self._lane_order:
+            lane = self._lanes[priority]
+            if lane:
+                rank = lane[0][0] + priority * interval
+                if best is None or rank < best_rank:
+                    best, best_rank = priority, rank
+        return best
+
+    def _iter_entries(self) -> Iterator[Tuple[int, float, int, Union[StandardMessage, WALRecord]]]:
+        """Iterate (priority, enqueue time, seq, message or record), lane by lane."""
+        for priority in self._lane_order:
+            for timestamp, seq, message in self._lanes[priority]:
+                if seq not in self._dead:
+                    yield priority, timestamp, seq, message
+
+    def _import_entries(self, entries: List[Tuple[float, float, StandardMessage]]) -> None:
+        """
+        Log and enqueue (priority, enqueue time, message) entries during startup.
+
+        Entries are appended to their lanes in the given order. The log is
+        synced before returning so the source of the entries can be discarded.
+        """
+        seqs = self._wal.append_enqueue_many(
+            [(m.to_bytes(), int(p), t, self._expires_at(m)) for p, t, m in entries],
+            PAYLOAD_BINARY,
+        )
+        self._wal.sync()
+        for (priority, timestamp, message), seq in zip(entries, seqs):
+            self._append(int(priority), timestamp, seq, message, self._expires_at(message))
+
+    def _migrate_legacy_pickle(self) -> None:
+        """
+        Import a queue file written by the former pickle-based persistence.
+
+        ``<persist_path>.pkl`` (e.g. ``main_queue.pkl`` next to the
+        ``main_queue`` log directory) is appended to the log once and then
+        renamed to ``*.pkl.migrated``.
+        """
+        legacy_path = self.persist_path.with_suffix(".pkl")
+        if not legacy_path.exists():
+            return
+
+        try:
+            # Only ever reads the file this service wrote itself before the WAL format
+            with open(legacy_path, "rb") as f:
+                data = pickle.load(f)  # nosec B301
+        except Exception:
+            # logger.exception(f"Failed to read legacy queue file {legacy_path}")
+            return
+
+        entries = []
+        for priority, timestamp, msg_data in data:
+            try:
+                entries.append((priority, timestamp, create_message(msg_data)))
+            except Exception:
+                # logger.exception("Failed to migrate message")
+                pass
+
+        entries.sort(key=lambda entry: entry[1])
+        self._import_entries(entries)
+        legacy_path.rename(legacy_path.with_name(f"{legacy_path.name}.migrated"))
+
+    def _absorb_shards(self) -> None:
+        """
+        Import the logs of the former sharded queue (``shard-*`` subdirectories).
+
+        Their messages are appended in enqueue order, and the shard
+        directories are removed once the log is synced.
+        """
+        directories = sorted(path for path in self.persist_path.glob("shard-*") if path.is_dir())
+        if not directories:
+            return
+
+        entries = []
+        for directory in directories:
+            shard = PersistentQueue(f"{self.name}-{directory.name}", 0, directory)
+            for priority, timestamp, _, message in shard._iter_entries():
+                if isinstance(message, WALRecord):
+                    message = shard._hydrate(message)
+                if message is not None:
+                    entries.append((priority, timestamp, message))
+            shard._wal.close()
+
+        entries.sort(key=lambda entry: entry[1])
+        self._import_entries(entries)
+        for directory in directories:
+            shutil.rmtree(directory)
+
+    def _recover(self) -> None:
+        """
+        Rebuild the priority lanes from the write-ahead log.
+
+        Only the record index is loaded; message bodies stay on disk until
+        the message is dequeued, so startup cost doesn't include decoding
+        and validating every persisted message.
+        """
+        if not self._wal:
+            return
+
+        # Damaged segments only lose the records they hold (see WriteAheadLog.recover())
+        records = self._wal.recover()
+        for error in self._wal.recovery_errors:
+            # logger.error(f"Damaged log segment in queue {self.name}: {error}")
+            pass
+
+        # Records are in sequence order, which is also FIFO order within a lane
+        for record in records:
+            self._append(record.priority, record.enqueued_at, record.seq, record, record.expires_at)
+        self._migrate_legacy_pickle()
+        self._absorb_shards()
+        if self._count:
+            self._not_empty.set()
+
+
+class DeadLetterQueue(QueueBackend):
+    """
+    Dead-letter queue with a bounded in-memory head that spills to disk.
+
+    Up to max_size messages are kept in a PersistentQueue. Once it is full,
+    further messages are appended to a SegmentSpool, whose memory use does
+    not grow with its length. While anything is spilled, new messages go to
+    the spool too, so they are read back in arrival order. get() drains the
+    head first and then streams from the spool.
+
+    Without a spill path, a full queue rejects messages like PersistentQueue.
+    """
+
+    # Spool reads between cursor commits for single-message get()
+    COMMIT_INTERVAL = 256
+
+    def __init__(
+        self,
+        name: str,
+        max_size: int = 1000,
+        persist_path: Optional[Path] = None,
+        fsync_policy: FsyncPolicy = FsyncPolicy.BATCHED,
+        spill_path: Optional[Path] = None,
+    ):
+        self.name = name
+        self.max_size = max_size
+        self.head = PersistentQueue(name, max_size, persist_path, fsync_policy)
+        self.spool: Optional[SegmentSpool] = None
+        if spill_path:
+            self.spool = SegmentSpool(spill_path, fsync_policy)
+        self.spilled_total = 0
+        self._uncommitted_reads = 0
+
+    async def put(self, message: StandardMessage, timeout: Optional[float] = None) -> None:
+        """
+        Add a message, spilling it to disk when the in-memory head is full.
+
+        Args:
+            message: Message to dead-letter
+            timeout: Seconds to wait for room in the head when spilling is
+                disabled (None = fail at once)
+
+        Raises:
+            QueueOverflowError: If the head is full and spilling is disabled
+        """
+        if self.spool is None:
+            await self.head.put(message, timeout)
+            return
 
-            _, _, message = heapq.heappop(self._queue)
+        if not self.spool:
+            try:
+                await self.head.put(message)
+                return
+            except QueueOverflowError:
+                pass
+        self._spill([message])
+
+    async def put_many(self, messages: List[StandardMessage]) -> List[Optional[Exception]]:
+        """
+        Add a batch of messages, spilling what doesn't fit in the head.
+
+        Returns:
+            Per-message error (None if stored), in input order
+        """
+        if self.spool is None:
+            return await self.head.put_many(messages)
+        if self.spool:
+            self._spill(messages)
+            return [None] * len(messages)
+
+        errors = await self.head.put_many(messages)
+        overflow = [message for message, error in zip(messages, errors) if error is not None]
+        self._spill(overflow)
+        return [None] * len(messages)
+
+    async def get(self) -> Optional[StandardMessage]:
+        """Get the next dead-lettered message (head first, then the spool)."""
+        message = await self.head.get()
+        if message is not None or not self.spool:
+            return message
+
+        messages = self._read_spool(1)
+        self._uncommitted_reads += len(messages)
+        if self._uncommitted_reads >= self.COMMIT_INTERVAL or not self.spool:
+            self._commit()
+        return messages[0] if messages else None
+
+    async def get_many(self, limit: int) -> List[StandardMessage]:
+        """
+        Get up to `limit` messages (head first, then the spool).
+
+        Spooled messages are committed as consumed before returning.
+        """
+        messages: List[StandardMessage] = []
+        while len(messages) < limit:
+            message = await self.head.get()
+            if message is None:
+                break
+            messages.append(message)
+
+        if len(messages) < limit and self.spool:
+            messages.extend(self._read_spool(limit - len(messages)))
+            self._commit()
+        return messages
+
+    async def ack(self, message: StandardMessage) -> None:
+        """Acknowledge a message handed out by get(); spooled ones were committed on read."""
+        await self.head.ack(message)
+
+    async def nack(self, message: StandardMessage) -> None:
+        """Return a message handed out by get() to the back of the queue."""
+        await self.requeue([message])
+
+    async def requeue(self, messages: List[StandardMessage]) -> None:
+        """
+        Return messages handed out by get() to the back of the queue (e.g. ones a replay skipped).
+
+        With a spool they are appended to it, behind everything already
+        queued, and their head copies are acked; otherwise they go back into
+        the head.
+        """
+        if self.spool is None:
+            for message in messages:
+                await self.head.nack(message)
+            return
+
+        self._spill(messages)
+        for message in messages:
+            await self.head.ack(message)
+
+    async def size(self) -> int:
+        """Get the number of dead-lettered messages, including spilled ones."""
+        return len(self)
+
+    async def wait_not_empty(self, timeout: Optional[float] = None) -> bool:
+        """Wait until a dead-lettered message is available."""
+        # Spilled messages can be read right away; otherwise wait for the head
+        return bool(self.spool) or await self.head.wait_not_empty(timeout)
+
+    def __len__(self) -> int:
+        return len(self.head) + (len(self.spool) if self.spool else 0)
+
+    @property
+    def spilled(self) -> int:
+        """Number of messages currently stored in the spool."""
+        return len(self.spool) if self.spool else 0
+
+    async def clear(self) -> None:
+        """Clear the head and the spool."""
+        await self.head.clear()
+        if self.spool:
+            self.spool.clear()
+        self._uncommitted_reads = 0
+
+    async def flush(self) -> None:
+        """Flush the head's log and the spool (including its read position) to disk."""
+        await self.head.flush()
+        if self.spool:
+            self._commit()
+            await self.spool.wait_synced()
+
+    async def close(self) -> None:
+        """Close the head's log and the spool, committing the spool's read position."""
+        await self.head.close()
+        if self.spool is not None:
+            self._uncommitted_reads = 0
+            self.spool.close()
+
+    def _spill(self, messages: List[StandardMessage]) -> None:
+        if not messages:
+            return
 
-            # Persist updated queue if enabled
-            if self.persist_path:
-                await self._persist_to_disk()
+        now = time.time()
+        self.spool.append_many(
+            [
+                (m.to_bytes(), int(m.priority), now, PersistentQueue._expires_at(m))
+                for m in messages
+            ],
+            PAYLOAD_BINARY,
+        )
+        self.spilled_total += len(messages)
 
-            return message
+    def _read_spool(self, limit: int) -> List[StandardMessage]:
+        """Read and decode spooled messages; an unreadable spool is set aside."""
+        try:
+            records = self.spool.read(limit)
+        except WALError:
+            # logger.exception("Dead letter spool is corrupt")
+            directory = self.spool.directory
+            self.spool.close()
+            directory.rename(directory.with_name(f"{directory.name}.corrupt-{int(time.time())}"))
+            self.spool = SegmentSpool(directory, self.spool.fsync_policy)
+            return []
+
+        messages = []
+        for record in records:
+            try:
+                messages.append(PersistentQueue._decode(record.payload, record.flags))
+            except Exception:
+                # logger.exception("Failed to decode spilled message", seq=record.seq)
+                pass
+        return messages
 
-    async def peek(self) -> Optional[StandardMessage]:
-        """Peek at highest priority message without removing."""
-        async with self._lock:
-            if not self._queue:
-                return None
-            return self._queue[0][2]
+    def _commit(self) -> None:
+        self.spool.commit()
+        self._uncommitted_reads = 0
 
-    async def size(self) -> int:
-        """Get current queue size."""
-        async with self._lock:
-            return len(self._queue)
 
-    async def clear(self) -> None:
-        """Clear all messages from queue."""
-        async with self._lock:
-            self._queue.clear()
-            if self.persist_path and self.persist_path.exists():
-                self.persist_path.unlink()
+class RetryScheduler:
+    """
+    Delay queue for messages waiting to be retried.
 
-    async def _persist_to_disk(self) -> None:
-        """Persist queue to disk."""
-        if not self.persist_path:
-            return
+    Messages sit in a heap keyed by due time; a single timer task sleeps until
+    the earliest one is due and hands it to ``release``. Scheduling never
+    blocks, so a failed delivery doesn't stall the dispatcher that saw it.
+    """
 
-        try:
-            # Create directory if needed
-            self.persist_path.parent.mkdir(parents=True, exist_ok=True)
+    def __init__(
+        self,
+        release: Callable[[StandardMessage], Awaitable[None]],
+        base_delay: float = 0.1,
+        max_delay: float = 30.0,
+        multiplier: float = 2.0,
+        jitter: float = 0.1,
+    ):
+        if base_delay < 0 or max_delay < base_delay:
+            raise ValueError("Retry delays must satisfy 0 <= base_delay <= max_delay")
+        if multiplier < 1:
+            raise ValueError("multiplier must be at least 1")
+        if not 0 <= jitter <= 1:
+            raise ValueError("jitter must be between 0 and 1")
+
+        self.release = release
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.jitter = jitter  # +/- fraction of the delay, spreads out retry bursts
+
+        # (due time on the loop clock, seq, message)
+        self._heap: List[Tuple[float, int, StandardMessage]] = []
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def backoff(self, retry_count: int) -> float:
+        """Get the delay before retry attempt ``retry_count`` (1-based)."""
+        delay = min(self.max_delay, self.base_delay * self.multiplier ** max(0, retry_count - 1))
+        if self.jitter:
+            delay *= 1 + random.uniform(-self.jitter, self.jitter)
+        return max(0.0, delay)
+
+    def schedule(self, message: StandardMessage, delay: Optional[float] = None) -> float:
+        """
+        Hold a message until its retry is due.
 
-            # Serialize messages
-            data = [(p, t, m.model_dump()) for p, t, m in self._queue]
+        Args:
+            message: Message to retry
+            delay: Seconds to wait (None = backoff for its retry count)
 
-            # Write atomically
-            temp_path = self.persist_path.with_suffix(".tmp")
-            with open(temp_path, "wb") as f:
-                pickle.dump(data, f)
-            temp_path.replace(self.persist_path)
+        Returns:
+            The delay applied, in seconds
+        """
+        if delay is None:
+            delay = self.backoff(message.retry_count)
+
+        entry = (asyncio.get_running_loop().time() + delay, next(self._seq), message)
+        heapq.heappush(self._heap, entry)
+        if self._heap[0] is entry:
+            # New earliest deadline; re-arm the timer
+            self._wakeup.set()
+        return delay
+
+    def start(self) -> None:
+        """Start the timer task."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> List[StandardMessage]:
+        """
+        Stop the timer task.
 
-        except Exception as e:
-            # logger.error(f"Failed to persist queue {self.name}: {str(e)}")
-            pass
+        Returns:
+            Messages that were still waiting, earliest due first
+        """
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
 
-    def _load_from_disk(self) -> None:
-        """Load queue from disk."""
-        if not self.persist_path or not self.persist_path.exists():
-            return
+        pending = [message for _, _, message in sorted(self._heap)]
+        self._heap.clear()
+        return pending
 
-        try:
-            with open(self.persist_path, "rb") as f:
-                data = pickle.load(f)
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
 
-            # Reconstruct messages
-            self._queue = []
-            for priority, timestamp, msg_data in data:
+        while True:
+            if not self._heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            remaining = self._heap[0][0] - loop.time()
+            if remaining > 0:
+                self._wakeup.clear()
                 try:
-                    message = create_message(msg_data)
-                    heapq.heappush(self._queue, (priority, timestamp, message))
-                except Exception as e:
-                    # logger.error(f"Failed to restore message: {str(e)}")
+                    await asyncio.wait_for(self._wakeup.wait(), remaining)
+                except asyncio.TimeoutError:
                     pass
+                continue
 
-        except Exception as e:
-            # logger.error(f"Failed to load queue {self.name} from disk: {str(e)}")
-            pass
+            _, _, message = heapq.heappop(self._heap)
+            try:
+                await self.release(message)
+            except Exception:
+                # logger.exception("Failed to re-queue message for retry", message_id=message.id)
+                pass
+
+
+def _as_utc(value: datetime) -> datetime:
+    """Treat naive datetimes as UTC so they compare with message timestamps."""
+    return value if value.tzinfo is not None else value.replace(tzinfo=timezone.utc)
+
+
+class ReplayProgress:
+    """Progress of a replay_dlq() run."""
+
+    def __init__(self, total: int):
+        self.total = total  # messages in the DLQ when the replay started
+        self.scanned = 0
+        self.replayed = 0
+        self.skipped = 0  # did not match the filters and stayed in the DLQ
+        self.failed = 0  # could not be republished and went back to the DLQ
+        self.elapsed = 0.0
+
+    @property
+    def rate(self) -> float:
+        """Messages replayed per second so far."""
+        return self.replayed / self.elapsed if self.elapsed else 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "total": self.total,
+            "scanned": self.scanned,
+            "replayed": self.replayed,
+            "skipped": self.skipped,
+            "failed": self.failed,
+            "elapsed": round(self.elapsed, 3),
+            "rate": round(self.rate, 1),
+        }
 
 
 class MessageBus:
@@ -223,10 +1614,16 @@ class MessageBus:
 
     Features:
     - Async pub/sub with topic and type filtering
-    - Priority queue processing
-    - Dead letter queue for failed messages
+    - Direct delivery of addressed messages to the recipient's subscription
+    - Priority lanes with strict or weighted dequeue
+    - Dead letter queue for failed messages, spilling to disk when full
     - Message persistence and replay
-    - Delivery guarantees with retry logic
+    - Delivery guarantees with non-blocking retry backoff
+    - Concurrent dispatch with optional per-recipient/correlation ordering
+    - Request/response with awaitable replies (request())
+    - Pluggable main queue transport (e.g. Redis Streams shared across processes)
+    - Optional process-pool delivery for CPU-bound sync subscribers
+    - Per-subscriber bounded mailboxes, so a slow subscriber only delays itself
     """
 
     def __init__(
@@ -235,28 +1632,94 @@ class MessageBus:
         max_dead_letter_size: int = 1000,
         persistence_dir: Optional[Path] = None,
         enable_persistence: bool = True,
+        fsync_policy: FsyncPolicy = FsyncPolicy.BATCHED,
+        dispatch_concurrency: int = 1,
+        ordering_key: Optional[str] = None,
+        dequeue_policy: DequeuePolicy = DequeuePolicy.STRICT,
+        lane_weights: Optional[Dict[int, int]] = None,
+        aging_interval: Optional[float] = None,
+        retry_base_delay: float = 0.1,
+        retry_max_delay: float = 30.0,
+        retry_backoff: float = 2.0,
+        retry_jitter: float = 0.1,
+        expiry_sweep_interval: float = 1.0,
+        expiry_batch_size: int = 1000,
+        sender_credits: Optional[int] = None,
+        dlq_spill: bool = True,
+        transport: Optional[QueueBackend] = None,
+        dead_letter_transport: Optional[QueueBackend] = None,
+        sync_workers: int = 4,
+        sync_max_pending: int = 100,
     ):
+        if dispatch_concurrency < 1:
+            raise ValueError("dispatch_concurrency must be at least 1")
+        if ordering_key not in (None, "recipient", "correlation_id"):
+            raise ValueError(f"Invalid ordering key: {ordering_key}")
+        if sender_credits is not None and sender_credits < 1:
+            raise ValueError("sender_credits must be at least 1")
+
         # Configuration
         self.max_queue_size = max_queue_size
         self.max_dead_letter_size = max_dead_letter_size
         self.persistence_dir = persistence_dir or Path("data/message_bus")
         self.enable_persistence = enable_persistence
+        self.fsync_policy = fsync_policy
+        self.dispatch_concurrency = dispatch_concurrency  # number of dispatcher workers
+        self.ordering_key = ordering_key  # messages sharing this attribute stay in order
+        self.expiry_sweep_interval = expiry_sweep_interval  # max seconds between expiry sweeps
+        self.expiry_batch_size = expiry_batch_size  # max messages evicted per sweep step
+        # Max queued messages per sender (None = no limit). Credits are returned
+        # when this bus takes a message off the main queue, so with a transport
+        # shared by several buses each sender should publish and consume
+        # through the same one.
+        self.sender_credits = sender_credits
+        self.sync_workers = sync_workers  # default threads per sync-callback pool
+        self.sync_max_pending = sync_max_pending  # default calls queued per pool beyond those
+
+        # Message queues (persisted as write-ahead log directories), unless another
+        # QueueBackend is given, e.g. core.message_transport.RedisStreamQueue
+        main_queue_path = self.persistence_dir / "main_queue" if enable_persistence else None
+        self.main_queue: QueueBackend
+        self._owns_main_queue = transport is None
+        self._owns_dead_letter_queue = dead_letter_transport is None
+        if transport is not None:
+            self.main_queue = transport
+        else:
+            self.main_queue = PersistentQueue(
+                "main",
+                max_queue_size,
+                main_queue_path,
+                fsync_policy,
+                policy=dequeue_policy,
+                lane_weights=lane_weights,
+                aging_interval=aging_interval,
+            )
+        self.dead_letter_queue: QueueBackend
+        if dead_letter_transport is not None:
+            self.dead_letter_queue = dead_letter_transport
+        else:
+            self.dead_letter_queue = DeadLetterQueue(
+                "dead_letter",
+                max_dead_letter_size,
+                self.persistence_dir / "dlq" if enable_persistence else None,
+                fsync_policy,
+                self.persistence_dir / "dlq_spill" if enable_persistence and dlq_spill else None,
+            )
 
-        # Message queues
-        self.main_queue = PersistentQueue(
-            "main",
-            max_queue_size,
-            self.persistence_dir / "main_queue.pkl" if enable_persistence else None,
-        )
-        self.dead_letter_queue = PersistentQueue(
-            "dead_letter",
-            max_dead_letter_size,
-            self.persistence_dir / "dlq.pkl" if enable_persistence else None,
+        # Failed deliveries wait here (off the dispatch path) until their retry is due
+        self.retry_scheduler = RetryScheduler(
+            self._requeue_retry,
+            base_delay=retry_base_delay,
+            max_delay=retry_max_delay,
+            multiplier=retry_backoff,
+            jitter=retry_jitter,
         )
 
         # Subscriptions
         self.subscriptions: Dict[str, MessageSubscription] = {}
+        self._subscription_index = SubscriptionIndex()
         self._subscription_lock = asyncio.Lock()
+        self._executors: Dict[str, CallbackExecutor] = {}  # sync callback pools by name
 
         # Metrics
         self.metrics = {
@@ -264,6 +1727,12 @@ class MessageBus:
             "messages_delivered": 0,
             "messages_failed": 0,
             "messages_dlq": 0,
+            "messages_retried": 0,
+            "messages_expired": 0,
+            "messages_dropped": 0,
+            "requests_sent": 0,
+            "requests_timed_out": 0,
+            "responses_resolved": 0,
             "delivery_errors": 0,
             "queue_overflows": 0,
             "avg_latency_ms": 0.0,
@@ -274,7 +1743,25 @@ class MessageBus:
 
         # Processing state
         self._running = False
-        self._process_task: Optional[asyncio.Task] = None
+        self._process_tasks: List[asyncio.Task] = []
+        self._idle_dispatchers: Set[asyncio.Task] = set()  # waiting for work, safe to cancel
+        self._expiry_task: Optional[asyncio.Task] = None
+
+        # Flow control: credits in use per sender, the senders holding credits
+        # for queued messages by message id (ids need not be unique), and
+        # producers waiting for a credit
+        self._credits_used: Dict[str, int] = defaultdict(int)
+        self._credit_holders: Dict[str, List[str]] = {}
+        self._credit_waiters: Dict[str, CapacityWaiters] = {}
+
+        # Request id -> future awaiting its AgentResponse (see request())
+        self._pending_requests: Dict[str, asyncio.Future] = {}
+
+        # Ordering key -> messages waiting behind the in-flight one for that key
+        self._inflight_keys: Dict[str, deque] = {}
+
+        # id(message) -> dispatches of failed attempts, released once the retry is re-queued
+        self._retry_holds: Dict[int, List[_Delivery]] = {}
 
         # Persistence
         if enable_persistence:
@@ -286,35 +1773,94 @@ class MessageBus:
             return
 
         self._running = True
-        self._process_task = asyncio.create_task(self._process_messages())
+        self.retry_scheduler.start()
+        for subscription in self.subscriptions.values():
+            self._start_mailbox(subscription)
+            self._start_process_pool(subscription)
+        self._process_tasks = [
+            asyncio.create_task(self._process_messages()) for _ in range(self.dispatch_concurrency)
+        ]
+        self._expiry_task = asyncio.create_task(self._sweep_expired())
         # logger.info("Message bus started")
 
-    async def stop(self) -> None:
-        """Stop the message bus processing."""
-        self._running = False
+    async def stop(self, timeout: float = 5.0) -> None:
+        """
+        Stop the message bus processing.
 
-        if self._process_task:
-            self._process_task.cancel()
-            try:
-                await self._process_task
-            except asyncio.CancelledError:
-                pass
+        Dispatchers finish the message they hold and mailboxes are delivered
+        within `timeout` seconds. Messages whose delivery is cut short then
+        go to the DLQ; messages never taken stay in the main queue.
 
-        # Persist final state
+        Args:
+            timeout: Seconds to wait for in-progress deliveries
+        """
+        self._running = False
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+
+        if self._expiry_task:
+            self._expiry_task.cancel()
+            await asyncio.gather(self._expiry_task, return_exceptions=True)
+            self._expiry_task = None
+
+        # Dispatchers waiting for work stop now; the others may be blocked on a full
+        # mailbox, which the consumers below keep draining
+        tasks, self._process_tasks = self._process_tasks, []
+        for task in self._idle_dispatchers:
+            task.cancel()
+        if tasks:
+            _, pending = await asyncio.wait(tasks, timeout=timeout)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        # Deliver what is still in the mailboxes (side by side, so one stuck subscriber
+        # costs one timeout), then let worker processes finish what they were handed;
+        # failures may schedule retries
+        subscriptions = list(self.subscriptions.values())
+        remaining = max(0.0, deadline - loop.time())
+        await asyncio.gather(*(self._stop_mailbox(s, remaining) for s in subscriptions))
+        for subscription in subscriptions:
+            await self._stop_process_pool(subscription)
+
+        # Put messages still waiting out their backoff back in the queue so they persist
+        for message in await self.retry_scheduler.stop():
+            await self._requeue_retry(message)
+
+        # Nothing will answer requests still in flight
+        for future in self._pending_requests.values():
+            if not future.done():
+                future.set_exception(MessageBusError("Message bus stopped"))
+        self._pending_requests.clear()
+
+        # Persist final state. Queues the bus created are closed (their logs reopen
+        # on the next start()); transports passed in belong to the caller
+        await (self.main_queue.close() if self._owns_main_queue else self.main_queue.flush())
+        await (
+            self.dead_letter_queue.close()
+            if self._owns_dead_letter_queue
+            else self.dead_letter_queue.flush()
+        )
         await self._persist_metrics()
 
         # logger.info("Message bus stopped")
 
-    async def publish(self, message: StandardMessage, validate: bool = True) -> None:
+    async def publish(
+        self, message: StandardMessage, validate: bool = True, timeout: Optional[float] = None
+    ) -> None:
         """
         Publish a message to the bus.
 
         Args:
             message: Message to publish
             validate: Whether to validate message before publishing
+            timeout: Seconds to wait for queue capacity (and, with sender_credits,
+                for a credit) before giving up; producers are served in FIFO
+                order (None = fail immediately when full)
 
         Raises:
             MessageCorruptionError: If message validation fails
+            FlowControlError: If the sender has no credits left
             QueueOverflowError: If queue is full
         """
         start_time = time.time()
@@ -326,8 +1872,25 @@ class MessageBus:
                 if errors:
                     raise MessageCorruptionError(f"Message validation failed: {', '.join(errors)}")
 
-            # Add to queue
-            await self.main_queue.put(message)
+            # Responses to request() go straight to the waiting caller
+            if (
+                self._pending_requests
+                and isinstance(message, AgentResponse)
+                and self._resolve_response(message)
+            ):
+                return
+
+            # Add to queue, waiting out backpressure within a single deadline
+            if self.sender_credits is not None:
+                await self._acquire_credit(message, timeout)
+            try:
+                remaining = None
+                if timeout is not None:
+                    remaining = max(0.0, timeout - (time.time() - start_time))
+                await self.main_queue.put(message, remaining)
+            except BaseException:
+                self._release_credit(message)
+                raise
 
             # Update metrics
             self.metrics["messages_published"] += 1
@@ -354,6 +1917,188 @@ class MessageBus:
             latency_ms = (time.time() - start_time) * 1000
             self._latency_samples.append(latency_ms)
 
+    async def publish_many(
+        self, messages: List[StandardMessage], validate: bool = True
+    ) -> List[Optional[MessageBusError]]:
+        """
+        Publish a batch of messages to the bus.
+
+        Messages are validated up front and enqueued with a single queue
+        operation (one lock acquisition and one log write). Validation and
+        encoding are still per message, so the saving over publish() is the
+        per-call overhead only. A failing message does not abort the rest of
+        the batch.
+
+        Args:
+            messages: Messages to publish
+            validate: Whether to validate messages before publishing
+
+        Returns:
+            Per-message error (None if published), in input order:
+            MessageCorruptionError for invalid messages, QueueOverflowError
+            for messages that did not fit in the queue, FlowControlError for
+            messages whose sender had no credits left
+        """
+        start_time = time.time()
+        results: List[Optional[MessageBusError]] = [None] * len(messages)
+
+        # Validate in bulk
+        valid_indexes = []
+        for index, message in enumerate(messages):
+            if validate:
+                errors = MessageValidator.validate_message(message)
+                if errors:
+                    results[index] = MessageCorruptionError(
+                        f"Message validation failed: {', '.join(errors)}"
+                    )
+                    continue
+            valid_indexes.append(index)
+
+        # Responses to request() go straight to the waiting caller
+        if self._pending_requests:
+            valid_indexes = [
+                index
+                for index in valid_indexes
+                if not (
+                    isinstance(messages[index], AgentResponse)
+                    and self._resolve_response(messages[index])
+                )
+            ]
+
+        # Take sender credits; batches never wait for them
+        if self.sender_credits is not None:
+            credited = []
+            for index in valid_indexes:
+                if self._try_acquire_credit(messages[index]):
+                    credited.append(index)
+                else:
+                    sender = messages[index].sender
+                    results[index] = FlowControlError(
+                        f"Sender {sender} has no credits left ({self.sender_credits})"
+                    )
+                    self.metrics["queue_overflows"] += 1
+            valid_indexes = credited
+
+        # Enqueue valid messages in one operation
+        queue_errors = await self.main_queue.put_many([messages[i] for i in valid_indexes])
+        published = 0
+        for index, error in zip(valid_indexes, queue_errors):
+            if error is None:
+                published += 1
+            else:
+                results[index] = error
+                self._release_credit(messages[index])
+                self.metrics["queue_overflows"] += 1
+
+        # Update metrics
+        if published:
+            self.metrics["messages_published"] += published
+            now = time.time()
+            self._throughput_window.extend([now] * published)
+            self._latency_samples.append((now - start_time) * 1000 / published)
+
+        return results
+
+    async def request(
+        self, request: AgentRequest, timeout: Optional[float] = None
+    ) -> AgentResponse:
+        """
+        Publish a request and wait for its response.
+
+        The response is the AgentResponse published with ``request_id`` set to
+        the request's id. It resolves this call directly and is not delivered
+        to subscribers.
+
+        The waiting call lives in this process: with a transport shared by
+        several processes, a response dispatched by another process is
+        delivered to that process's subscribers instead, and this call times
+        out. Responses for request() should go through a queue only this
+        process consumes.
+
+        Args:
+            request: Request to send (must require a response)
+            timeout: Seconds to wait for the response (None = request.timeout)
+
+        Returns:
+            The response
+
+        Raises:
+            RequestTimeoutError: If no response arrives in time
+            DeliveryError: If the request was dead-lettered
+            MessageBusError: If the request could not be published
+        """
+        if not request.requires_response:
+            raise ValueError("request() needs a request with requires_response=True")
+        if request.id in self._pending_requests:
+            raise ValueError(f"Request {request.id} is already awaiting a response")
+
+        timeout = request.timeout if timeout is None else timeout
+        future = asyncio.get_running_loop().create_future()
+        self._pending_requests[request.id] = future
+        try:
+            await self.publish(request)
+            self.metrics["requests_sent"] += 1
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            self.metrics["requests_timed_out"] += 1
+            raise RequestTimeoutError(
+                f"No response to request {request.id} within {timeout:g}s"
+            ) from None
+        finally:
+            self._pending_requests.pop(request.id, None)
+
+    def _resolve_response(self, response: AgentResponse) -> bool:
+        """Hand a response to the request() call waiting for it, if there is one."""
+        future = self._pending_requests.pop(response.request_id, None)
+        if future is None or future.done():
+            return False
+
+        future.set_result(response)
+        self.metrics["responses_resolved"] += 1
+        return True
+
+    async def _acquire_credit(self, message: StandardMessage, timeout: Optional[float]) -> None:
+        """Take a publish credit for the message's sender, waiting up to `timeout`."""
+        sender = message.sender
+        if self._credits_used[sender] >= self.sender_credits or self._credit_waiters.get(sender):
+            waiters = self._credit_waiters.setdefault(sender, CapacityWaiters())
+            if timeout is None or not await waiters.wait(
+                lambda: self._credits_used[sender] < self.sender_credits, timeout
+            ):
+                raise FlowControlError(
+                    f"Sender {sender} has no credits left ({self.sender_credits})"
+                )
+
+        self._credits_used[sender] += 1
+        self._credit_holders.setdefault(message.id, []).append(sender)
+
+    def _try_acquire_credit(self, message: StandardMessage) -> bool:
+        """Take a publish credit for the message's sender if one is free right now."""
+        sender = message.sender
+        if self._credits_used[sender] >= self.sender_credits or self._credit_waiters.get(sender):
+            return False
+        self._credits_used[sender] += 1
+        self._credit_holders.setdefault(message.id, []).append(sender)
+        return True
+
+    def _release_credit(self, message: StandardMessage) -> None:
+        """Return the publish credit held by a message, if any."""
+        holders = self._credit_holders.get(message.id)
+        if not holders:
+            return
+        # Prefer the message's own sender among messages sharing its id
+        sender = message.sender if message.sender in holders else holders[-1]
+        holders.remove(sender)
+        if not holders:
+            del self._credit_holders[message.id]
+
+        self._credits_used[sender] -= 1
+        if not self._credits_used[sender]:
+            del self._credits_used[sender]
+        waiters = self._credit_waiters.get(sender)
+        if waiters:
+            waiters.wake()
+
     async def subscribe(
         self,
         subscriber_id: str,
@@ -361,17 +2106,69 @@ class MessageBus:
         topics: Optional[List[str]] = None,
         message_types: Optional[List[str]] = None,
         priority_threshold: Optional[MessagePriority] = None,
+        max_batch: Optional[int] = None,
+        max_wait_ms: float = 50.0,
+        max_pending: int = 1000,
+        process_workers: Optional[int] = None,
+        ring_size: int = 1 << 20,
+        executor: Optional[str] = None,
+        sync_workers: Optional[int] = None,
+        sync_max_pending: Optional[int] = None,
+        overflow: Union[OverflowPolicy, str] = OverflowPolicy.BLOCK,
+        concurrency: int = 1,
     ) -> None:
         """
         Subscribe to messages.
 
+        Messages addressed to `subscriber_id` are delivered directly and bypass
+        the topic, type and priority filters, which apply to broadcasts only.
+
+        Dispatch only leaves messages in the subscriber's mailbox; the
+        subscriber's own consumer tasks run the callback, so a slow subscriber
+        delays nobody else until its mailbox is full (see `overflow`). A
+        failed callback retries an addressed message; a broadcast is
+        dead-lettered, since the other subscribers already have it.
+
         Args:
             subscriber_id: Unique subscriber identifier
-            callback: Async callback function to handle messages
+            callback: Callback to handle messages; async callbacks run on the
+                event loop, sync ones on a thread pool (see `executor`)
             topics: List of topics to subscribe to (None = all)
             message_types: List of message types to receive (None = all)
             priority_threshold: Only receive messages at or above this priority
+            max_batch: Deliver lists of up to this many messages (None = one at a time)
+            max_wait_ms: Maximum time to wait for a batch to fill before delivering it
+            max_pending: Maximum messages waiting in the subscriber's mailbox
+            process_workers: Run a sync, module-level callback in this many
+                worker processes (None = on the event loop or its thread pool);
+                for CPU-bound subscribers
+            ring_size: Bytes of shared memory per worker process holding messages
+                on their way to it; the consumer waits for space when all are full
+            executor: Name of a thread pool to share with other sync subscribers
+                of the same kind (None = a pool of its own, named after
+                subscriber_id); the first subscription to use a name sizes it
+            sync_workers: Threads in the pool (None = the bus's sync_workers)
+            sync_max_pending: Calls that may wait for a thread before the
+                consumer waits too (None = the bus's sync_max_pending)
+            overflow: What dispatch does when the mailbox is full: wait for room
+                ("block"), discard the oldest waiting message ("drop_oldest") or
+                dead-letter the new one ("dead_letter")
+            concurrency: Consumer tasks delivering from the mailbox; above 1,
+                callbacks overlap and messages may complete out of order
         """
+        overflow = OverflowPolicy(overflow)
+        if max_pending < 1:
+            raise ValueError("max_pending must be at least 1")
+        if concurrency < 1:
+            raise ValueError("concurrency must be at least 1")
+        if process_workers is not None:
+            if process_workers < 1:
+                raise ValueError("process_workers must be at least 1")
+            if _is_async_callable(callback):
+                raise ValueError("process_workers requires a sync callback")
+            if max_batch:
+                raise ValueError("process_workers does not apply to batch subscriptions")
+
         async with self._subscription_lock:
             subscription = MessageSubscription(
                 subscriber_id=subscriber_id,
@@ -379,9 +2176,31 @@ class MessageBus:
                 topics=set(topics) if topics else None,
                 message_types=set(message_types) if message_types else None,
                 priority_threshold=priority_threshold,
+                max_batch=max_batch,
+                max_wait_ms=max_wait_ms,
+                max_pending=max_pending,
+                process_workers=process_workers,
+                ring_size=ring_size,
+                overflow=overflow,
+                concurrency=concurrency,
             )
+            if not subscription.is_async and subscription.process_pool is None:
+                subscription.executor = self._acquire_executor(
+                    executor or subscriber_id, sync_workers, sync_max_pending
+                )
+
+            previous = self.subscriptions.get(subscriber_id)
+            if previous is not None:
+                previous.is_active = False
+                self._subscription_index.remove(previous)
+                await self._stop_mailbox(previous)
+                await self._stop_process_pool(previous)
+                self._release_executor(previous)
 
             self.subscriptions[subscriber_id] = subscription
+            self._subscription_index.add(subscription)
+            self._start_mailbox(subscription)
+            self._start_process_pool(subscription)
 
             # logger.info(
             #     "Subscriber registered",
@@ -394,111 +2213,494 @@ class MessageBus:
         """Unsubscribe from messages."""
         async with self._subscription_lock:
             if subscriber_id in self.subscriptions:
-                self.subscriptions[subscriber_id].is_active = False
-                del self.subscriptions[subscriber_id]
+                subscription = self.subscriptions.pop(subscriber_id)
+                subscription.is_active = False
+                self._subscription_index.remove(subscription)
+                await self._stop_mailbox(subscription)
+                await self._stop_process_pool(subscription)
+                self._release_executor(subscription)
                 # logger.info("Subscriber unregistered", subscriber_id=subscriber_id)
 
+    def _acquire_executor(
+        self, name: str, workers: Optional[int], max_pending: Optional[int]
+    ) -> CallbackExecutor:
+        """Get the named sync-callback pool, creating it on first use."""
+        pool = self._executors.get(name)
+        if pool is None:
+            pool = self._executors[name] = CallbackExecutor(
+                name,
+                workers if workers is not None else self.sync_workers,
+                max_pending if max_pending is not None else self.sync_max_pending,
+            )
+        pool.subscribers += 1
+        return pool
+
+    def _release_executor(self, subscription: MessageSubscription) -> None:
+        """Drop a subscription's use of its pool, shutting the pool down when unused."""
+        pool, subscription.executor = subscription.executor, None
+        if pool is None:
+            return
+        pool.subscribers -= 1
+        if pool.subscribers <= 0:
+            del self._executors[pool.name]
+            pool.shutdown()
+
     async def _process_messages(self) -> None:
-        """Main message processing loop."""
+        """Dispatcher worker loop; several may run concurrently."""
         # logger.info("Message processing started")
 
+        task = asyncio.current_task()
         while self._running:
             try:
-                # Get next message
-                message = await self.main_queue.get()
+                # Block until work arrives instead of polling; stop() cancels idle workers
+                self._idle_dispatchers.add(task)
+                try:
+                    await self.main_queue.wait_not_empty()
+                    message = await self.main_queue.get()
+                finally:
+                    self._idle_dispatchers.discard(task)
 
                 if message is None:
-                    # No messages, wait a bit
-                    await asyncio.sleep(0.001)  # 1ms
                     continue
+                if self._credit_holders:
+                    self._release_credit(message)
 
-                # Check if expired
-                if message.is_expired():
-                    # logger.warning("Message expired", message_id=message.id)
-                    await self._send_to_dlq(message, "expired")
+                key = self._get_ordering_key(message)
+                if key is None:
+                    await self._dispatch(message)
                     continue
 
-                # Process message
-                await self._deliver_message(message)
+                # Another worker is dispatching this key; it will pick this up in order
+                backlog = self._inflight_keys.get(key)
+                if backlog is not None:
+                    backlog.append(message)
+                    continue
 
-                # Update throughput metric
-                self._update_throughput()
+                await self._dispatch_ordered(key, message)
 
             except Exception as e:
                 # logger.error(f"Error in message processing loop: {str(e)}")
                 await asyncio.sleep(0.1)  # Back off on error
 
-    async def _deliver_message(self, message: StandardMessage) -> None:
-        """Deliver message to matching subscribers."""
-        start_time = time.time()
-        delivered_count = 0
+    async def _sweep_expired(self) -> None:
+        """Evict expired messages from the main queue to the DLQ ahead of dispatch."""
+        while self._running:
+            try:
+                now = time.time()
+                next_expiry = self.main_queue.next_expiry()
+                if next_expiry is None or next_expiry > now:
+                    delay = self.expiry_sweep_interval
+                    if next_expiry is not None:
+                        delay = min(delay, next_expiry - now)
+                    await asyncio.sleep(delay)
+                    continue
 
-        # Find matching subscribers
-        matching_subs = []
-        async with self._subscription_lock:
-            for sub in self.subscriptions.values():
-                if sub.matches(message):
-                    matching_subs.append(sub)
-
-        # If no subscribers and message has specific recipient, it's an error
-        if not matching_subs and message.recipient:
-            await self._handle_delivery_failure(
-                message, f"No subscriber found for recipient: {message.recipient}"
-            )
+                expired = await self.main_queue.evict_expired(now, self.expiry_batch_size)
+                for message in expired:
+                    self._release_credit(message)
+                    await self._send_to_dlq(message, "expired")
+                    await self.main_queue.ack(message)
+                self.metrics["messages_expired"] += len(expired)
+                await asyncio.sleep(0)  # let dispatch run between batches
+
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # logger.exception("Error in expiry sweep")
+                await asyncio.sleep(self.expiry_sweep_interval)
+
+    def _get_ordering_key(self, message: StandardMessage) -> Optional[str]:
+        """Get the ordering key of a message, if ordered dispatch is enabled."""
+        if self.ordering_key is None:
+            return None
+        return getattr(message, self.ordering_key)
+
+    async def _dispatch_ordered(self, key: str, message: StandardMessage) -> None:
+        """Dispatch a message and then every message queued behind it for the same key."""
+        backlog: deque = deque()
+        self._inflight_keys[key] = backlog
+        try:
+            await self._dispatch(message)
+            while backlog:
+                await self._dispatch(backlog.popleft())
+        finally:
+            del self._inflight_keys[key]
+            # Return undispatched messages (e.g. on shutdown) to the queue
+            for pending in backlog:
+                await self.main_queue.nack(pending)
+
+    async def _dispatch(self, message: StandardMessage) -> None:
+        """Expire or deliver a single message."""
+        delivery = _Delivery(message)
+        try:
+            # Check if expired
+            # Catches messages that expired since the last sweep
+            if message.is_expired():
+                # logger.warning("Message expired", message_id=message.id)
+                await self._send_to_dlq(message, "expired")
+                self.metrics["messages_expired"] += 1
+            else:
+                # Process message
+                await self._deliver_message(message, delivery)
+
+                # Update throughput metric
+                self._update_throughput()
+
+        except Exception:
+            # logger.exception("Error dispatching message", message_id=message.id)
+            pass
+
+        finally:
+            # Mailbox copies still hold the message until their callbacks ran
+            await self._release_delivery(delivery)
+
+    async def _release_delivery(self, delivery: _Delivery) -> None:
+        """Release a hold on a dispatched message, acking it when none are left."""
+        delivery.holds -= 1
+        if delivery.holds:
+            return
+
+        # Delivered, scheduled for retry or dead-lettered; a transport may now drop it
+        try:
+            await self.main_queue.ack(delivery.message)
+        except Exception:
+            # logger.exception("Failed to acknowledge message", message_id=delivery.message.id)
+            pass
+
+    async def _deliver_message(self, message: StandardMessage, delivery: _Delivery) -> None:
+        """Leave a message in the mailbox of its recipient or of each matching subscriber."""
+        # Point-to-point: the recipient's subscription is its mailbox
+        if message.recipient:
+            subscription = self.subscriptions.get(message.recipient)
+            if subscription is None or not subscription.is_active:
+                await self._handle_delivery_failure(
+                    message, f"No subscriber found for recipient: {message.recipient}", delivery
+                )
+                return
+
+            await self._post(subscription, message, delivery)
+            return
+
+        # Broadcast: find matching subscribers (index lookups don't yield, so no lock needed)
+        matching_subs = self._subscription_index.match(message)
+        if not matching_subs:
+            await self._handle_delivery_failure(message, "No successful deliveries", delivery)
             return
 
-        # Deliver to each matching subscriber
-        delivery_tasks = []
         for sub in matching_subs:
-            task = asyncio.create_task(self._deliver_to_subscriber(message, sub))
-            delivery_tasks.append(task)
-
-        # Wait for all deliveries
-        if delivery_tasks:
-            results = await asyncio.gather(*delivery_tasks, return_exceptions=True)
-
-            # Count successful deliveries
-            for i, result in enumerate(results):
-                if isinstance(result, Exception):
-                    # logger.error(
-                    #     f"Delivery failed to {matching_subs[i].subscriber_id}: {str(result)}"
-                    # )
-                    pass
-                else:
-                    delivered_count += 1
+            await self._post(sub, message, delivery)
 
-        # Update metrics
-        if delivered_count > 0:
-            self.metrics["messages_delivered"] += delivered_count
-            latency_ms = (time.time() - start_time) * 1000
-            self._latency_samples.append(latency_ms)
-            self._update_avg_latency()
-        else:
-            # No successful deliveries
-            await self._handle_delivery_failure(message, "No successful deliveries")
+    async def _post(
+        self, subscription: MessageSubscription, message: StandardMessage, delivery: _Delivery
+    ) -> None:
+        """Put a message in a subscriber's mailbox, applying its overflow policy when full."""
+        mailbox = subscription.mailbox
+        entry = (time.time(), message, delivery)
+        if not mailbox.full():
+            mailbox.put_nowait(entry)
+            delivery.holds += 1
+            return
+
+        if subscription.overflow is OverflowPolicy.BLOCK:
+            try:
+                await mailbox.put(entry)
+            except asyncio.CancelledError:
+                # stop() gave up waiting for room
+                await self._abandon(subscription, [entry])
+                raise
+            delivery.holds += 1
+            return
+
+        subscription.overflow_count += 1
+        if subscription.overflow is OverflowPolicy.DEAD_LETTER:
+            await self._send_to_dlq(message, f"Mailbox full: {subscription.subscriber_id}")
+            return
+
+        # DROP_OLDEST
+        dropped = mailbox.get_nowait()
+        mailbox.put_nowait(entry)
+        delivery.holds += 1
+        if dropped is None:
+            # A consumer's stop sentinel; keep it behind the new message
+            await mailbox.put(None)
+            return
+        self.metrics["messages_dropped"] += 1
+        self._fail_pending_request(
+            dropped[1], f"Request dropped: mailbox of {subscription.subscriber_id} full"
+        )
+        await self._release_delivery(dropped[2])
+        # logger.warning(
+        #     "Dropped message from full mailbox",
+        #     message_id=dropped[1].id,
+        #     subscriber_id=subscription.subscriber_id,
+        # )
+
+    def _start_mailbox(self, subscription: MessageSubscription) -> None:
+        """Start the consumer tasks of a subscription's mailbox."""
+        if not subscription.consumer_tasks:
+            subscription.consumer_tasks = [
+                asyncio.create_task(self._run_mailbox(subscription))
+                for _ in range(subscription.concurrency)
+            ]
+
+    async def _stop_mailbox(self, subscription: MessageSubscription, timeout: float = 5.0) -> None:
+        """Stop a subscription's consumers after they deliver what is in its mailbox."""
+        if not subscription.consumer_tasks:
+            return
+
+        # A callback unsubscribing or replacing its own subscription runs in one of the
+        # consumers; that one can't wait for itself and, taken off the list, exits when
+        # the callback returns. The others keep consuming until their sentinel
+        current = asyncio.current_task()
+        tasks = [task for task in subscription.consumer_tasks if task is not current]
+        subscription.consumer_tasks = tasks
+
+        async def drain() -> None:
+            # One sentinel per consumer, behind the messages already waiting
+            for _ in tasks:
+                await subscription.mailbox.put(None)
+            await asyncio.wait(tasks)
+
+        if tasks:
+            try:
+                await asyncio.wait_for(drain(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        subscription.consumer_tasks = []
+
+        # Whatever the consumers didn't get to is kept for replay
+        mailbox = subscription.mailbox
+        while not mailbox.empty():
+            entry = mailbox.get_nowait()
+            if entry is not None:
+                await self._abandon(subscription, [entry])
+                await self._release_delivery(entry[2])
+
+    async def _abandon(
+        self,
+        subscription: MessageSubscription,
+        entries: List[Tuple[float, StandardMessage, _Delivery]],
+    ) -> None:
+        """Dead-letter mailbox entries a stopping subscriber won't deliver (the caller releases)."""
+        for _, message, _ in entries:
+            await self._send_to_dlq(message, f"Subscriber stopped: {subscription.subscriber_id}")
+
+    async def _run_mailbox(self, subscription: MessageSubscription) -> None:
+        """Consumer loop: deliver a subscription's messages one by one or as batches."""
+        mailbox = subscription.mailbox
+        loop = asyncio.get_running_loop()
+        task = asyncio.current_task()
+        stopping = False
+
+        # _stop_mailbox() takes the consumer off the list if its own callback stopped it
+        while not stopping and task in subscription.consumer_tasks:
+            entry = await mailbox.get()
+            if entry is None:
+                break
+
+            try:
+                if not subscription.is_batch:
+                    await self._deliver_to_subscriber(subscription, *entry)
+                    continue
+
+                batch = [entry]
+                deadline = loop.time() + subscription.max_wait_ms / 1000
+                while len(batch) < subscription.max_batch:
+                    try:
+                        entry = mailbox.get_nowait()
+                    except asyncio.QueueEmpty:
+                        remaining = deadline - loop.time()
+                        if remaining <= 0:
+                            break
+                        try:
+                            entry = await asyncio.wait_for(mailbox.get(), remaining)
+                        except asyncio.TimeoutError:
+                            break
+                        except asyncio.CancelledError:
+                            # Stopped while collecting; the batch was taken off the mailbox
+                            await self._abandon(subscription, batch)
+                            for _, _, delivery in batch:
+                                await self._release_delivery(delivery)
+                            raise
+
+                    if entry is None:
+                        stopping = True
+                        break
+                    batch.append(entry)
+
+                await self._deliver_batch(subscription, batch)
+
+            except Exception:
+                # logger.exception(
+                #     "Error in mailbox consumer", subscriber_id=subscription.subscriber_id
+                # )
+                pass
 
     async def _deliver_to_subscriber(
-        self, message: StandardMessage, subscription: MessageSubscription
+        self,
+        subscription: MessageSubscription,
+        enqueued_at: float,
+        message: StandardMessage,
+        delivery: _Delivery,
     ) -> None:
-        """Deliver message to a single subscriber."""
+        """Deliver a message from a subscription's mailbox to its callback."""
         try:
-            # Call the callback
-            if asyncio.iscoroutinefunction(subscription.callback):
+            if subscription.process_pool is not None:
+                # Hand off to the worker processes; waits when their rings are full.
+                # Their outcomes are recorded by _record_process_results()
+                await subscription.process_pool.submit(message)
+                subscription.process_deliveries.setdefault(id(message), []).append(delivery)
+                return
+
+            if subscription.is_async:
                 await subscription.callback(message)
             else:
-                # Run sync callback in executor
-                await asyncio.get_event_loop().run_in_executor(None, subscription.callback, message)
+                # Run sync callback on its own bounded thread pool
+                await subscription.executor.run(subscription.callback, message)
 
-            # Update subscription metrics
-            subscription.message_count += 1
-            subscription.last_message_time = datetime.now(timezone.utc)
+        except asyncio.CancelledError:
+            # stop() gave up on the callback; it may not have finished
+            await self._abandon(subscription, [(enqueued_at, message, delivery)])
+            await self._release_delivery(delivery)
+            raise
+
+        except Exception as e:
+            subscription.error_count += 1
+            self.metrics["delivery_errors"] += 1
+            await self._handle_subscriber_failure(message, f"Callback error: {str(e)}", delivery)
+            await self._release_delivery(delivery)
+            return
+
+        # Update subscription metrics
+        subscription.message_count += 1
+        subscription.last_message_time = datetime.now(timezone.utc)
+        self.metrics["messages_delivered"] += 1
+        self._latency_samples.append((time.time() - enqueued_at) * 1000)
+        self._update_avg_latency()
+        await self._release_delivery(delivery)
+
+    async def _deliver_batch(
+        self,
+        subscription: MessageSubscription,
+        batch: List[Tuple[float, StandardMessage, _Delivery]],
+    ) -> None:
+        """Invoke a batch subscriber's callback with a list of messages."""
+        messages = [message for _, message, _ in batch]
+        try:
+            if subscription.is_async:
+                await subscription.callback(messages)
+            else:
+                await subscription.executor.run(subscription.callback, messages)
+
+        except asyncio.CancelledError:
+            await self._abandon(subscription, batch)
+            for _, _, delivery in batch:
+                await self._release_delivery(delivery)
+            raise
 
         except Exception as e:
             subscription.error_count += 1
-            raise DeliveryError(f"Callback error: {str(e)}")
+            self.metrics["delivery_errors"] += 1
+            for _, message, delivery in batch:
+                await self._handle_subscriber_failure(
+                    message, f"Batch callback error: {str(e)}", delivery
+                )
+            for _, _, delivery in batch:
+                await self._release_delivery(delivery)
+            return
 
-    async def _handle_delivery_failure(self, message: StandardMessage, reason: str) -> None:
-        """Handle failed message delivery."""
+        subscription.message_count += len(messages)
+        subscription.batch_count += 1
+        subscription.last_message_time = datetime.now(timezone.utc)
+        self.metrics["messages_delivered"] += len(messages)
+        now = time.time()
+        self._latency_samples.extend((now - enqueued_at) * 1000 for enqueued_at, _, _ in batch)
+        self._update_avg_latency()
+        for _, _, delivery in batch:
+            await self._release_delivery(delivery)
+
+    def _start_process_pool(self, subscription: MessageSubscription) -> None:
+        """Start the worker processes of a process-delivery subscription."""
+        pool = subscription.process_pool
+        if pool is not None and not pool.running:
+            pool.start()
+            subscription.process_task = asyncio.create_task(self._run_process_results(subscription))
+
+    async def _stop_process_pool(
+        self, subscription: MessageSubscription, timeout: float = 5.0
+    ) -> None:
+        """Stop a subscription's worker processes after they finish the messages handed to them."""
+        pool = subscription.process_pool
+        if pool is None or not pool.running:
+            return
+
+        task, subscription.process_task = subscription.process_task, None
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        await self._record_process_results(subscription, await pool.stop(timeout))
+
+    async def _run_process_results(self, subscription: MessageSubscription) -> None:
+        """Record the outcomes reported by a subscription's worker processes."""
+        while True:
+            await self._record_process_results(
+                subscription, await subscription.process_pool.completed()
+            )
+
+    async def _record_process_results(
+        self,
+        subscription: MessageSubscription,
+        results: List[Tuple[StandardMessage, Optional[str]]],
+    ) -> None:
+        """Update metrics for delivered messages and retry or dead-letter failed ones."""
+        for message, error in results:
+            delivery = None
+            deliveries = subscription.process_deliveries.get(id(message))
+            if deliveries:
+                delivery = deliveries.pop(0)
+                if not deliveries:
+                    del subscription.process_deliveries[id(message)]
+
+            if error is None:
+                subscription.message_count += 1
+                self.metrics["messages_delivered"] += 1
+            else:
+                subscription.error_count += 1
+                self.metrics["delivery_errors"] += 1
+                await self._handle_subscriber_failure(
+                    message, f"Process callback error: {error}", delivery
+                )
+
+            if delivery is not None:
+                await self._release_delivery(delivery)
+
+        if results:
+            subscription.last_message_time = datetime.now(timezone.utc)
+
+    async def _handle_subscriber_failure(
+        self, message: StandardMessage, reason: str, delivery: Optional[_Delivery] = None
+    ) -> None:
+        """Retry a message whose callback failed, or dead-letter it if it was a broadcast."""
+        if message.recipient:
+            # Only this subscriber receives it, so a retry redelivers to it alone
+            await self._handle_delivery_failure(message, reason, delivery)
+        else:
+            # Other subscribers already have it; re-queueing would redeliver to them
+            await self._send_to_dlq(message, reason)
+
+    async def _handle_delivery_failure(
+        self, message: StandardMessage, reason: str, delivery: Optional[_Delivery] = None
+    ) -> None:
+        """
+        Handle failed message delivery.
+
+        A retry holds `delivery` (the dispatch of the failed attempt) until it
+        is back in the main queue, so the original stays unacked, and is
+        recovered after a crash, while the retry waits out its backoff.
+        """
         self.metrics["messages_failed"] += 1
 
         # Check if we should retry
@@ -510,15 +2712,35 @@ class MessageBus:
             #     reason=reason,
             # )
 
-            # Re-queue with slight delay
-            await asyncio.sleep(0.1 * message.retry_count)  # Exponential backoff
-            await self.main_queue.put(message)
+            # Re-queue after a backoff without holding up dispatch
+            if delivery is not None:
+                delivery.holds += 1
+                self._retry_holds.setdefault(id(message), []).append(delivery)
+            self.retry_scheduler.schedule(message)
+            self.metrics["messages_retried"] += 1
         else:
             # Max retries exceeded, send to DLQ
             await self._send_to_dlq(message, reason)
 
+    async def _requeue_retry(self, message: StandardMessage) -> None:
+        """Return a message whose retry is due to the main queue, then ack the failed attempt."""
+        try:
+            await self.main_queue.put(message)
+        except QueueOverflowError:
+            await self._send_to_dlq(message, "queue overflow on retry")
+
+        deliveries = self._retry_holds.get(id(message))
+        if deliveries:
+            delivery = deliveries.pop(0)
+            if not deliveries:
+                del self._retry_holds[id(message)]
+            await self._release_delivery(delivery)
+
     async def _send_to_dlq(self, message: StandardMessage, reason: str) -> None:
         """Send message to dead letter queue."""
+        # A request that can't be delivered won't be answered; fail its caller now
+        self._fail_pending_request(message, f"Request dead-lettered: {reason}")
+
         try:
             # Add failure metadata
             message.metadata["dlq_reason"] = reason
@@ -533,6 +2755,17 @@ class MessageBus:
             # logger.critical("Dead letter queue full, message lost!", message_id=message.id)
             pass
 
+        except WALError:
+            # logger.exception("Failed to spill dead letter", message_id=message.id)
+            pass
+
+    def _fail_pending_request(self, message: StandardMessage, reason: str) -> None:
+        """Fail the request() call waiting on a message that will not be delivered."""
+        if self._pending_requests:
+            future = self._pending_requests.pop(message.id, None)
+            if future is not None and not future.done():
+                future.set_exception(DeliveryError(reason))
+
     def _update_avg_latency(self) -> None:
         """Update average latency metric."""
         if self._latency_samples:
@@ -548,6 +2781,28 @@ class MessageBus:
 
         self.metrics["throughput_per_sec"] = len(self._throughput_window)
 
+    async def clear_queue(self) -> int:
+        """
+        Drop every message waiting in the main queue.
+
+        Sender credits held by the dropped messages are returned. Clear the
+        queue through the bus rather than main_queue.clear(), which cannot
+        return them.
+
+        Returns:
+            Number of messages dropped
+        """
+        dropped = await self.main_queue.size()
+        await self.main_queue.clear()
+
+        # Credited messages are queued, or publishes still waiting for
+        # capacity; dropping the latter's credits errs towards admitting
+        self._credit_holders.clear()
+        self._credits_used.clear()
+        for waiters in self._credit_waiters.values():
+            waiters.wake(len(waiters))
+        return dropped
+
     async def get_metrics(self) -> Dict[str, Any]:
         """Get current metrics."""
         metrics = self.metrics.copy()
@@ -555,6 +2810,25 @@ class MessageBus:
         # Add queue sizes
         metrics["main_queue_size"] = await self.main_queue.size()
         metrics["dlq_size"] = await self.dead_letter_queue.size()
+        if isinstance(self.dead_letter_queue, DeadLetterQueue):
+            metrics["dlq_spilled"] = self.dead_letter_queue.spilled
+        metrics["main_queue_lanes"] = self.main_queue.lane_sizes()
+        metrics["main_queue_wait_ms"] = {
+            _priority_name(priority): histogram.snapshot()
+            for priority, histogram in sorted(self.main_queue.wait_times().items())
+        }
+        metrics["retry_pending"] = len(self.retry_scheduler)
+        metrics["executors"] = {name: pool.stats() for name, pool in self._executors.items()}
+        metrics["process_pending"] = sum(
+            len(s.process_pool) for s in self.subscriptions.values() if s.process_pool is not None
+        )
+        metrics["mailbox_backlog"] = sum(s.mailbox.qsize() for s in self.subscriptions.values())
+        metrics["mailboxes_full"] = sum(1 for s in self.subscriptions.values() if s.mailbox.full())
+        metrics["requests_pending"] = len(self._pending_requests)
+        if self.sender_credits is not None:
+            metrics["senders_throttled"] = sum(
+                1 for used in self._credits_used.values() if used >= self.sender_credits
+            )
 
         # Add subscription info
         async with self._subscription_lock:
@@ -575,37 +2849,158 @@ class MessageBus:
             # logger.error(f"Failed to persist metrics: {str(e)}")
             pass
 
-    async def replay_dlq(self, limit: Optional[int] = None) -> int:
+    async def replay_dlq(
+        self,
+        limit: Optional[int] = None,
+        predicate: Optional[Callable[[StandardMessage], bool]] = None,
+        reasons: Optional[List[str]] = None,
+        message_types: Optional[List[str]] = None,
+        senders: Optional[List[str]] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        rate: Optional[float] = None,
+        batch_size: int = 100,
+        max_queue_fill: Optional[float] = 0.5,
+        progress: Optional[Callable[["ReplayProgress"], None]] = None,
+    ) -> int:
         """
         Replay messages from dead letter queue.
 
+        The DLQ is streamed in batches; each pass looks at every message that
+        was dead-lettered when the replay started at most once. Messages that
+        don't match the filters stay in the DLQ.
+
         Args:
             limit: Maximum number of messages to replay (None = all)
+            predicate: Custom filter; only messages it returns True for are replayed
+            reasons: Only replay messages whose dlq_reason starts with one of these
+            message_types: Only replay these message types
+            senders: Only replay messages from these senders
+            since: Only replay messages dead-lettered at or after this time
+            until: Only replay messages dead-lettered before this time
+            rate: Maximum messages replayed per second (None = unpaced)
+            batch_size: Messages read and republished per step
+            max_queue_fill: Pause while the main queue is at least this full
+                (fraction of the main queue's max_size; None = never pause)
+            progress: Called with a ReplayProgress after every batch
 
         Returns:
             Number of messages replayed
         """
-        count = 0
-
-        while True:
-            if limit and count >= limit:
+        limit = limit or None
+        dlq = self.dead_letter_queue
+        state = ReplayProgress(total=len(dlq))
+        remaining_scan = state.total
+        # A spooling DLQ returns skipped messages behind the unscanned ones; any
+        # other backend might hand them out again, so they wait until the end
+        spooling = dlq if isinstance(dlq, DeadLetterQueue) and dlq.spool is not None else None
+        deferred: List[StandardMessage] = []  # non-matching, returned after the scan
+        types = set(message_types) if message_types else None
+        started = time.monotonic()
+
+        while remaining_scan > 0 and (limit is None or state.replayed < limit):
+            # Leave room for live traffic (only a running bus drains the queue); size()
+            # rather than len(), as other processes may drain a shared transport
+            if max_queue_fill is not None:
+                high_water = self.main_queue.max_size * max_queue_fill
+                while self._running and await self.main_queue.size() >= high_water:
+                    await asyncio.sleep(0.05)
+
+            want = min(batch_size, remaining_scan)
+            if limit is not None:
+                want = min(want, limit - state.replayed)
+            batch = await dlq.get_many(want)
+            if not batch:
                 break
+            remaining_scan -= len(batch)
+            state.scanned += len(batch)
 
-            message = await self.dead_letter_queue.get()
-            if message is None:
-                break
+            selected, skipped = [], []
+            for message in batch:
+                if self._replay_matches(message, predicate, reasons, types, senders, since, until):
+                    selected.append(message)
+                else:
+                    skipped.append(message)
+
+            if skipped:
+                state.skipped += len(skipped)
+                if spooling is not None:
+                    await spooling.requeue(skipped)
+                else:
+                    deferred.extend(skipped)
 
-            # Reset retry count
-            message.retry_count = 0
-            message.metadata.pop("dlq_reason", None)
-            message.metadata.pop("dlq_timestamp", None)
+            for message in selected:
+                # Reset retry count
+                message.retry_count = 0
+                message.metadata.pop("dlq_reason", None)
+                message.metadata.pop("dlq_timestamp", None)
 
             # Re-publish
-            await self.publish(message, validate=False)
-            count += 1
+            errors = await self.publish_many(selected, validate=False)
+            for message, error in zip(selected, errors):
+                if error is None:
+                    state.replayed += 1
+                else:
+                    state.failed += 1
+                    await self._send_to_dlq(message, f"replay failed: {str(error)}")
+                await dlq.ack(message)
+
+            state.elapsed = time.monotonic() - started
+            if progress is not None:
+                progress(state)
+
+            # Pace to the target rate
+            if rate:
+                delay = state.replayed / rate - (time.monotonic() - started)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+        for message in deferred:
+            await dlq.nack(message)
+
+        # logger.info(f"Replayed {state.replayed} messages from DLQ")
+        return state.replayed
+
+    @staticmethod
+    def _replay_matches(
+        message: StandardMessage,
+        predicate: Optional[Callable[[StandardMessage], bool]],
+        reasons: Optional[List[str]],
+        types: Optional[Set[str]],
+        senders: Optional[List[str]],
+        since: Optional[datetime],
+        until: Optional[datetime],
+    ) -> bool:
+        """Check a dead-lettered message against replay filters."""
+        if types is not None:
+            message_type = message.type.value if hasattr(message.type, "value") else message.type
+            if message_type not in types:
+                return False
+
+        if senders is not None and message.sender not in senders:
+            return False
+
+        if reasons is not None:
+            reason = message.metadata.get("dlq_reason") or ""
+            if not any(reason.startswith(prefix) for prefix in reasons):
+                return False
+
+        if since is not None or until is not None:
+            dead_lettered_at = message.timestamp
+            stamp = message.metadata.get("dlq_timestamp")
+            if stamp:
+                try:
+                    dead_lettered_at = datetime.fromisoformat(stamp)
+                except ValueError:
+                    pass
+            if dead_lettered_at.tzinfo is None:
+                dead_lettered_at = dead_lettered_at.replace(tzinfo=timezone.utc)
+            if since is not None and dead_lettered_at < _as_utc(since):
+                return False
+            if until is not None and dead_lettered_at >= _as_utc(until):
+                return False
 
-        # logger.info(f"Replayed {count} messages from DLQ")
-        return count
+        return predicate is None or bool(predicate(message))
 
 
 # Singleton instance
@@ -0,0 +1,423 @@
+"""
+Process-pool delivery for CPU-bound subscriber callbacks.
+
+Sync callbacks normally run on the event loop's thread pool, where CPU-bound
+work (SQL parsing, schema analysis) is serialized by the GIL. A
+ProcessDispatcher runs such a callback in worker processes instead.
+
+Messages are encoded once in the codec's JSON form
+(StandardMessage.to_bytes(compact=False)), which decodes faster than the
+compact one, and copied into shared memory, where each worker has a ring buffer of its own; the
+workers decode them from there, so nothing is pickled per message. Each
+worker reports a small binary result record back over its own pipe.
+
+A ring has one writer (the parent) and one reader (its worker), so reading
+needs no lock that a dying worker could leave held. The parent hands each
+message to the worker with the fewest outstanding messages.
+
+Ring layout: a 16-byte header holding the write and read positions (uint64,
+little-endian, counting bytes since the ring was created), followed by the
+data area. Records are a 12-byte header (uint32 payload length, uint64
+sequence number) followed by the payload; a record never wraps. When the
+tail of the data area is too short for the next record, the writer leaves a
+wrap marker there (if it has room for one) and continues at the start.
+Sequence number 0 tells the worker that reads it to exit.
+
+Each worker also has a uint64 slot in a shared array holding the sequence
+number of the last record it took from its ring, written before the record
+is removed from the ring. When a worker dies the parent fails that record
+(skipping it if it is still in the ring) and starts a new worker on the same
+ring, which picks up the records queued behind it.
+"""
+
+import asyncio
+import multiprocessing
+import signal
+import struct
+import time
+from multiprocessing import shared_memory
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from core.message_types import StandardMessage
+
+RING_HEADER = struct.Struct("<QQ")  # write position, read position
+RECORD_HEADER = struct.Struct("<IQ")  # payload length, sequence number
+RESULT = struct.Struct("<QB")  # sequence number, ok; followed by the UTF-8 error text
+WRAP_MARKER = 0xFFFFFFFF
+STOP_SEQ = 0
+
+
+class RingBuffer:
+    """Single-producer ring of length-prefixed records over a shared memory buffer."""
+
+    def __init__(self, buffer: memoryview):
+        self.buffer = buffer
+        self.capacity = len(buffer) - RING_HEADER.size
+
+    @property
+    def write_pos(self) -> int:
+        return RING_HEADER.unpack_from(self.buffer)[0]
+
+    @property
+    def read_pos(self) -> int:
+        return RING_HEADER.unpack_from(self.buffer)[1]
+
+    @property
+    def empty(self) -> bool:
+        write_pos, read_pos = RING_HEADER.unpack_from(self.buffer)
+        return write_pos == read_pos
+
+    def fits(self, payload_size: int) -> bool:
+        """Whether a record of this payload size could ever be written."""
+        return RECORD_HEADER.size + payload_size <= self.capacity
+
+    def try_write(self, seq: int, payload: bytes) -> bool:
+        """Append a record if there is room for it now (producer only)."""
+        write_pos, read_pos = RING_HEADER.unpack_from(self.buffer)
+        size = RECORD_HEADER.size + len(payload)
+        offset = write_pos % self.capacity
+        tail = self.capacity - offset
+        padding = tail if tail < size else 0
+        if self.capacity - (write_pos - read_pos) < padding + size:
+            return False
+
+        base = RING_HEADER.size
+        if padding:
+            if tail >= 4:
+                struct.pack_into("<I", self.buffer, base + offset, WRAP_MARKER)
+            offset = 0
+
+        RECORD_HEADER.pack_into(self.buffer, base + offset, len(payload), seq)
+        start = base + offset + RECORD_HEADER.size
+        self.buffer[start : start + len(payload)] = payload
+        # Publish the record only after it is fully written
+        struct.pack_into("<Q", self.buffer, 0, write_pos + padding + size)
+        return True
+
+    def read(self) -> Tuple[int, bytes]:
+        """Remove and return the next record (consumer only)."""
+        seq, payload, next_pos = self.peek()
+        self.advance(next_pos)
+        return seq, payload
+
+    def peek(self) -> Tuple[int, bytes, int]:
+        """Return the next record and the read position after it, leaving it in the ring."""
+        read_pos = self.read_pos
+        base = RING_HEADER.size
+        offset = read_pos % self.capacity
+        tail = self.capacity - offset
+        if tail < RECORD_HEADER.size or (
+            struct.unpack_from("<I", self.buffer, base + offset)[0] == WRAP_MARKER
+        ):
+            read_pos += tail
+            offset = 0
+
+        length, seq = RECORD_HEADER.unpack_from(self.buffer, base + offset)
+        start = base + offset + RECORD_HEADER.size
+        payload = bytes(self.buffer[start : start + length])
+        return seq, payload, read_pos + RECORD_HEADER.size + length
+
+    def advance(self, read_pos: int) -> None:
+        """Free the space up to `read_pos`, as returned by peek()."""
+        struct.pack_into("<Q", self.buffer, 8, read_pos)
+
+
+def _run_worker(  # pragma: no cover - runs in the worker processes
+    shm_name: str,
+    ring_size: int,
+    items: Any,
+    results: Any,
+    callback: Callable[[StandardMessage], None],
+    taken: Any,
+    index: int,
+) -> None:
+    """Worker process loop: read records, run the callback, report results."""
+    # Ctrl-C reaches the whole process group; shutdown is driven by the parent
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    ring = RingBuffer(shm.buf[index * ring_size : (index + 1) * ring_size])
+    try:
+        while True:
+            items.acquire()
+            seq, payload, next_pos = ring.peek()
+            # Claim the record before freeing its space, so a worker dying in
+            # between leaves a record the parent can recognize and skip
+            taken[index] = seq
+            ring.advance(next_pos)
+            if seq == STOP_SEQ:
+                break
+
+            try:
+                callback(StandardMessage.from_bytes(payload))
+                results.send_bytes(RESULT.pack(seq, 1))
+            except Exception as e:
+                results.send_bytes(RESULT.pack(seq, 0) + str(e).encode("utf-8", "replace"))
+    finally:
+        ring.buffer.release()
+        shm.close()
+        results.close()
+
+
+class ProcessDispatcher:
+    """
+    Runs a sync callback in a pool of worker processes fed from shared-memory rings.
+
+    submit() only waits for ring space; results are collected with
+    completed(). The callback must be picklable by reference (a module-level
+    function), since workers are started with the ``spawn`` method by
+    default. Result pipes are watched with the event loop's add_reader().
+    ring_size is the size of each worker's ring.
+    """
+
+    def __init__(
+        self,
+        callback: Callable[[StandardMessage], None],
+        workers: int = 2,
+        ring_size: int = 1 << 20,
+        start_method: str = "spawn",
+    ):
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        if ring_size <= RING_HEADER.size + RECORD_HEADER.size:
+            raise ValueError("ring_size is too small")
+
+        self.callback = callback
+        self.workers = workers
+        self.ring_size = ring_size
+        self._context = multiprocessing.get_context(start_method)
+
+        self._shm: Optional[shared_memory.SharedMemory] = None
+        self._rings: List[RingBuffer] = []  # one per worker
+        self._items: List[Any] = []  # per-worker semaphore: records in its ring
+        self._taken: Any = None  # per-worker sequence number of the last record read
+        self._processes: List[Any] = []
+        self._connections: Dict[int, Any] = {}  # worker index -> result pipe, while alive
+        self._exits: Set[asyncio.Task] = set()  # dead workers being joined and replaced
+        self._stopping = False
+
+        self._seq = 0
+        self._pending: Dict[int, StandardMessage] = {}  # seq -> message in a ring or running
+        self._assigned: List[Set[int]] = []  # per worker: seqs of its pending messages
+        self._results: List[Tuple[StandardMessage, Optional[str]]] = []
+        self._results_ready = asyncio.Event()
+        self._space_freed = asyncio.Event()
+
+    def __len__(self) -> int:
+        """Number of messages submitted but not yet completed."""
+        return len(self._pending)
+
+    @property
+    def running(self) -> bool:
+        return bool(self._rings)
+
+    def start(self) -> None:
+        """Create the rings and start the worker processes."""
+        if self.running:
+            return
+
+        size = self.ring_size
+        self._shm = shared_memory.SharedMemory(create=True, size=size * self.workers)
+        for index in range(self.workers):
+            self._shm.buf[index * size : index * size + RING_HEADER.size] = bytes(RING_HEADER.size)
+        self._rings = [
+            RingBuffer(self._shm.buf[index * size : (index + 1) * size])
+            for index in range(self.workers)
+        ]
+        self._items = [self._context.Semaphore(0) for _ in range(self.workers)]
+        self._taken = self._context.RawArray("Q", self.workers)
+        self._assigned = [set() for _ in range(self.workers)]
+        self._stopping = False
+
+        self._processes = [None] * self.workers
+        for index in range(self.workers):
+            self._spawn(index)
+
+    async def submit(self, message: StandardMessage) -> None:
+        """
+        Copy a message into the ring of the least busy worker.
+
+        Waits while all rings are full.
+
+        Raises:
+            ValueError: If the encoded message is larger than the ring
+            RuntimeError: If the dispatcher is not running or all workers exited
+        """
+        payload = message.to_bytes(compact=False)
+        if not self.running:
+            raise RuntimeError("Process dispatcher is not running")
+        if not self._connections and not self._exits:
+            raise RuntimeError("All worker processes exited")
+        if not self._rings[0].fits(len(payload)):
+            raise ValueError(
+                f"Message of {len(payload)} bytes does not fit in a " f"{self.ring_size}-byte ring"
+            )
+
+        self._seq += 1
+        while not self._try_write(self._seq, payload):
+            if not self._connections and not self._exits:
+                raise RuntimeError("All worker processes exited")
+            # Workers free space before running the callback, so a result means room;
+            # the timeout covers space freed by a worker that hasn't reported yet
+            self._space_freed.clear()
+            try:
+                await asyncio.wait_for(self._space_freed.wait(), 0.01)
+            except asyncio.TimeoutError:
+                pass
+
+        self._pending[self._seq] = message
+
+    def _try_write(self, seq: int, payload: bytes) -> bool:
+        """Write a record to the least busy worker's ring that has room for it."""
+        for index in sorted(range(self.workers), key=lambda i: len(self._assigned[i])):
+            if self._rings[index].try_write(seq, payload):
+                self._assigned[index].add(seq)
+                self._items[index].release()
+                return True
+        return False
+
+    async def completed(self) -> List[Tuple[StandardMessage, Optional[str]]]:
+        """Wait for results; returns (message, error or None) pairs."""
+        while not self._results:
+            self._results_ready.clear()
+            await self._results_ready.wait()
+
+        results, self._results = self._results, []
+        return results
+
+    async def stop(self, timeout: float = 5.0) -> List[Tuple[StandardMessage, Optional[str]]]:
+        """
+        Let the workers finish what is in the ring, then shut them down.
+
+        Returns:
+            Results not yet collected with completed(), including messages
+            that never completed (with an error)
+        """
+        if not self.running:
+            return []
+
+        # Workers that died are not replaced from here on
+        self._stopping = True
+        if self._exits:
+            await asyncio.gather(*self._exits)
+
+        # Stop records go behind everything already submitted
+        deadline = time.monotonic() + timeout
+        for index in list(self._connections):
+            while not self._rings[index].try_write(STOP_SEQ, b""):
+                if not self._processes[index].is_alive() or time.monotonic() >= deadline:
+                    break
+                await asyncio.sleep(0.01)
+            else:
+                self._items[index].release()
+
+        while any(p.is_alive() for p in self._processes) and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+
+        loop = asyncio.get_running_loop()
+        for process in self._processes:
+            if process.is_alive():
+                process.terminate()
+            await loop.run_in_executor(None, process.join)
+        for index, connection in list(self._connections.items()):
+            self._read_results(connection, index)  # results written before the worker exited
+            if index in self._connections:
+                loop.remove_reader(connection.fileno())
+                connection.close()
+        if self._exits:
+            await asyncio.gather(*self._exits)
+        self._processes.clear()
+        self._connections.clear()
+        self._items = []
+        self._taken = None
+
+        results, self._results = self._results, []
+        for message in self._pending.values():
+            results.append((message, "worker process stopped before delivery"))
+        self._pending.clear()
+        self._assigned = []
+
+        for ring in self._rings:
+            ring.buffer.release()
+        self._rings = []
+        self._shm.close()
+        self._shm.unlink()
+        self._shm = None
+        return results
+
+    def _spawn(self, index: int) -> None:
+        """Start the worker process for slot `index` and watch its result pipe."""
+        receiver, sender = self._context.Pipe(duplex=False)
+        process = self._context.Process(
+            target=_run_worker,
+            args=(
+                self._shm.name,
+                self.ring_size,
+                self._items[index],
+                sender,
+                self.callback,
+                self._taken,
+                index,
+            ),
+            daemon=True,
+        )
+        self._taken[index] = STOP_SEQ
+        process.start()
+        sender.close()
+        asyncio.get_running_loop().add_reader(
+            receiver.fileno(), self._read_results, receiver, index
+        )
+        self._processes[index] = process
+        self._connections[index] = receiver
+
+    async def _worker_exited(self, index: int) -> None:
+        """Fail the message a worker was running when it exited and replace the worker."""
+        process = self._processes[index]
+        # Its pipe is closed, so the process is on its way out
+        await asyncio.get_running_loop().run_in_executor(None, process.join, 1.0)
+
+        seq = self._taken[index]
+        message = self._pending.pop(seq, None)
+        if message is not None:
+            self._assigned[index].discard(seq)
+            self._results.append(
+                (message, f"worker process exited with code {process.exitcode} during delivery")
+            )
+            self._results_ready.set()
+            ring = self._rings[index]
+            if not ring.empty:
+                next_seq, _, next_pos = ring.peek()
+                if next_seq == seq:
+                    # Claimed but not yet removed from the ring when the worker died
+                    ring.advance(next_pos)
+                    self._space_freed.set()
+
+        if not self._stopping:
+            # logger.warning(f"Worker process {index} exited", exitcode=process.exitcode)
+            # A new semaphore: the old count may have lost a record the worker took
+            self._items[index] = self._context.Semaphore(len(self._assigned[index]))
+            self._spawn(index)
+
+    def _read_results(self, connection: Any, index: int) -> None:
+        """Collect the result records available on a worker's pipe."""
+        try:
+            while connection.poll():
+                record = connection.recv_bytes()
+                seq, ok = RESULT.unpack_from(record)
+                message = self._pending.pop(seq, None)
+                if message is not None:
+                    self._assigned[index].discard(seq)
+                    error = None if ok else record[RESULT.size :].decode("utf-8", "replace")
+                    self._results.append((message, error))
+        except (EOFError, OSError):
+            # The worker exited; stop watching its pipe
+            asyncio.get_running_loop().remove_reader(connection.fileno())
+            connection.close()
+            del self._connections[index]
+            task = asyncio.ensure_future(self._worker_exited(index))
+            self._exits.add(task)
+            task.add_done_callback(self._exits.discard)
+
+        if self._results:
+            self._results_ready.set()
+        self._space_freed.set()
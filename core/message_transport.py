@@ -0,0 +1,443 @@
+"""
+Networked QueueBackend implementations for the message bus.
+
+MessageBus accepts any core.message_bus.QueueBackend as its ``transport``
+(main queue) or ``dead_letter_transport``. It acks each dispatched message
+once the callback of every subscriber it was delivered to has run, or it
+was dead-lettered, or its retry was put back in the queue (so a retry
+waiting out its backoff is not lost with the process).
+
+RedisStreamQueue keeps the queue in Redis Streams so that several processes
+(uvicorn workers, agent processes, other nodes) can publish to and dispatch
+from one queue without losing messages between them. The ``redis`` package
+is imported when a RedisStreamQueue is created, so the in-process queues do
+not depend on it.
+
+MessageBus.request() only resolves with responses its own process
+dispatches; a response read from a shared queue by another process goes to
+that process's subscribers, and the request times out.
+"""
+
+import asyncio
+import os
+import socket
+import time
+from collections import defaultdict, deque
+from typing import Any, Dict, List, Optional, Tuple
+
+from core.message_bus import QueueBackend, QueueOverflowError, WaitTimeHistogram, _priority_name
+from core.message_types import MessagePriority, StandardMessage
+
+# Adds as many (lane index, payload) pairs from ARGV[2:] as fit under the
+# capacity ARGV[1], counting every lane; returns {accepted, size after}
+_PUT_SCRIPT = """
+local size = 0
+for _, key in ipairs(KEYS) do
+    size = size + redis.call('XLEN', key)
+end
+local capacity = tonumber(ARGV[1]) - size
+local accepted = 0
+for i = 2, #ARGV, 2 do
+    if accepted >= capacity then
+        break
+    end
+    redis.call('XADD', KEYS[tonumber(ARGV[i])], '*', 'm', ARGV[i + 1])
+    accepted = accepted + 1
+end
+return {accepted, size + accepted}
+"""
+
+# Seconds between capacity checks while put() waits for a full queue to drain
+CAPACITY_POLL_INTERVAL = 0.05
+
+
+class RedisStreamQueue(QueueBackend):
+    """
+    Priority queue stored in Redis Streams and consumed through a consumer group.
+
+    Each priority level is its own stream, ``{<name>}:p<priority>``; the hash
+    tag keeps every lane in one cluster slot so the capacity check and add
+    run atomically in a single script. Lanes are read in strict priority
+    order, up to ``read_count`` entries per lane at a time.
+
+    Every process sharing a queue joins the same consumer group under its own
+    consumer name, so each message is dispatched by exactly one of them.
+    Entries stay in the group's pending list until the bus acknowledges
+    them; acknowledged entries are deleted, so stream length is the number
+    of queued plus in-flight messages and is what ``max_size`` limits.
+    Acknowledgements are batched and sent before the next read.
+
+    Delivery is at least once: on its first read a consumer takes back
+    entries it read but never acknowledged (e.g. before a crash or restart),
+    and entries another consumer has left pending for ``claim_idle`` seconds
+    are reclaimed with XAUTOCLAIM.
+
+    TTLs are not indexed here; expired messages are dead-lettered when they
+    are dispatched.
+
+    Connects to ``url`` unless an existing ``redis.asyncio`` client is passed
+    as ``client``; such a client must not decode responses (payloads are
+    binary).
+    """
+
+    def __init__(
+        self,
+        name: str = "message_bus",
+        max_size: int = 10000,
+        url: str = "redis://localhost:6379/0",
+        client: Optional[Any] = None,
+        group: str = "dispatchers",
+        consumer: Optional[str] = None,
+        read_count: int = 32,
+        block_ms: int = 1000,
+        claim_idle: float = 60.0,
+    ):
+        if read_count < 1:
+            raise ValueError("read_count must be at least 1")
+        if claim_idle <= 0:
+            raise ValueError("claim_idle must be positive")
+
+        try:
+            import redis.asyncio as redis_asyncio
+            from redis.exceptions import ResponseError
+        except ImportError as e:
+            raise ImportError("RedisStreamQueue requires the redis package") from e
+
+        self.name = name  # stream name prefix shared by every process using the queue
+        self.max_size = max_size  # queued plus in-flight messages, across all processes
+        self.group = group
+        # Reuse a consumer name across restarts to take back its unacked entries at once
+        self.consumer = consumer or f"{socket.gethostname()}-{os.getpid()}"
+        self.read_count = read_count  # max entries read per lane at a time
+        self.block_ms = block_ms  # longest single blocking read in wait_not_empty()
+        self.claim_idle = claim_idle  # seconds pending with another consumer before reclaim
+
+        self._owns_client = client is None
+        self._redis = client if client is not None else redis_asyncio.from_url(url)
+        self._response_error = ResponseError
+        self._put_script = self._redis.register_script(_PUT_SCRIPT)
+
+        # One stream per priority, highest priority first
+        self._lane_order = [int(priority) for priority in sorted(MessagePriority)]
+        self._keys = [f"{{{name}}}:p{priority}" for priority in self._lane_order]
+        self._key_priority = {key.encode(): p for key, p in zip(self._keys, self._lane_order)}
+        self._lane_index = {priority: i + 1 for i, priority in enumerate(self._lane_order)}
+
+        # Priority -> FIFO of (entry id, stream key, message) read but not yet handed out
+        self._buffer: Dict[int, deque] = {priority: deque() for priority in self._lane_order}
+        self._buffered = 0
+        # id(message) -> (key, entry id, message) of entries handed out but not yet acked;
+        # each entry is decoded into its own object, so messages sharing an id stay apart
+        self._inflight: Dict[int, Tuple[bytes, bytes, StandardMessage]] = {}
+        self._acks: Dict[bytes, List[bytes]] = defaultdict(list)  # key -> entry ids to ack
+        self._ack_count = 0
+
+        self._read_lock = asyncio.Lock()  # one reader at a time, so entries are buffered once
+        self._group_ready = False
+        # Own pending entries still to take back: key -> last entry id seen (None = not started)
+        self._recovery: Optional[Dict[bytes, bytes]] = None
+        self._claim_cursor: Dict[bytes, bytes] = {}
+        self._next_claim = time.monotonic() + claim_idle
+
+        # Stream length as of the last put() or size(), less the entries deleted since
+        self._size = 0
+        self._lane_sizes: Dict[int, int] = dict.fromkeys(self._lane_order, 0)
+        self._wait_times: Dict[int, WaitTimeHistogram] = defaultdict(WaitTimeHistogram)
+
+    async def put(self, message: StandardMessage, timeout: Optional[float] = None) -> None:
+        """
+        Append a message to the stream of its priority.
+
+        Args:
+            message: Message to enqueue
+            timeout: Seconds to wait for capacity when the queue is full
+                (None = fail at once)
+
+        Raises:
+            QueueOverflowError: If the queue is full (after waiting `timeout`)
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not await self._add([message]):
+            if deadline is None:
+                raise QueueOverflowError(f"Queue {self.name} is at capacity ({self.max_size})")
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise QueueOverflowError(
+                    f"Queue {self.name} is at capacity ({self.max_size}) "
+                    f"after waiting {timeout:.3g}s"
+                )
+            # Consumers in other processes free capacity without notifying us
+            await asyncio.sleep(min(CAPACITY_POLL_INTERVAL, remaining))
+
+    async def put_many(self, messages: List[StandardMessage]) -> List[Optional[Exception]]:
+        """
+        Append a batch of messages in a single round trip.
+
+        Messages beyond the remaining capacity are rejected individually.
+
+        Returns:
+            Per-message error (None if enqueued), in input order
+        """
+        if not messages:
+            return []
+
+        accepted = await self._add(messages)
+        errors: List[Optional[Exception]] = [None] * accepted
+        errors.extend(
+            QueueOverflowError(f"Queue {self.name} is at capacity ({self.max_size})")
+            for _ in messages[accepted:]
+        )
+        return errors
+
+    async def get(self) -> Optional[StandardMessage]:
+        """Get the next message of the highest priority lane, reading ahead if needed."""
+        if not self._buffered:
+            async with self._read_lock:
+                if not self._buffered:
+                    await self._fill(block_ms=None)
+
+        for priority in self._lane_order:
+            lane = self._buffer[priority]
+            if lane:
+                entry_id, key, message = lane.popleft()
+                self._buffered -= 1
+                self._inflight[id(message)] = (key, entry_id, message)
+
+                # Entry ids start with the millisecond they were added at
+                enqueued_at = int(entry_id.split(b"-", 1)[0]) / 1000
+                self._wait_times[priority].observe(max(0.0, time.time() - enqueued_at))
+                return message
+
+        return None
+
+    async def ack(self, message: StandardMessage) -> None:
+        """
+        Acknowledge a message returned by get(); its entry is deleted.
+
+        Acknowledgements are sent with the next read, after `read_count` of
+        them, or on flush().
+        """
+        inflight = self._inflight.pop(id(message), None)
+        if inflight is None:
+            return
+
+        key, entry_id, _ = inflight
+        self._acks[key].append(entry_id)
+        self._ack_count += 1
+        if self._ack_count >= self.read_count:
+            await self._flush_acks()
+
+    async def nack(self, message: StandardMessage) -> None:
+        """
+        Return a message returned by get() to the front of its lane buffer.
+
+        Its entry stays pending with this consumer, so if the process stops
+        first it is taken back on restart or reclaimed by another consumer.
+        """
+        inflight = self._inflight.pop(id(message), None)
+        if inflight is None:
+            return
+
+        key, entry_id, _ = inflight
+        self._buffer[self._key_priority[key]].appendleft((entry_id, key, message))
+        self._buffered += 1
+
+    async def wait_not_empty(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until a message is available to this consumer.
+
+        Args:
+            timeout: Maximum seconds to wait (None = wait forever)
+
+        Returns:
+            True if a message is available, False if the wait timed out
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self._buffered:
+            block_ms = self.block_ms
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                block_ms = max(1, min(block_ms, int(remaining * 1000)))
+            async with self._read_lock:
+                if not self._buffered:
+                    await self._fill(block_ms)
+        return True
+
+    async def size(self) -> int:
+        """Get the number of queued and in-flight messages across all consumers."""
+        async with self._redis.pipeline(transaction=False) as pipe:
+            for key in self._keys:
+                pipe.xlen(key)
+            lengths = await pipe.execute()
+
+        self._lane_sizes = dict(zip(self._lane_order, lengths))
+        self._size = sum(lengths)
+        return self._size
+
+    def __len__(self) -> int:
+        # Local estimate: other processes' puts and acks show up on the next size()
+        return self._size
+
+    def lane_sizes(self) -> Dict[str, int]:
+        """Get the stream length per priority lane as of the last size()."""
+        return {_priority_name(p): count for p, count in self._lane_sizes.items()}
+
+    def wait_times(self) -> Dict[int, WaitTimeHistogram]:
+        """Get the wait-time histograms of messages this consumer dequeued, by priority value."""
+        return dict(self._wait_times)
+
+    async def clear(self) -> None:
+        """Delete every lane stream, and with them the consumer group, for all processes."""
+        await self._redis.delete(*self._keys)
+        for lane in self._buffer.values():
+            lane.clear()
+        self._buffered = 0
+        self._inflight.clear()
+        self._acks.clear()
+        self._ack_count = 0
+        self._group_ready = False
+        self._claim_cursor.clear()
+        self._size = 0
+        self._lane_sizes = dict.fromkeys(self._lane_order, 0)
+
+    async def flush(self) -> None:
+        """Send pending acknowledgements."""
+        await self._flush_acks()
+
+    async def close(self) -> None:
+        """Send pending acknowledgements and close the client if this queue created it."""
+        await self._flush_acks()
+        if self._owns_client:
+            await self._redis.aclose()
+
+    async def _add(self, messages: List[StandardMessage]) -> int:
+        """Append messages atomically up to capacity; returns how many were added."""
+        lowest = len(self._lane_order)
+        args: List[Any] = [self.max_size]
+        for message in messages:
+            lane = self._lane_index.get(int(message.priority), lowest)
+            # The JSON form: entries are decoded on every read, compactness matters less
+            args.extend((lane, message.to_bytes(compact=False)))
+
+        accepted, self._size = await self._put_script(keys=self._keys, args=args)
+        return int(accepted)
+
+    async def _ensure_group(self) -> None:
+        """Create the consumer group on every lane, reading from the start of each stream."""
+        if self._group_ready:
+            return
+
+        for key in self._keys:
+            try:
+                await self._redis.xgroup_create(key, self.group, id="0", mkstream=True)
+            except self._response_error as e:
+                if "BUSYGROUP" not in str(e):
+                    raise
+        self._group_ready = True
+        if self._recovery is None:
+            self._recovery = {key.encode(): b"0" for key in self._keys}
+
+    async def _fill(self, block_ms: Optional[int]) -> None:
+        """
+        Read entries into the local buffer.
+
+        Takes back this consumer's own unacknowledged entries first, then
+        reclaims entries idle with other consumers, then reads new entries
+        (blocking up to `block_ms`, None = not at all).
+        """
+        await self._flush_acks()
+
+        try:
+            await self._ensure_group()
+
+            if self._recovery:
+                await self._read(dict(self._recovery), None)
+                if self._buffered:
+                    return
+
+            if time.monotonic() >= self._next_claim:
+                self._next_claim = time.monotonic() + self.claim_idle
+                await self._claim()
+                if self._buffered:
+                    return
+
+            await self._read({key: ">" for key in self._key_priority}, block_ms)
+
+        except self._response_error as e:
+            # The streams were deleted (clear() in some process); recreate the group
+            if "NOGROUP" not in str(e):
+                raise
+            self._group_ready = False
+
+    async def _read(self, streams: Dict[bytes, Any], block_ms: Optional[int]) -> None:
+        """Read entries with XREADGROUP into the buffer."""
+        response = await self._redis.xreadgroup(
+            self.group, self.consumer, streams, count=self.read_count, block=block_ms
+        )
+        for key, entries in response or []:
+            if self._recovery and key in self._recovery:
+                # Own pending entries are paged by id; an empty page ends recovery
+                if entries:
+                    self._recovery[key] = entries[-1][0]
+                else:
+                    del self._recovery[key]
+            self._buffer_entries(key, entries)
+
+    async def _claim(self) -> None:
+        """Take over entries left pending by other consumers for at least claim_idle."""
+        min_idle_ms = int(self.claim_idle * 1000)
+        for key in self._key_priority:
+            response = await self._redis.xautoclaim(
+                key,
+                self.group,
+                self.consumer,
+                min_idle_ms,
+                start_id=self._claim_cursor.get(key, b"0-0"),
+                count=self.read_count,
+            )
+            self._claim_cursor[key] = response[0]
+            self._buffer_entries(key, response[1])
+
+    def _buffer_entries(self, key: bytes, entries: List[Tuple[bytes, Any]]) -> None:
+        """Decode read entries into their lane buffer; unreadable entries are acked away."""
+        priority = self._key_priority[key]
+        for entry_id, fields in entries:
+            message = None
+            if fields:
+                try:
+                    message = StandardMessage.from_bytes(fields[b"m"])
+                except Exception:
+                    # logger.exception("Failed to decode stream entry", entry_id=entry_id)
+                    pass
+
+            if message is None:
+                # Deleted while pending, or undecodable
+                self._acks[key].append(entry_id)
+                self._ack_count += 1
+                continue
+
+            self._buffer[priority].append((entry_id, key, message))
+            self._buffered += 1
+
+    async def _flush_acks(self) -> None:
+        """Acknowledge and delete the entries of acked messages."""
+        if not self._acks:
+            return
+
+        acks, self._acks = self._acks, defaultdict(list)
+        self._ack_count = 0
+        async with self._redis.pipeline(transaction=False) as pipe:
+            for key, entry_ids in acks.items():
+                pipe.xack(key, self.group, *entry_ids)
+                pipe.xdel(key, *entry_ids)
+            results = await pipe.execute()
+
+        # Every other result is an XDEL count
+        deleted = sum(results[1::2])
+        self._size = max(0, self._size - deleted)
+        for key, removed in zip(acks, results[1::2]):
+            priority = self._key_priority[key]
+            self._lane_sizes[priority] = max(0, self._lane_sizes[priority] - removed)
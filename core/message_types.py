@@ -92,6 +92,9 @@ class StandardMessage(BaseModel):
     @classmethod
     def validate_metadata_size(cls, v):
         """Ensure metadata doesn't exceed size limits."""
+        if not v:
+            return v
+
         # Serialize to check size
         serialized = json.dumps(v)
         if len(serialized.encode("utf-8")) > 512:  # 512 bytes limit
@@ -126,8 +129,21 @@ class StandardMessage(BaseModel):
         """Deserialize message from bytes."""
         return cls.model_validate_json(data)
 
+    def to_bytes(self, compact: bool = True) -> bytes:
+        """Encode message with the binary codec (compact=False: its faster-to-decode JSON form)."""
+        from core.message_codec import encode_message
+
+        return encode_message(self, compact)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "StandardMessage":
+        """Decode a message produced by to_bytes()."""
+        from core.message_codec import decode_message
+
+        return decode_message(data)
+
     def get_size_bytes(self) -> int:
-        """Get message size in bytes."""
+        """Get serialized message size in bytes."""
         return len(self.serialize())
 
 
@@ -385,6 +401,8 @@ def create_message(data: Dict[str, Any]) -> StandardMessage:
     msg_type = data.get("type")
     if msg_type is None:
         raise ValueError("Message type is required")
+    if isinstance(msg_type, MessageType):
+        msg_type = msg_type.value
 
     type_map = {
         MessageType.AGENT_REQUEST.value: AgentRequest,
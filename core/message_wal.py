@@ -0,0 +1,1113 @@
+"""
+Segmented append-only write-ahead log for persistent message queues.
+
+The log stores queue state as a sequence of segment files containing:
+- Enqueue records carrying the serialized message payload
+- Ack records marking a previously enqueued message as consumed
+
+Each operation appends a single record, so persistence cost is independent of
+queue size. Fully consumed segments are dropped from the head of the log and
+partially consumed sealed segments are compacted when they become mostly dead.
+Recovery replays the segments in order and returns an index of the live
+enqueue records; payloads are read back on demand with read_payload().
+
+On-disk format (version 1):
+- Segment files are named by a zero-padded segment id with a ``.seg`` suffix
+  and start with an 8-byte header: magic ``MBWL``, uint16 format version,
+  uint16 reserved
+- Records follow back to back, each a fixed 36-byte little-endian header
+  (kind, priority, flags, payload length, crc32, seq, enqueued_at,
+  expires_at) followed by the length-prefixed payload
+- The crc32 covers the header with its crc field zeroed, then the payload
+
+Segments are scanned through mmap, so iter_log() can stream arbitrarily
+large logs for inspection without loading them into memory.
+
+Appends are plain writes; fsyncs, sealing rolled segments and compaction run
+on a background I/O thread per log, so callers on the event loop never wait
+for the disk unless they ask to (wait_synced()).
+
+SegmentSpool reuses the segment format for FIFO overflow storage: it has no
+ack records and tracks consumption with a small cursor file instead.
+"""
+
+import asyncio
+import concurrent.futures
+import contextlib
+import enum
+import mmap
+import os
+import shutil
+import struct
+import time
+import zlib
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+
+class WALError(Exception):
+    """Raised when the write-ahead log cannot be read or written."""
+
+    pass
+
+
+class FsyncPolicy(enum.Enum):
+    """When appended records are flushed to stable storage."""
+
+    ALWAYS = "always"  # fsync after every append (writes in one loop iteration share it)
+    BATCHED = "batched"  # fsync every N records, or T seconds after the first unsynced one
+    NEVER = "never"  # leave flushing to the operating system
+
+
+class RecordKind(enum.IntEnum):
+    """Types of records stored in the log."""
+
+    ENQUEUE = 1
+    ACK = 2
+
+
+# Segment file layout: header followed by records
+SEGMENT_MAGIC = b"MBWL"
+SEGMENT_VERSION = 1
+SEGMENT_SUFFIX = ".seg"
+SEGMENT_HEADER = struct.Struct("<4sHH")  # magic, version, reserved
+
+# Record header: kind, priority, flags, payload length, crc32, seq,
+# enqueued_at (epoch seconds), expires_at (epoch seconds, 0 = never)
+RECORD_HEADER = struct.Struct("<BBHIIQdd")
+# Spool cursor file: segment id and offset of the next unread record
+SPOOL_CURSOR_FILE = "cursor"
+SPOOL_CURSOR = struct.Struct("<QQ")
+
+_CRC_OFFSET = 8  # byte offset of the crc32 field within the record header
+_ZERO_CRC = b"\x00" * 4
+
+
+class WALRecord:
+    """A single decoded log record."""
+
+    __slots__ = (
+        "kind",
+        "seq",
+        "priority",
+        "flags",
+        "enqueued_at",
+        "expires_at",
+        "payload",
+        "offset",
+    )
+
+    def __init__(
+        self,
+        kind: RecordKind,
+        seq: int,
+        priority: int = 0,
+        flags: int = 0,
+        enqueued_at: float = 0.0,
+        expires_at: float = 0.0,
+        payload: bytes = b"",
+        offset: int = 0,
+    ):
+        self.kind = kind
+        self.seq = seq
+        self.priority = priority
+        self.flags = flags
+        self.enqueued_at = enqueued_at
+        self.expires_at = expires_at
+        self.payload = payload
+        self.offset = offset  # position of the record within its segment
+
+    def encode(self) -> bytes:
+        """Encode record to its on-disk representation."""
+        header = RECORD_HEADER.pack(
+            self.kind,
+            self.priority,
+            self.flags,
+            len(self.payload),
+            0,
+            self.seq,
+            self.enqueued_at,
+            self.expires_at,
+        )
+        crc = zlib.crc32(self.payload, zlib.crc32(header))
+        header = RECORD_HEADER.pack(
+            self.kind,
+            self.priority,
+            self.flags,
+            len(self.payload),
+            crc,
+            self.seq,
+            self.enqueued_at,
+            self.expires_at,
+        )
+        return header + self.payload
+
+
+class _Segment:
+    """Bookkeeping for a single segment file."""
+
+    __slots__ = ("segment_id", "path", "records", "live", "size")
+
+    def __init__(self, segment_id: int, path: Path):
+        self.segment_id = segment_id
+        self.path = path
+        self.records = 0
+        self.live = 0
+        self.size = 0
+
+
+def _segment_path(directory: Path, segment_id: int) -> Path:
+    return directory / f"{segment_id:020d}{SEGMENT_SUFFIX}"
+
+
+@contextlib.contextmanager
+def _map_segment(path: Path) -> Iterator[Any]:
+    """Map a segment file read-only (empty files map to b"")."""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield b""
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            yield mapped
+
+
+def _scan_records(data: Any, path: Path, with_payload: bool) -> Iterator[Tuple[WALRecord, int]]:
+    """
+    Scan valid records from mapped segment data.
+
+    Yields:
+        Tuples of (record, offset just past the record); stops at the first
+        torn or corrupt record
+    """
+    if len(data) < SEGMENT_HEADER.size:
+        return
+
+    magic, version, _ = SEGMENT_HEADER.unpack_from(data, 0)
+    if magic != SEGMENT_MAGIC or version != SEGMENT_VERSION:
+        raise WALError(f"Unsupported segment format in {path}")
+
+    unpack_header = RECORD_HEADER.unpack_from
+    header_size = RECORD_HEADER.size
+    size = len(data)
+    offset = SEGMENT_HEADER.size
+    while offset + header_size <= size:
+        kind, priority, flags, length, crc, seq, enqueued_at, expires_at = unpack_header(
+            data, offset
+        )
+        end = offset + header_size + length
+        if (kind != RecordKind.ENQUEUE and kind != RecordKind.ACK) or end > size:
+            return
+
+        # CRC covers the header with a zeroed crc field, then the payload
+        with memoryview(data) as view:
+            checksum = zlib.crc32(view[offset : offset + _CRC_OFFSET])
+            checksum = zlib.crc32(_ZERO_CRC, checksum)
+            checksum = zlib.crc32(view[offset + _CRC_OFFSET + 4 : end], checksum)
+        if checksum != crc:
+            return
+
+        payload = data[offset + header_size : end] if with_payload else b""
+        yield WALRecord(kind, seq, priority, flags, enqueued_at, expires_at, payload, offset), end
+        offset = end
+
+
+def _read_segment(path: Path, with_payload: bool = True) -> Tuple[List[WALRecord], int, int]:
+    """
+    Read all valid records from a segment file.
+
+    Args:
+        path: Segment file path
+        with_payload: Whether to keep record payloads (otherwise only the
+            index fields and offsets are returned; payloads are still verified)
+
+    Returns:
+        Tuple of (records, offset of end of last valid record, file size)
+    """
+    records: List[WALRecord] = []
+    with _map_segment(path) as data:
+        valid_end = SEGMENT_HEADER.size if len(data) >= SEGMENT_HEADER.size else 0
+        for record, end in _scan_records(data, path, with_payload):
+            records.append(record)
+            valid_end = end
+        return records, valid_end, len(data)
+
+
+def iter_log(
+    directory: Path, with_payload: bool = False, start: Optional[Tuple[int, int]] = None
+) -> Iterator[WALRecord]:
+    """
+    Stream every record of a log directory, oldest segment first.
+
+    Segments are mapped one at a time and records are yielded as they are
+    scanned, so memory use doesn't grow with log size.
+
+    Args:
+        directory: Log directory (e.g. ``data/message_bus/main_queue``)
+        with_payload: Whether to include record payloads
+        start: (segment id, offset) of the first record to yield, e.g. a
+            spool cursor from read_spool_cursor()
+    """
+    start_segment, start_offset = start or (0, 0)
+    for path in sorted(directory.glob(f"*{SEGMENT_SUFFIX}")):
+        segment_id = int(path.stem)
+        if segment_id < start_segment:
+            continue
+        with _map_segment(path) as data:
+            for record, _ in _scan_records(data, path, with_payload):
+                if segment_id > start_segment or record.offset >= start_offset:
+                    yield record
+
+
+def read_spool_cursor(directory: Path) -> Optional[Tuple[int, int]]:
+    """
+    Get the committed (segment id, offset) of a SegmentSpool directory.
+
+    Returns:
+        The position of the next unread record, or None if the directory has
+        no valid cursor (not a spool, or nothing consumed from it yet)
+    """
+    try:
+        data = (directory / SPOOL_CURSOR_FILE).read_bytes()
+    except FileNotFoundError:
+        return None
+    if len(data) != SPOOL_CURSOR.size:
+        return None
+    return SPOOL_CURSOR.unpack(data)
+
+
+def _fsync(file: Any) -> None:
+    os.fsync(file.fileno())
+
+
+def _fsync_and_close(file: Any) -> None:
+    try:
+        os.fsync(file.fileno())
+    finally:
+        file.close()
+
+
+class _SyncedFile:
+    """
+    Fsync bookkeeping for an append handle (``_file``), per FsyncPolicy.
+
+    Fsyncs run on a single background I/O thread, which also closes sealed
+    files after their last fsync. Jobs run in submission order, so once a
+    job is done every job before it is too. wait_synced() lets a caller
+    await durability without blocking the event loop; callers arriving
+    while an fsync is in progress share the next one.
+
+    Under BATCHED, a write that doesn't start a sync arms a timer on the
+    running event loop, so the last batch before an idle period is still
+    synced within ``fsync_interval``. Under ALWAYS the timer fires on the
+    next loop iteration, covering every write made in the current one.
+    """
+
+    directory: Path  # set by subclasses
+
+    def __init__(self, fsync_policy: FsyncPolicy, fsync_batch_size: int, fsync_interval: float):
+        self.fsync_policy = fsync_policy
+        self.fsync_batch_size = fsync_batch_size
+        self.fsync_interval = fsync_interval
+
+        self._file: Optional[Any] = None
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self._sync_timer: Optional[asyncio.TimerHandle] = None
+        self._io: Optional[concurrent.futures.ThreadPoolExecutor] = None  # started on first use
+        self._last_job: Optional[concurrent.futures.Future] = None
+
+    def sync(self) -> None:
+        """Flush appended records to stable storage, blocking until done."""
+        self._drain()
+        if self._file is not None and self._unsynced:
+            os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self._cancel_sync_timer()
+
+    async def wait_synced(self) -> None:
+        """
+        Wait until every record appended so far is on stable storage.
+
+        Raises:
+            WALError: If the fsync failed
+        """
+        job = self._last_job
+        if self._unsynced and job is not None and not job.done():
+            # Let the fsync in progress finish; the next one covers every write since
+            await asyncio.wait([asyncio.wrap_future(job)])
+        if self._unsynced:
+            self._sync_in_background()
+
+        job = self._last_job
+        if job is None:
+            return
+        try:
+            await asyncio.wrap_future(job)
+        except OSError as e:
+            raise WALError(f"Failed to sync {self.directory}: {str(e)}") from e
+        finally:
+            if job.done() and self._last_job is job:
+                self._last_job = None
+
+    def _submit(self, fn: Callable[..., Any], *args: Any) -> concurrent.futures.Future:
+        """Run a job on the I/O thread after every job submitted before it."""
+        if self._io is None:
+            self._io = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix="wal-io")
+        self._last_job = self._io.submit(fn, *args)
+        return self._last_job
+
+    def _drain(self) -> None:
+        """Block until every background job submitted so far has run."""
+        job, self._last_job = self._last_job, None
+        if job is not None:
+            concurrent.futures.wait([job])
+
+    def _stop_io(self) -> None:
+        """Finish background jobs and stop the I/O thread (restarted on next use)."""
+        self._cancel_sync_timer()
+        io, self._io = self._io, None
+        if io is not None:
+            io.shutdown(wait=True)
+        self._last_job = None
+
+    def _sync_in_background(self) -> None:
+        """Start an fsync of everything written so far on the I/O thread."""
+        self._cancel_sync_timer()
+        if self._file is not None and self._unsynced:
+            self._submit(_fsync, self._file)
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def _seal(self, file: Any) -> None:
+        """Hand a finished append handle to the I/O thread for its last fsync and close."""
+        if self.fsync_policy == FsyncPolicy.NEVER and self._io is None:
+            file.close()
+        elif self.fsync_policy == FsyncPolicy.NEVER:
+            self._submit(file.close)
+        else:
+            self._submit(_fsync_and_close, file)
+
+    def _maybe_sync(self) -> None:
+        """Start a background sync if the policy calls for one now, else schedule it."""
+        if self.fsync_policy == FsyncPolicy.ALWAYS:
+            self._schedule_sync(0.0)
+        elif self.fsync_policy == FsyncPolicy.BATCHED:
+            elapsed = time.monotonic() - self._last_sync
+            if self._unsynced >= self.fsync_batch_size or elapsed >= self.fsync_interval:
+                self._sync_in_background()
+            else:
+                self._schedule_sync(self.fsync_interval - elapsed)
+
+    def _schedule_sync(self, delay: float) -> None:
+        """Arm the sync timer; without a running loop, ALWAYS syncs at once and BATCHED waits."""
+        if self._sync_timer is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            if self.fsync_policy == FsyncPolicy.ALWAYS:
+                self._sync_in_background()
+            return
+        self._sync_timer = loop.call_later(delay, self._sync_when_idle)
+
+    def _sync_when_idle(self) -> None:
+        """Timer callback: sync records written since the last sync."""
+        self._sync_timer = None
+        self._sync_in_background()
+
+    def _cancel_sync_timer(self) -> None:
+        if self._sync_timer is not None:
+            self._sync_timer.cancel()
+            self._sync_timer = None
+
+
+class _Compaction:
+    """A compaction of sealed segments: written on the I/O thread, applied on the loop."""
+
+    __slots__ = ("sealed", "tmp_path", "future")
+
+    def __init__(self, sealed: List["_Segment"]):
+        self.sealed = sealed
+        self.tmp_path = sealed[0].path.with_suffix(".compact")
+        self.future: Optional[concurrent.futures.Future] = None
+
+
+class WriteAheadLog(_SyncedFile):
+    """
+    Segmented append-only log of enqueue/ack records.
+
+    The log is not safe for concurrent use from multiple threads; callers are
+    expected to serialize access (PersistentQueue does so on the event loop).
+    Its own I/O thread only syncs and closes sealed files and writes
+    compacted segments; the result of a compaction is applied on the event
+    loop (or, without a running loop, before compact() returns).
+    """
+
+    def __init__(
+        self,
+        directory: Path,
+        fsync_policy: FsyncPolicy = FsyncPolicy.BATCHED,
+        segment_max_bytes: int = 16 * 1024 * 1024,
+        fsync_batch_size: int = 256,
+        fsync_interval: float = 0.05,
+        compaction_ratio: float = 0.5,
+    ):
+        super().__init__(fsync_policy, fsync_batch_size, fsync_interval)
+        self.directory = directory
+        self.segment_max_bytes = segment_max_bytes
+        self.compaction_ratio = compaction_ratio
+
+        self._segments: List[_Segment] = []
+        # seq -> (segment, offset) of its enqueue record
+        self._live: Dict[int, Tuple[_Segment, int]] = {}
+        self._readers: Dict[int, Any] = {}  # segment id -> open read handle
+        self._next_seq = 1
+        self._compaction: Optional[_Compaction] = None  # running in the background
+
+        # Metrics
+        self.compactions = 0
+        self.bytes_written = 0
+        # Damage found by the last recover(), one description per damaged segment
+        self.recovery_errors: List[str] = []
+
+    @property
+    def live_count(self) -> int:
+        """Number of enqueued records that have not been acked."""
+        return len(self._live)
+
+    @property
+    def segment_count(self) -> int:
+        """Number of segment files currently on disk."""
+        return len(self._segments)
+
+    def recover(self) -> List[WALRecord]:
+        """
+        Open the log and rebuild state from existing segments.
+
+        A torn record at the tail of the last segment (e.g. from a crash
+        mid-write) is truncated away. Damage elsewhere only costs the
+        records it touches: a segment with an unreadable header is set
+        aside, and a segment with a corrupt record keeps the records before
+        it. Either way the original file is kept as ``<segment>.corrupt``
+        and the damage is described in ``recovery_errors``.
+
+        Returns:
+            Live enqueue records in sequence order, without payloads
+        """
+        self.close()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._segments = []
+        self._live = {}
+        self.recovery_errors = []
+        for path in self.directory.glob("*.compact"):
+            # A compaction interrupted before its rename; the originals are intact
+            path.unlink()
+
+        pending: Dict[int, WALRecord] = {}
+        paths = sorted(self.directory.glob(f"*{SEGMENT_SUFFIX}"))
+        for index, path in enumerate(paths):
+            segment = _Segment(int(path.stem), path)
+            try:
+                records, valid_end, file_size = _read_segment(path, with_payload=False)
+            except WALError as e:
+                path.replace(path.with_suffix(".corrupt"))
+                self.recovery_errors.append(f"{path.name}: {str(e)}; segment skipped")
+                continue
+
+            if valid_end < file_size:
+                if index < len(paths) - 1:
+                    # Not an interrupted append: keep the damaged original for inspection
+                    shutil.copyfile(path, path.with_suffix(".corrupt"))
+                    self.recovery_errors.append(
+                        f"{path.name}: corrupt record at offset {valid_end}; "
+                        f"{file_size - valid_end} bytes after it skipped"
+                    )
+                # Torn tail from an interrupted write
+                with open(path, "r+b") as f:
+                    f.truncate(valid_end)
+                file_size = valid_end
+
+            segment.size = file_size
+            segment.records = len(records)
+            for record in records:
+                if record.kind == RecordKind.ENQUEUE:
+                    pending[record.seq] = record
+                    self._live[record.seq] = (segment, record.offset)
+                else:
+                    pending.pop(record.seq, None)
+                    self._live.pop(record.seq, None)
+                if record.seq >= self._next_seq:
+                    self._next_seq = record.seq + 1
+
+            self._segments.append(segment)
+
+        for segment in self._segments:
+            segment.live = 0
+        for segment, _ in self._live.values():
+            segment.live += 1
+
+        self._drop_dead_head()
+        self._open_active()
+
+        return [pending[seq] for seq in sorted(pending)]
+
+    def append_enqueue(
+        self, payload: bytes, priority: int, enqueued_at: float, expires_at: float, flags: int = 0
+    ) -> int:
+        """
+        Append an enqueue record.
+
+        Returns:
+            Sequence number assigned to the record
+        """
+        seq = self._next_seq
+        self._next_seq += 1
+        record = WALRecord(
+            RecordKind.ENQUEUE, seq, priority, flags, enqueued_at, expires_at, payload
+        )
+        segment, offset = self._write(record.encode(), 1)
+        segment.live += 1
+        self._live[seq] = (segment, offset)
+        self._maybe_roll()
+        return seq
+
+    def append_enqueue_many(
+        self, entries: List[Tuple[bytes, int, float, float]], flags: int = 0
+    ) -> List[int]:
+        """
+        Append a batch of enqueue records with a single write.
+
+        Args:
+            entries: (payload, priority, enqueued_at, expires_at) tuples
+
+        Returns:
+            Sequence numbers assigned to the records, in input order
+        """
+        if not entries:
+            return []
+
+        seqs = list(range(self._next_seq, self._next_seq + len(entries)))
+        self._next_seq += len(entries)
+        encoded = [
+            WALRecord(
+                RecordKind.ENQUEUE, seq, priority, flags, enqueued_at, expires_at, payload
+            ).encode()
+            for seq, (payload, priority, enqueued_at, expires_at) in zip(seqs, entries)
+        ]
+
+        segment, offset = self._write(b"".join(encoded), len(entries))
+        segment.live += len(entries)
+        for seq, data in zip(seqs, encoded):
+            self._live[seq] = (segment, offset)
+            offset += len(data)
+        self._maybe_roll()
+        return seqs
+
+    def append_ack(self, seq: int) -> None:
+        """Append an ack record for a previously enqueued sequence number."""
+        location = self._live.pop(seq, None)
+        if location is None:
+            return
+
+        self._write(WALRecord(RecordKind.ACK, seq).encode(), 1)
+        location[0].live -= 1
+        self._drop_dead_head()
+        self._maybe_roll()
+
+    def read_payload(self, seq: int) -> bytes:
+        """
+        Read the payload of a live enqueue record from disk.
+
+        Raises:
+            WALError: If the record is not live or fails its checksum
+        """
+        location = self._live.get(seq)
+        if location is None:
+            raise WALError(f"No live record with sequence {seq}")
+        segment, offset = location
+
+        reader = self._readers.get(segment.segment_id)
+        if reader is None:
+            reader = self._readers[segment.segment_id] = open(segment.path, "rb")
+
+        reader.seek(offset)
+        header = reader.read(RECORD_HEADER.size)
+        if len(header) < RECORD_HEADER.size:
+            raise WALError(f"Truncated record {seq} in {segment.path}")
+        kind, priority, flags, length, crc, record_seq, enqueued_at, expires_at = (
+            RECORD_HEADER.unpack(header)
+        )
+        payload = reader.read(length)
+
+        zeroed = RECORD_HEADER.pack(
+            kind, priority, flags, length, 0, record_seq, enqueued_at, expires_at
+        )
+        if record_seq != seq or zlib.crc32(payload, zlib.crc32(zeroed)) != crc:
+            raise WALError(f"Corrupt record {seq} in {segment.path}")
+        return payload
+
+    def close(self) -> None:
+        """Finish background work, then sync and close the active segment and any read handles."""
+        self._drain()
+        self._stop_io()
+        if self._file is not None:
+            self.sync()
+            self._file.close()
+            self._file = None
+        for reader in self._readers.values():
+            reader.close()
+        self._readers = {}
+
+    def clear(self) -> None:
+        """Delete all segments and start an empty log."""
+        self.close()
+        for segment in self._segments:
+            segment.path.unlink(missing_ok=True)
+        self._segments = []
+        self._live = {}
+        self._open_active()
+
+    def compact(self) -> None:
+        """
+        Rewrite sealed segments keeping only live enqueue records, waiting for it.
+
+        The compacted segment takes the id of the oldest sealed segment so
+        segment ordering is preserved. Recovery de-duplicates by sequence
+        number, so a crash between the rename and the unlinks is harmless.
+        """
+        self._drain()
+        if self._start_compaction():
+            self._drain()
+
+    def _start_compaction(self) -> bool:
+        """Start writing a compacted copy of the sealed segments on the I/O thread."""
+        sealed = self._segments[:-1]
+        if not sealed or self._compaction is not None:
+            return False
+        job = self._compaction = _Compaction(sealed)
+        job.future = self._submit(self._write_compacted, job)
+        return True
+
+    def _write_compacted(self, job: _Compaction) -> Tuple[List[Tuple[int, int]], int]:
+        """
+        Copy the live enqueue records of sealed segments into a new file (I/O thread).
+
+        Records acked meanwhile may still be copied; _finish_compaction()
+        only points records that are still live at the copy.
+
+        Returns:
+            Tuple of ((seq, offset) of each copied record, size of the new file)
+        """
+        copied: List[Tuple[int, int]] = []
+        with open(job.tmp_path, "wb") as f:
+            f.write(SEGMENT_HEADER.pack(SEGMENT_MAGIC, SEGMENT_VERSION, 0))
+            size = SEGMENT_HEADER.size
+            for segment in job.sealed:
+                if segment.live == 0:
+                    continue
+                try:
+                    records, _, _ = _read_segment(segment.path)
+                except FileNotFoundError:
+                    # Dropped once fully acked
+                    continue
+                for record in records:
+                    # Single dict lookups, atomic with respect to the event loop thread
+                    location = self._live.get(record.seq)
+                    if record.kind == RecordKind.ENQUEUE and location and location[0] is segment:
+                        data = record.encode()
+                        f.write(data)
+                        copied.append((record.seq, size))
+                        size += len(data)
+            f.flush()
+            os.fsync(f.fileno())
+        return copied, size
+
+    def _finish_compaction(self, job: _Compaction) -> None:
+        """Swap a written compacted segment in for the sealed ones it replaces."""
+        if self._compaction is not job:
+            # Already applied by close() or compact()
+            return
+        self._compaction = None
+
+        try:
+            copied, size = job.future.result()
+        except Exception:
+            # The originals are intact; a later roll tries again
+            job.tmp_path.unlink(missing_ok=True)
+            return
+
+        sealed = set(job.sealed)
+        target = job.sealed[0]
+        compacted = _Segment(target.segment_id, target.path)
+        compacted.size = size
+        compacted.records = len(copied)
+        for seq, offset in copied:
+            location = self._live.get(seq)
+            if location is not None and location[0] in sealed:
+                self._live[seq] = (compacted, offset)
+                compacted.live += 1
+
+        for segment in job.sealed:
+            self._close_reader(segment)
+        os.replace(job.tmp_path, target.path)
+        for segment in job.sealed[1:]:
+            segment.path.unlink(missing_ok=True)
+
+        self._segments = [compacted] + [s for s in self._segments if s not in sealed]
+        self.compactions += 1
+        self._drop_dead_head()
+
+    def _drain(self) -> None:
+        """Block until background jobs have run, applying a finished compaction."""
+        super()._drain()
+        if self._compaction is not None:
+            self._finish_compaction(self._compaction)
+
+    def iter_records(self, with_payload: bool = True) -> Iterator[WALRecord]:
+        """Iterate over all records currently on disk, oldest first."""
+        if self._file is not None:
+            self._file.flush()
+        yield from iter_log(self.directory, with_payload)
+
+    def _write(self, data: bytes, record_count: int) -> Tuple[_Segment, int]:
+        """
+        Write encoded records to the active segment.
+
+        Callers update their bookkeeping and then call _maybe_roll(), since
+        rolling may compact the segment that was just written to.
+
+        Returns:
+            Tuple of (segment written to, offset of the first record)
+        """
+        if self._file is None:
+            self._open_active()
+
+        active = self._segments[-1]
+        offset = active.size
+        try:
+            self._file.write(data)
+        except OSError as e:
+            raise WALError(f"Failed to append to {active.path}: {str(e)}") from e
+
+        active.size += len(data)
+        active.records += record_count
+        self.bytes_written += len(data)
+        self._unsynced += record_count
+        self._maybe_sync()
+
+        return active, offset
+
+    def _maybe_roll(self) -> None:
+        """Roll over to a new segment once the active one is full."""
+        if self._segments and self._segments[-1].size >= self.segment_max_bytes:
+            self._roll()
+
+    def _open_active(self) -> None:
+        """Open the last segment for appending, creating one if needed."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        if not self._segments:
+            segment_id = 1
+            self._segments.append(_Segment(segment_id, _segment_path(self.directory, segment_id)))
+
+        active = self._segments[-1]
+        self._file = open(active.path, "ab", buffering=0)
+        if active.size == 0:
+            header = SEGMENT_HEADER.pack(SEGMENT_MAGIC, SEGMENT_VERSION, 0)
+            self._file.write(header)
+            active.size = len(header)
+
+    def _roll(self) -> None:
+        """Seal the active segment and start a new one."""
+        if self._file is not None:
+            self._seal(self._file)
+            self._file = None
+        next_id = self._segments[-1].segment_id + 1
+        self._segments.append(_Segment(next_id, _segment_path(self.directory, next_id)))
+        self._open_active()
+        self._maybe_compact()
+
+    def _maybe_compact(self) -> None:
+        """
+        Compact sealed segments once most of their records are dead.
+
+        On a running event loop the compaction is written in the background
+        and applied by a loop callback; otherwise it completes here.
+        """
+        sealed = self._segments[:-1]
+        if len(sealed) < 2 or self._compaction is not None:
+            return
+
+        records = sum(segment.records for segment in sealed)
+        live = sum(segment.live for segment in sealed)
+        if not records or (records - live) / records < self.compaction_ratio:
+            return
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.compact()
+            return
+
+        self._start_compaction()
+        job = self._compaction
+
+        def done(_: concurrent.futures.Future) -> None:
+            try:
+                loop.call_soon_threadsafe(self._finish_compaction, job)
+            except RuntimeError:
+                # Loop closed; close() or recover() applies or discards it
+                pass
+
+        job.future.add_done_callback(done)
+
+    def _drop_dead_head(self) -> None:
+        """Delete fully consumed segments from the head of the log."""
+        while len(self._segments) > 1 and self._segments[0].live == 0:
+            segment = self._segments.pop(0)
+            self._close_reader(segment)
+            segment.path.unlink(missing_ok=True)
+
+    def _close_reader(self, segment: _Segment) -> None:
+        reader = self._readers.pop(segment.segment_id, None)
+        if reader is not None:
+            reader.close()
+
+
+class SegmentSpool(_SyncedFile):
+    """
+    Append-only FIFO of message payloads stored in log segments.
+
+    Used as overflow storage that may grow far beyond memory, such as the
+    dead-letter spill. Records use the segment format above, but there are
+    no ack records: consumption is tracked by a cursor file holding the
+    segment id and offset of the next unread record. Segments behind the
+    committed cursor are deleted. Records read but not yet committed are
+    read again after a crash (at-least-once).
+    """
+
+    def __init__(
+        self,
+        directory: Path,
+        fsync_policy: FsyncPolicy = FsyncPolicy.BATCHED,
+        segment_max_bytes: int = 16 * 1024 * 1024,
+        fsync_batch_size: int = 256,
+        fsync_interval: float = 0.05,
+    ):
+        super().__init__(fsync_policy, fsync_batch_size, fsync_interval)
+        self.directory = directory
+        self.segment_max_bytes = segment_max_bytes
+
+        self._segment_ids: List[int] = []
+        self._write_size = 0  # size of the last segment, which _file appends to
+        self._reader: Optional[Any] = None
+        self._read_position = (1, SEGMENT_HEADER.size)  # (segment id, offset)
+        self._unread = 0
+        self._next_seq = 1
+
+        self.open()
+
+    def __len__(self) -> int:
+        return self._unread
+
+    @property
+    def cursor_path(self) -> Path:
+        return self.directory / SPOOL_CURSOR_FILE
+
+    def open(self) -> None:
+        """Open the spool, counting unread records from the committed cursor."""
+        self.close()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._segment_ids = sorted(
+            int(path.stem) for path in self.directory.glob(f"*{SEGMENT_SUFFIX}")
+        )
+
+        cursor_segment, cursor_offset = read_spool_cursor(self.directory) or (
+            self._segment_ids[0] if self._segment_ids else 1,
+            0,
+        )
+        cursor_offset = max(cursor_offset, SEGMENT_HEADER.size)
+
+        # Segments wholly behind the cursor were consumed before a crash
+        for segment_id in [s for s in self._segment_ids if s < cursor_segment]:
+            _segment_path(self.directory, segment_id).unlink(missing_ok=True)
+        self._segment_ids = [s for s in self._segment_ids if s >= cursor_segment]
+        if self._segment_ids and self._segment_ids[0] != cursor_segment:
+            cursor_segment, cursor_offset = self._segment_ids[0], SEGMENT_HEADER.size
+
+        self._unread = 0
+        for index, segment_id in enumerate(self._segment_ids):
+            path = _segment_path(self.directory, segment_id)
+            with _map_segment(path) as data:
+                valid_end = SEGMENT_HEADER.size if len(data) >= SEGMENT_HEADER.size else 0
+                file_size = len(data)
+                for record, end in _scan_records(data, path, with_payload=False):
+                    valid_end = end
+                    self._next_seq = max(self._next_seq, record.seq + 1)
+                    if segment_id != cursor_segment or record.offset >= cursor_offset:
+                        self._unread += 1
+
+            if valid_end < file_size and index == len(self._segment_ids) - 1:
+                # Torn tail from an interrupted write
+                with open(path, "r+b") as f:
+                    f.truncate(valid_end)
+
+        self._read_position = (cursor_segment, cursor_offset)
+        self._open_writer(self._segment_ids[-1] if self._segment_ids else cursor_segment)
+
+    def append(
+        self, payload: bytes, priority: int, enqueued_at: float, expires_at: float, flags: int = 0
+    ) -> None:
+        """Append one record."""
+        self.append_many([(payload, priority, enqueued_at, expires_at)], flags)
+
+    def append_many(self, entries: List[Tuple[bytes, int, float, float]], flags: int = 0) -> None:
+        """
+        Append a batch of records with a single write.
+
+        Args:
+            entries: (payload, priority, enqueued_at, expires_at) tuples
+        """
+        if not entries:
+            return
+
+        data = b"".join(
+            WALRecord(
+                RecordKind.ENQUEUE, seq, priority, flags, enqueued_at, expires_at, payload
+            ).encode()
+            for seq, (payload, priority, enqueued_at, expires_at) in enumerate(
+                entries, self._next_seq
+            )
+        )
+        self._next_seq += len(entries)
+
+        if self._file is None:
+            # Closed (e.g. by MessageBus.stop()); reopen the last segment
+            self._open_writer(self._segment_ids[-1] if self._segment_ids else 1)
+        try:
+            self._file.write(data)
+        except OSError as e:
+            raise WALError(f"Failed to append to spool {self.directory}: {str(e)}") from e
+
+        self._write_size += len(data)
+        self._unread += len(entries)
+        self._unsynced += len(entries)
+        self._maybe_sync()
+
+        if self._write_size >= self.segment_max_bytes:
+            self._open_writer(self._segment_ids[-1] + 1)
+
+    def read(self, limit: int) -> List[WALRecord]:
+        """
+        Read up to `limit` unread records, oldest first, with payloads.
+
+        The records stay on disk until commit() is called.
+
+        Raises:
+            WALError: If a record fails its checksum
+        """
+        records: List[WALRecord] = []
+        segment_id, offset = self._read_position
+
+        while len(records) < limit and self._unread:
+            if self._reader is None:
+                self._reader = open(_segment_path(self.directory, segment_id), "rb")
+                self._reader.seek(offset)
+
+            header = self._reader.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                # End of this segment; the writer has moved on to a later one
+                later = [s for s in self._segment_ids if s > segment_id]
+                if not later:
+                    break
+                self._reader.close()
+                self._reader = None
+                segment_id, offset = later[0], SEGMENT_HEADER.size
+                continue
+
+            kind, priority, flags, length, crc, seq, enqueued_at, expires_at = RECORD_HEADER.unpack(
+                header
+            )
+            payload = self._reader.read(length)
+            zeroed = RECORD_HEADER.pack(
+                kind, priority, flags, length, 0, seq, enqueued_at, expires_at
+            )
+            if len(payload) < length or zlib.crc32(payload, zlib.crc32(zeroed)) != crc:
+                raise WALError(f"Corrupt spool record at {segment_id}:{offset} in {self.directory}")
+
+            records.append(
+                WALRecord(kind, seq, priority, flags, enqueued_at, expires_at, payload, offset)
+            )
+            offset += RECORD_HEADER.size + length
+            self._unread -= 1
+
+        self._read_position = (segment_id, offset)
+        return records
+
+    def commit(self) -> None:
+        """Persist the read position and delete fully consumed segments, on the I/O thread."""
+        segment_id, offset = self._read_position
+
+        if (
+            not self._unread
+            and segment_id == self._segment_ids[-1]
+            and self._write_size > SEGMENT_HEADER.size
+        ):
+            # Everything consumed: start over with a fresh segment
+            if self._reader is not None:
+                self._reader.close()
+                self._reader = None
+            self._open_writer(segment_id + 1)
+            segment_id, offset = self._segment_ids[-1], SEGMENT_HEADER.size
+            self._read_position = (segment_id, offset)
+
+        consumed = [s for s in self._segment_ids if s < segment_id]
+        self._segment_ids = [s for s in self._segment_ids if s >= segment_id]
+        self._submit(self._write_cursor, segment_id, offset, consumed)
+
+    def close(self) -> None:
+        """Sync and close the spool, committing the read position."""
+        if self._file is not None:
+            self.sync()
+            self.commit()
+            self._stop_io()
+            self._file.close()
+            self._file = None
+        self._stop_io()
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+
+    def clear(self) -> None:
+        """Delete every record and the cursor."""
+        self.close()
+        for path in self.directory.glob(f"*{SEGMENT_SUFFIX}"):
+            path.unlink()
+        self.cursor_path.unlink(missing_ok=True)
+        self.open()
+
+    def _open_writer(self, segment_id: int) -> None:
+        """Start appending to a segment, creating it if needed."""
+        if self._file is not None:
+            self._seal(self._file)
+
+        path = _segment_path(self.directory, segment_id)
+        if segment_id not in self._segment_ids:
+            self._segment_ids.append(segment_id)
+        self._file = open(path, "ab", buffering=0)
+        self._write_size = self._file.tell()
+        if self._write_size == 0:
+            self._file.write(SEGMENT_HEADER.pack(SEGMENT_MAGIC, SEGMENT_VERSION, 0))
+            self._write_size = SEGMENT_HEADER.size
+
+    def _write_cursor(self, segment_id: int, offset: int, consumed: List[int]) -> None:
+        """Replace the cursor file, then delete the segments behind it (I/O thread)."""
+        tmp_path = self.cursor_path.with_suffix(".tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(SPOOL_CURSOR.pack(segment_id, offset))
+            if self.fsync_policy != FsyncPolicy.NEVER:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, self.cursor_path)
+        for consumed_id in consumed:
+            _segment_path(self.directory, consumed_id).unlink(missing_ok=True)
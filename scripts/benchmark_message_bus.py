@@ -0,0 +1,515 @@
+"""
+Performance benchmarks for the message bus.
+
+Usage:
+    python -m scripts.benchmark_message_bus [benchmark ...]
+
+Run without arguments to execute every benchmark.
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple
+
+from core.message_bus import (
+    DequeuePolicy,
+    MessageBus,
+    PersistentQueue,
+    QueueBackend,
+)
+from core.message_codec import decode_message, encode_message
+from core.message_types import (
+    AgentRequest,
+    MessagePriority,
+    MessageValidator,
+    StandardMessage,
+    StatusMessage,
+)
+
+
+def _make_request(index: int) -> AgentRequest:
+    return AgentRequest(sender="benchmark", recipient="worker", action=f"action_{index}")
+
+
+def _cpu_bound_agent(message: StandardMessage) -> None:
+    # Stand-in for SQL parsing or schema analysis; holds the GIL throughout
+    sum(i * i for i in range(20000))
+
+
+def _percentile(samples: List[float], percent: float) -> float:
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(len(ordered) * percent / 100))
+    return ordered[index]
+
+
+async def benchmark_dispatch_latency(iterations: int = 2000) -> Dict[str, Any]:
+    """Measure publish-to-dispatch latency for messages published one at a time."""
+    bus = MessageBus(enable_persistence=False)
+    delivered = asyncio.Event()
+    published_at: Dict[str, float] = {}
+    latencies_us: List[float] = []
+
+    async def on_message(message: StandardMessage) -> None:
+        latencies_us.append((time.perf_counter() - published_at[message.id]) * 1_000_000)
+        delivered.set()
+
+    await bus.subscribe("worker", on_message)
+    await bus.start()
+
+    try:
+        for index in range(iterations):
+            message = _make_request(index)
+            delivered.clear()
+            published_at[message.id] = time.perf_counter()
+            await bus.publish(message)
+            await delivered.wait()
+    finally:
+        await bus.stop()
+
+    return {
+        "messages": iterations,
+        "p50_us": round(statistics.median(latencies_us), 1),
+        "p99_us": round(_percentile(latencies_us, 99), 1),
+        "max_us": round(max(latencies_us), 1),
+    }
+
+
+async def benchmark_idle_cpu(duration: float = 1.0) -> Dict[str, Any]:
+    """Measure CPU consumed by a running bus with no traffic."""
+    bus = MessageBus(enable_persistence=False)
+    await bus.start()
+
+    try:
+        await asyncio.sleep(0.05)
+        cpu_start = time.process_time()
+        await asyncio.sleep(duration)
+        cpu_used = time.process_time() - cpu_start
+    finally:
+        await bus.stop()
+
+    return {
+        "idle_seconds": duration,
+        "cpu_ms": round(cpu_used * 1000, 2),
+        "cpu_percent": round(cpu_used / duration * 100, 2),
+    }
+
+
+async def benchmark_batch_publish(batch_size: int = 1000, rounds: int = 5) -> Dict[str, Any]:
+    """
+    Compare publish() in a loop against publish_many() with persistence enabled.
+
+    Both paths validate and encode every message; only the queue lock, the
+    log write and the lane bookkeeping are shared by a batch. The
+    validate_encode rate is that per-message floor, which bounds the speedup.
+    """
+    timings: Dict[str, List[float]] = {"validate_encode": [], "publish": [], "publish_many": []}
+
+    for _ in range(rounds):
+        messages = [_make_request(index) for index in range(batch_size)]
+        start = time.perf_counter()
+        for message in messages:
+            MessageValidator.validate_message(message)
+            message.to_bytes()
+        timings["validate_encode"].append(time.perf_counter() - start)
+
+        for mode in ("publish", "publish_many"):
+            with tempfile.TemporaryDirectory() as tmp:
+                bus = MessageBus(max_queue_size=batch_size, persistence_dir=Path(tmp))
+                messages = [_make_request(index) for index in range(batch_size)]
+
+                start = time.perf_counter()
+                if mode == "publish":
+                    for message in messages:
+                        await bus.publish(message)
+                else:
+                    await bus.publish_many(messages)
+                timings[mode].append(time.perf_counter() - start)
+
+                await bus.clear_queue()
+
+    floor = statistics.median(timings["validate_encode"])
+    single = statistics.median(timings["publish"])
+    batched = statistics.median(timings["publish_many"])
+    return {
+        "batch_size": batch_size,
+        "validate_encode_msgs_per_sec": round(batch_size / floor),
+        "publish_msgs_per_sec": round(batch_size / single),
+        "publish_many_msgs_per_sec": round(batch_size / batched),
+        "speedup": round(single / batched, 1),
+    }
+
+
+async def benchmark_serialization(iterations: int = 2000, rounds: int = 15) -> Dict[str, Any]:
+    """
+    Compare the JSON form against the binary codec (best of `rounds` per operation).
+
+    json_form is the codec's JSON form, used on the dispatch path (the Redis
+    transport and the process ring); binary is the compact form, used by
+    the WAL and the dead letter spool.
+    """
+    message = AgentRequest(
+        sender="benchmark",
+        recipient="worker",
+        action="analyze_schema",
+        payload={"table": "users", "columns": ["id", "email", "created_at"]},
+        metadata={"topics": ["schema"]},
+    )
+    json_bytes = message.serialize()
+    binary_bytes = encode_message(message)
+    json_form_bytes = encode_message(message, compact=False)
+    operations: Dict[str, Callable[[], Any]] = {
+        "json_encode_us": message.serialize,
+        "json_form_encode_us": lambda: encode_message(message, compact=False),
+        "binary_encode_us": lambda: encode_message(message),
+        "json_decode_us": lambda: AgentRequest.deserialize(json_bytes),
+        "json_form_decode_us": lambda: decode_message(json_form_bytes),
+        "binary_decode_us": lambda: decode_message(binary_bytes),
+    }
+
+    # Interleave the operations so machine noise affects them alike
+    best = {name: float("inf") for name in operations}
+    for _ in range(rounds):
+        for name, func in operations.items():
+            start = time.perf_counter()
+            for _ in range(iterations):
+                func()
+            best[name] = min(best[name], (time.perf_counter() - start) / iterations * 1_000_000)
+
+    result: Dict[str, Any] = {name: round(us, 2) for name, us in best.items()}
+    result["json_bytes"] = len(json_bytes)
+    result["binary_bytes"] = len(binary_bytes)
+    return result
+
+
+async def benchmark_validation(iterations: int = 20000) -> Dict[str, Any]:
+    """Measure validation cost per publish and the share of it spent on the size check."""
+    message = _make_request(0)
+
+    def per_call_us(func: Callable[[], Any]) -> float:
+        start = time.perf_counter()
+        for _ in range(iterations):
+            func()
+        return (time.perf_counter() - start) / iterations * 1_000_000
+
+    return {
+        "validate_us": round(per_call_us(lambda: MessageValidator.validate_message(message)), 2),
+        "size_check_us": round(per_call_us(message.get_size_bytes), 2),
+    }
+
+
+async def benchmark_retry_storm(healthy: int = 500, failing: int = 200) -> Dict[str, Any]:
+    """Measure healthy-traffic latency while another recipient fails every delivery."""
+    bus = MessageBus(enable_persistence=False, retry_base_delay=0.2)
+    published_at: Dict[str, float] = {}
+    latencies_us: List[float] = []
+    done = asyncio.Event()
+
+    async def on_healthy(message: StandardMessage) -> None:
+        latencies_us.append((time.perf_counter() - published_at[message.id]) * 1_000_000)
+        if len(latencies_us) == healthy:
+            done.set()
+
+    async def on_failing(message: StandardMessage) -> None:
+        raise RuntimeError("simulated failure")
+
+    await bus.subscribe("worker", on_healthy, message_types=["agent_request"])
+    await bus.subscribe("flaky", on_failing, message_types=["status"])
+    await bus.start()
+
+    try:
+        await bus.publish_many(
+            [
+                StatusMessage(
+                    sender="benchmark",
+                    recipient="flaky",
+                    status="busy",
+                    component="db",
+                    health_score=50,
+                )
+                for _ in range(failing)
+            ]
+        )
+        start = time.perf_counter()
+        for index in range(healthy):
+            message = _make_request(index)
+            published_at[message.id] = time.perf_counter()
+            await bus.publish(message)
+            await asyncio.sleep(0)
+        await asyncio.wait_for(done.wait(), 60)
+        elapsed = time.perf_counter() - start
+        retried = bus.metrics["messages_retried"]
+    finally:
+        await bus.stop()
+
+    return {
+        "failing_messages": failing,
+        "retries_scheduled": retried,
+        "healthy_msgs_per_sec": round(healthy / elapsed),
+        "healthy_p50_us": round(statistics.median(latencies_us), 1),
+        "healthy_p99_us": round(_percentile(latencies_us, 99), 1),
+    }
+
+
+async def benchmark_priority_lanes(
+    depths: Tuple[int, ...] = (1000, 10000, 100000)
+) -> Dict[str, Any]:
+    """Measure put/get cost per message as queue depth grows, per dequeue policy."""
+    priorities = list(MessagePriority)
+    results: Dict[str, Any] = {}
+
+    for depth in depths:
+        messages = [
+            AgentRequest(sender="benchmark", action="a", priority=priorities[i % len(priorities)])
+            for i in range(depth)
+        ]
+        for policy in DequeuePolicy:
+            queue = PersistentQueue("benchmark", depth, policy=policy)
+
+            start = time.perf_counter()
+            for message in messages:
+                await queue.put(message)
+            put_us = (time.perf_counter() - start) / depth * 1_000_000
+
+            start = time.perf_counter()
+            while await queue.get() is not None:
+                pass
+            get_us = (time.perf_counter() - start) / depth * 1_000_000
+
+            results[f"{policy.value}_{depth}_put_us"] = round(put_us, 2)
+            results[f"{policy.value}_{depth}_get_us"] = round(get_us, 2)
+
+    return results
+
+
+async def benchmark_direct_delivery(messages: int = 5000, subscribers: int = 500) -> Dict[str, Any]:
+    """Compare addressed and broadcast dispatch throughput with many subscribers."""
+    results: Dict[str, Any] = {"messages": messages, "subscribers": subscribers}
+
+    for mode in ("addressed", "broadcast"):
+        bus = MessageBus(max_queue_size=messages, enable_persistence=False)
+        received = 0
+        done = asyncio.Event()
+
+        async def on_message(message: StandardMessage) -> None:
+            nonlocal received
+            received += 1
+            if received == messages:
+                done.set()
+
+        async def on_other(message: StandardMessage) -> None:
+            pass
+
+        await bus.subscribe("worker", on_message, message_types=["agent_request"])
+        for index in range(subscribers - 1):
+            await bus.subscribe(f"agent_{index}", on_other, topics=[f"topic_{index}"])
+        await bus.start()
+        try:
+            recipient = "worker" if mode == "addressed" else None
+            start = time.perf_counter()
+            await bus.publish_many(
+                [
+                    AgentRequest(
+                        sender="benchmark",
+                        recipient=recipient,
+                        action="a",
+                        requires_response=False,
+                    )
+                    for _ in range(messages)
+                ]
+            )
+            await asyncio.wait_for(done.wait(), 120)
+            elapsed = time.perf_counter() - start
+        finally:
+            await bus.stop()
+
+        results[f"{mode}_msgs_per_sec"] = round(messages / elapsed)
+
+    return results
+
+
+async def benchmark_queue_backends(messages: int = 20000, batch: int = 500) -> Dict[str, Any]:
+    """Measure put_many/get_many/ack throughput of each built-in QueueBackend."""
+    results: Dict[str, Any] = {"messages": messages}
+    payload = [_make_request(index) for index in range(messages)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        backends: Dict[str, Callable[[], QueueBackend]] = {
+            "memory": lambda: PersistentQueue("benchmark", messages),
+            "wal": lambda: PersistentQueue("benchmark", messages, Path(tmp) / "wal"),
+        }
+        for name, factory in backends.items():
+            queue = factory()
+
+            start = time.perf_counter()
+            for offset in range(0, messages, batch):
+                await queue.put_many(payload[offset : offset + batch])
+            while True:
+                received = await queue.get_many(batch)
+                if not received:
+                    break
+                for message in received:
+                    await queue.ack(message)
+            await queue.flush()
+            elapsed = time.perf_counter() - start
+
+            results[f"{name}_msgs_per_sec"] = round(messages / elapsed)
+
+    return results
+
+
+async def benchmark_process_delivery(messages: int = 2000) -> Dict[str, Any]:
+    """Compare a CPU-bound sync subscriber on the thread pool against worker processes."""
+    workers = os.cpu_count() or 1
+    results: Dict[str, Any] = {"messages": messages, "workers": workers}
+
+    for mode in ("threads", "processes"):
+        bus = MessageBus(max_queue_size=messages, enable_persistence=False, dispatch_concurrency=8)
+        await bus.subscribe(
+            "worker",
+            _cpu_bound_agent,
+            process_workers=workers if mode == "processes" else None,
+        )
+        await bus.start()
+        try:
+            # Warm up first, so process start-up isn't measured
+            subscription = bus.subscriptions["worker"]
+            await bus.publish(_make_request(0))
+            while subscription.message_count < 1:
+                await asyncio.sleep(0.005)
+
+            start = time.perf_counter()
+            await bus.publish_many([_make_request(index) for index in range(messages)])
+            while subscription.message_count < messages + 1:
+                await asyncio.sleep(0.005)
+            elapsed = time.perf_counter() - start
+        finally:
+            await bus.stop()
+
+        results[f"{mode}_msgs_per_sec"] = round(messages / elapsed)
+
+    return results
+
+
+async def benchmark_sync_isolation(fast: int = 2000, slow: int = 200) -> Dict[str, Any]:
+    """Measure a fast sync subscriber next to a slow one, sharing a thread pool or not."""
+    results: Dict[str, Any] = {"fast_messages": fast, "slow_messages": slow}
+
+    def on_fast(message: StandardMessage) -> None:
+        pass
+
+    def on_slow(message: StandardMessage) -> None:
+        time.sleep(0.01)  # blocking I/O in a sync agent
+
+    for mode in ("shared", "isolated"):
+        bus = MessageBus(
+            max_queue_size=fast + slow, enable_persistence=False, dispatch_concurrency=16
+        )
+        await bus.subscribe("fast", on_fast, executor="agents" if mode == "shared" else None)
+        await bus.subscribe("slow", on_slow, executor="agents" if mode == "shared" else None)
+        await bus.start()
+        try:
+            subscription = bus.subscriptions["fast"]
+            messages = [
+                AgentRequest(sender="benchmark", recipient="slow", action="a") for _ in range(slow)
+            ]
+            messages += [
+                AgentRequest(sender="benchmark", recipient="fast", action="a") for _ in range(fast)
+            ]
+            random.Random(0).shuffle(messages)
+
+            start = time.perf_counter()
+            await bus.publish_many(messages)
+            while subscription.message_count < fast:
+                await asyncio.sleep(0.005)
+            elapsed = time.perf_counter() - start
+        finally:
+            await bus.stop()
+
+        results[f"{mode}_fast_msgs_per_sec"] = round(fast / elapsed)
+
+    return results
+
+
+async def benchmark_slow_subscriber(messages: int = 2000) -> Dict[str, Any]:
+    """Measure a fast subscriber sharing broadcasts with a slow one, per overflow policy."""
+    results: Dict[str, Any] = {"messages": messages}
+
+    for policy in ("block", "drop_oldest", "dead_letter"):
+        bus = MessageBus(max_queue_size=messages, enable_persistence=False, dispatch_concurrency=4)
+        received = 0
+
+        async def on_fast(message: StandardMessage) -> None:
+            nonlocal received
+            received += 1
+
+        async def on_slow(message: StandardMessage) -> None:
+            await asyncio.sleep(0.01)  # a stalled agent
+
+        await bus.subscribe("fast", on_fast, topics=["events"])
+        await bus.subscribe("slow", on_slow, topics=["events"], max_pending=500, overflow=policy)
+        await bus.start()
+        try:
+            batch = [
+                AgentRequest(
+                    sender="benchmark",
+                    action="a",
+                    requires_response=False,
+                    metadata={"topics": ["events"]},
+                )
+                for _ in range(messages)
+            ]
+
+            start = time.perf_counter()
+            await bus.publish_many(batch)
+            while received < messages:
+                await asyncio.sleep(0.005)
+            elapsed = time.perf_counter() - start
+            overflowed = bus.subscriptions["slow"].overflow_count
+        finally:
+            await bus.stop()
+
+        results[f"{policy}_fast_msgs_per_sec"] = round(messages / elapsed)
+        results[f"{policy}_slow_overflowed"] = overflowed
+
+    return results
+
+
+BENCHMARKS: Dict[str, Callable[[], Any]] = {
+    "dispatch_latency": benchmark_dispatch_latency,
+    "idle_cpu": benchmark_idle_cpu,
+    "batch_publish": benchmark_batch_publish,
+    "serialization": benchmark_serialization,
+    "validation": benchmark_validation,
+    "retry_storm": benchmark_retry_storm,
+    "priority_lanes": benchmark_priority_lanes,
+    "direct_delivery": benchmark_direct_delivery,
+    "queue_backends": benchmark_queue_backends,
+    "process_delivery": benchmark_process_delivery,
+    "sync_isolation": benchmark_sync_isolation,
+    "slow_subscriber": benchmark_slow_subscriber,
+}
+
+
+def main() -> None:
+    """Run the selected benchmarks and print their results."""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("benchmarks", nargs="*", help=f"One of: {', '.join(BENCHMARKS)}")
+    args = parser.parse_args()
+
+    unknown = set(args.benchmarks) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown benchmark(s): {', '.join(sorted(unknown))}")
+
+    for name in args.benchmarks or BENCHMARKS:
+        result = asyncio.run(BENCHMARKS[name]())
+        print(f"{name}: " + ", ".join(f"{key}={value}" for key, value in result.items()))
+
+
+if __name__ == "__main__":
+    main()
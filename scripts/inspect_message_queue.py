@@ -0,0 +1,141 @@
+"""
+Inspect a persisted message queue without loading it into memory.
+
+Usage:
+    python -m scripts.inspect_message_queue data/message_bus/main_queue [--dump N]
+
+Segments are streamed through mmap; only the set of live sequence numbers is
+kept in memory. A dead letter spill spool (e.g. data/message_bus/dlq_spill)
+has no ack records; it is read from its committed cursor instead, so only
+the records not yet consumed are counted. shard-* subdirectories, left by
+the former sharded queue until the bus next starts on the directory, are
+inspected in turn.
+"""
+
+import argparse
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Set
+
+from core.message_bus import PAYLOAD_BINARY, PersistentQueue, _priority_name
+from core.message_wal import (
+    SEGMENT_SUFFIX,
+    SEGMENT_VERSION,
+    RecordKind,
+    iter_log,
+    read_spool_cursor,
+)
+
+
+def log_directories(directory: Path) -> List[Path]:
+    """Get the log directories of a queue: its shards, or the directory itself."""
+    shards = sorted(path for path in directory.glob("shard-*") if path.is_dir())
+    return shards or [directory]
+
+
+def summarize(directory: Path) -> Dict[str, object]:
+    """Summarize the records of a queue log or spool directory."""
+    live: Dict[int, int] = {}  # seq -> priority
+    expires: Dict[int, float] = {}
+    acked: Set[int] = set()
+    records = 0
+    oldest = None
+
+    cursor = read_spool_cursor(directory)
+    for record in iter_log(directory, start=cursor):
+        records += 1
+        if record.kind == RecordKind.ENQUEUE:
+            live[record.seq] = record.priority
+            if record.expires_at:
+                expires[record.seq] = record.expires_at
+            if oldest is None or record.enqueued_at < oldest:
+                oldest = record.enqueued_at
+        else:
+            live.pop(record.seq, None)
+            expires.pop(record.seq, None)
+            acked.add(record.seq)
+
+    now = time.time()
+    by_priority = Counter(live.values())
+    segments = [int(path.stem) for path in directory.glob(f"*{SEGMENT_SUFFIX}")]
+    return {
+        "format_version": SEGMENT_VERSION,
+        "spool_cursor": cursor,
+        "segments": sum(1 for s in segments if cursor is None or s >= cursor[0]),
+        "records": records,
+        "live_messages": len(live),
+        "acked_messages": len(acked),
+        "expired_messages": sum(1 for deadline in expires.values() if deadline < now),
+        "oldest_age_s": round(now - oldest, 1) if oldest else None,
+        "live_by_priority": {
+            _priority_name(priority): count for priority, count in sorted(by_priority.items())
+        },
+    }
+
+
+def dump(directory: Path, limit: int) -> int:
+    """
+    Print up to `limit` live messages, decoding them one at a time.
+
+    Returns:
+        Number of messages printed
+    """
+    cursor = read_spool_cursor(directory)
+    acked = {
+        record.seq for record in iter_log(directory, start=cursor) if record.kind == RecordKind.ACK
+    }
+
+    shown = 0
+    for record in iter_log(directory, with_payload=True, start=cursor):
+        if shown >= limit:
+            break
+        if record.kind != RecordKind.ENQUEUE or record.seq in acked:
+            continue
+
+        try:
+            message = PersistentQueue._decode(record.payload, record.flags)
+        except Exception as e:
+            print(f"#{record.seq}: <undecodable: {e}>")
+            continue
+
+        codec = "binary" if record.flags & PAYLOAD_BINARY else "json"
+        print(
+            f"#{record.seq} [{_priority_name(record.priority)}] {message.type} "
+            f"{message.sender} -> {message.recipient or '*'} id={message.id} ({codec})"
+        )
+        shown += 1
+    return shown
+
+
+def main() -> None:
+    """Print a summary of a queue log directory."""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("directory", type=Path, help="Queue log directory")
+    parser.add_argument("--dump", type=int, default=0, metavar="N", help="Print N live messages")
+    args = parser.parse_args()
+
+    if not args.directory.is_dir():
+        parser.error(f"not a queue log directory: {args.directory}")
+
+    directories = log_directories(args.directory)
+    sharded = directories != [args.directory]
+    if sharded:
+        print(f"shards: {len(directories)}")
+
+    for directory in directories:
+        if sharded:
+            print(f"\n[{directory.name}]")
+        for key, value in summarize(directory).items():
+            print(f"{key}: {value}")
+
+    remaining = args.dump
+    for directory in directories:
+        if remaining <= 0:
+            break
+        print(f"\n[{directory.name}]" if sharded else "")
+        remaining -= dump(directory, remaining)
+
+
+if __name__ == "__main__":
+    main()
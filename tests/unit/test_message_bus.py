@@ -0,0 +1,1291 @@
+"""Unit tests for MessageBus."""
+
+import asyncio
+from collections import deque
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from core.message_bus import (
+    PAYLOAD_BINARY,
+    CapacityWaiters,
+    DeadLetterQueue,
+    DeliveryError,
+    DequeuePolicy,
+    FlowControlError,
+    MessageBus,
+    MessageCorruptionError,
+    MessageSubscription,
+    PersistentQueue,
+    QueueBackend,
+    QueueOverflowError,
+    RequestTimeoutError,
+    RetryScheduler,
+    SubscriptionIndex,
+    WaitTimeHistogram,
+)
+from core.message_types import AgentRequest, AgentResponse, MessagePriority, StatusMessage
+
+
+def _request(**kwargs):
+    kwargs.setdefault("sender", "producer")
+    kwargs.setdefault("recipient", "worker")
+    return AgentRequest(action="a", **kwargs)
+
+
+async def _wait_for(condition, timeout=2.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, "condition not met in time"
+        await asyncio.sleep(0.01)
+
+
+class TestSenderCredits:
+    async def test_messages_sharing_an_id_each_return_their_credit(self):
+        bus = MessageBus(enable_persistence=False, sender_credits=2)
+        first = _request()
+        await bus.publish(first)
+        await bus.publish(_request(id=first.id))
+        with pytest.raises(FlowControlError):
+            await bus.publish(_request())
+
+        received = []
+        await bus.subscribe("worker", received.append)
+        await bus.start()
+        try:
+            await _wait_for(lambda: len(received) == 2)
+            assert not bus._credits_used
+
+            await bus.publish(_request())
+            await bus.publish(_request())
+        finally:
+            await bus.stop()
+
+    async def test_clear_queue_returns_credits(self):
+        bus = MessageBus(enable_persistence=False, sender_credits=1)
+        await bus.publish(_request())
+        with pytest.raises(FlowControlError):
+            await bus.publish(_request())
+
+        assert await bus.clear_queue() == 1
+        assert await bus.main_queue.size() == 0
+        await bus.publish(_request())
+
+    async def test_clear_queue_wakes_waiting_publishers(self):
+        bus = MessageBus(enable_persistence=False, sender_credits=1)
+        await bus.publish(_request())
+
+        waiting = asyncio.ensure_future(bus.publish(_request(), timeout=2.0))
+        await asyncio.sleep(0.01)
+        assert not waiting.done()
+
+        await bus.clear_queue()
+        await asyncio.wait_for(waiting, 1.0)
+        assert await bus.main_queue.size() == 1
+
+    async def test_expired_messages_return_credits(self):
+        bus = MessageBus(enable_persistence=False, sender_credits=1, expiry_sweep_interval=0.01)
+        await bus.publish(_request(ttl=0), validate=False)
+
+        await bus.start()
+        try:
+            await _wait_for(lambda: not bus._credits_used)
+            await bus.publish(_request())
+        finally:
+            await bus.stop()
+
+
+class FlakyQueue(PersistentQueue):
+    """Main queue whose next reads come back empty or fail."""
+
+    def __init__(self, *faults):
+        super().__init__("main")
+        self.faults = list(faults)
+        self.gets = 0
+
+    async def get(self):
+        self.gets += 1
+        if self.faults:
+            fault = self.faults.pop(0)
+            if fault is None:
+                return None
+            raise fault
+        return await super().get()
+
+
+class TestDispatchLoop:
+    async def test_wait_not_empty_times_out_on_an_empty_queue(self):
+        queue = PersistentQueue("main")
+        assert not await queue.wait_not_empty(0.01)
+
+        await queue.put(_request())
+        assert await queue.wait_not_empty(0.01)
+
+    async def test_idle_dispatchers_wait_without_polling(self):
+        queue = FlakyQueue()
+        bus = MessageBus(enable_persistence=False, transport=queue, dispatch_concurrency=3)
+        received = []
+        await bus.subscribe("worker", received.append)
+        await bus.start()
+        try:
+            await _wait_for(lambda: len(bus._idle_dispatchers) == 3)
+            await asyncio.sleep(0.05)
+            assert queue.gets == 0
+
+            await bus.publish(_request())
+            await _wait_for(lambda: received)
+        finally:
+            await bus.stop()
+        assert not bus._idle_dispatchers
+
+    async def test_dispatcher_survives_empty_and_failed_reads(self):
+        queue = FlakyQueue(None, RuntimeError("boom"))
+        bus = MessageBus(enable_persistence=False, transport=queue, dispatch_concurrency=1)
+        received = []
+        await bus.subscribe("worker", received.append)
+        await bus.start()
+        try:
+            message = _request()
+            await bus.publish(message)
+            await _wait_for(lambda: received)
+        finally:
+            await bus.stop()
+
+        assert [m.id for m in received] == [message.id]
+        assert queue.gets >= 3
+
+
+class TestOrderedDispatch:
+    def test_invalid_settings_are_rejected(self):
+        with pytest.raises(ValueError):
+            MessageBus(enable_persistence=False, dispatch_concurrency=0)
+        with pytest.raises(ValueError):
+            MessageBus(enable_persistence=False, ordering_key="sender")
+        with pytest.raises(ValueError):
+            MessageBus(enable_persistence=False, sender_credits=0)
+
+    async def test_messages_sharing_a_key_keep_their_order(self):
+        bus = MessageBus(enable_persistence=False, dispatch_concurrency=3, ordering_key="recipient")
+        release = asyncio.Event()
+        received = []
+
+        async def gated(message):
+            await release.wait()
+            received.append(message.id)
+
+        await bus.subscribe("worker", gated, max_pending=1)
+        await bus.start()
+        try:
+            messages = [_request() for _ in range(6)]
+            for message in messages:
+                await bus.publish(message)
+            # One dispatcher is blocked on the full mailbox, the others queued behind it
+            await _wait_for(lambda: len(bus.main_queue) == 0)
+            assert len(bus._inflight_keys["worker"]) == 3
+
+            release.set()
+            await _wait_for(lambda: len(received) == len(messages))
+        finally:
+            await bus.stop()
+
+        assert received == [m.id for m in messages]
+        assert not bus._inflight_keys
+
+    async def test_queued_messages_of_a_key_survive_a_stop(self, tmp_path):
+        bus = MessageBus(persistence_dir=tmp_path, dispatch_concurrency=3, ordering_key="recipient")
+
+        async def stuck(message):
+            await asyncio.Event().wait()
+
+        await bus.subscribe("worker", stuck, max_pending=1)
+        await bus.start()
+        messages = [_request() for _ in range(6)]
+        for message in messages:
+            await bus.publish(message)
+        await _wait_for(lambda: len(bus._inflight_keys.get("worker", ())) == 3)
+        await bus.stop(timeout=0.2)
+
+        restarted = MessageBus(persistence_dir=tmp_path)
+        queued = []
+        while (message := await restarted.main_queue.get()) is not None:
+            queued.append(message.id)
+        dead = [m.id for m in await restarted.dead_letter_queue.get_many(100)]
+        assert sorted(queued + dead) == sorted(m.id for m in messages)
+        assert len(queued) >= 3
+
+
+def _status(**kwargs):
+    return StatusMessage(sender="producer", status="up", component="c", health_score=99, **kwargs)
+
+
+class TestSubscriptionIndex:
+    def _subscriptions(self):
+        return [
+            MessageSubscription("all", print),
+            MessageSubscription("status", print, message_types={"status"}),
+            MessageSubscription("requests", print, message_types={"agent_request"}),
+            MessageSubscription("alerts", print, topics={"alerts"}),
+            MessageSubscription("status-alerts", print, {"alerts", "ops"}, {"status"}),
+            MessageSubscription("urgent", print, priority_threshold=MessagePriority.HIGH),
+        ]
+
+    def test_match_agrees_with_a_scan(self):
+        subscriptions = self._subscriptions()
+        index = SubscriptionIndex()
+        for subscription in subscriptions:
+            index.add(subscription)
+
+        messages = [
+            _status(),
+            _status(metadata={"topics": ["alerts"]}),
+            _status(metadata={"topics": ["ops", "other"]}),
+            _status(priority=MessagePriority.CRITICAL),
+            _status(priority=MessagePriority.LOW, metadata={"topics": ["alerts"]}),
+            _request(recipient=None),
+            _request(recipient=None, metadata={"topics": ["unknown"]}),
+        ]
+        for message in messages:
+            scanned = {s.subscriber_id for s in subscriptions if s.matches(message)}
+            assert {s.subscriber_id for s in index.match(message)} == scanned
+
+    def test_topics_may_be_a_single_string(self):
+        index = SubscriptionIndex()
+        index.add(MessageSubscription("alerts", print, topics={"alerts"}))
+        matched = index.match(_status(metadata={"topics": "alerts"}))
+        assert [s.subscriber_id for s in matched] == ["alerts"]
+
+    def test_removed_and_inactive_subscriptions_do_not_match(self):
+        subscriptions = self._subscriptions()
+        index = SubscriptionIndex()
+        for subscription in subscriptions:
+            index.add(subscription)
+        subscriptions[0].is_active = False
+        message = _status(metadata={"topics": ["alerts"]})
+        assert "all" not in {s.subscriber_id for s in index.match(message)}
+
+        for subscription in subscriptions:
+            index.remove(subscription)
+        assert index.match(message) == []
+        assert not index._by_type and not index._by_topic
+
+    def test_addressed_messages_bypass_the_filters(self):
+        subscription = MessageSubscription("worker", print, message_types={"status"})
+        assert subscription.matches(_request())
+        assert not subscription.matches(_request(recipient="other"))
+        subscription.is_active = False
+        assert not subscription.matches(_request())
+
+    async def test_broadcast_without_a_match_is_dead_lettered(self):
+        bus = MessageBus(enable_persistence=False)
+        received = []
+        await bus.subscribe("requests", received.append, message_types=["agent_request"])
+        await bus.start()
+        try:
+            await bus.publish(_status(max_retries=0))
+            await _wait_for(lambda: bus.metrics["messages_failed"])
+        finally:
+            await bus.stop()
+
+        assert not received
+        assert len(bus.dead_letter_queue) == 1
+
+
+class TestPriorityLanes:
+    async def _fill(self, queue, per_lane):
+        messages = {}
+        for priority in MessagePriority:
+            messages[priority] = [_request(priority=priority) for _ in range(per_lane)]
+            await queue.put_many(messages[priority])
+        return messages
+
+    async def test_strict_policy_serves_lanes_in_priority_order(self):
+        queue = PersistentQueue("main")
+        messages = await self._fill(queue, 2)
+        assert queue.lane_sizes() == {p.name: 2 for p in MessagePriority}
+
+        expected = [m.id for priority in sorted(messages) for m in messages[priority]]
+        assert [m.id for m in await queue.get_many(len(expected))] == expected
+
+    async def test_weighted_policy_shares_dequeues_by_lane_weight(self):
+        queue = PersistentQueue("main", policy=DequeuePolicy.WEIGHTED)
+        messages = await self._fill(queue, 40)
+
+        # One round of the default weights 16/8/4/2/1; peek agrees with get throughout
+        served = []
+        for _ in range(31):
+            head = await queue.peek()
+            message = await queue.get()
+            assert message.id == head.id
+            served.append(message)
+        shares = {p: sum(m.priority == p for m in served) for p in MessagePriority}
+        assert list(shares.values()) == [16, 8, 4, 2, 1]
+
+        # Each lane stays FIFO
+        low = [m.id for m in served if m.priority == MessagePriority.LOW]
+        assert low == [m.id for m in messages[MessagePriority.LOW][:2]]
+
+    async def test_lane_weights_can_be_overridden(self):
+        queue = PersistentQueue(
+            "main",
+            policy=DequeuePolicy.WEIGHTED,
+            lane_weights={MessagePriority.CRITICAL: 1, MessagePriority.DEFERRED: 1},
+        )
+        await queue.put(_request(priority=MessagePriority.CRITICAL))
+        await queue.put(_request(priority=MessagePriority.DEFERRED))
+        priorities = [(await queue.get()).priority for _ in range(2)]
+        assert priorities == [MessagePriority.CRITICAL, MessagePriority.DEFERRED]
+
+        with pytest.raises(ValueError):
+            PersistentQueue("main", lane_weights={MessagePriority.LOW: 0})
+
+
+class TestAging:
+    def test_aging_interval_must_be_positive(self):
+        with pytest.raises(ValueError):
+            PersistentQueue("main", aging_interval=0)
+
+    async def test_long_waiting_low_priority_message_is_served_first(self):
+        aged = PersistentQueue("main", aging_interval=0.001)
+        strict = PersistentQueue("main")
+        low = _request(priority=MessagePriority.LOW)
+        high = _request(priority=MessagePriority.HIGH)
+        for queue in (aged, strict):
+            await queue.put(low)
+        await asyncio.sleep(0.05)
+        for queue in (aged, strict):
+            await queue.put(high)
+
+        assert [m.id for m in await aged.get_many(2)] == [low.id, high.id]
+        assert [m.id for m in await strict.get_many(2)] == [high.id, low.id]
+
+    async def test_recent_messages_keep_strict_order(self):
+        queue = PersistentQueue("main", aging_interval=60)
+        low = _request(priority=MessagePriority.LOW)
+        high = _request(priority=MessagePriority.HIGH)
+        await queue.put(low)
+        await queue.put(high)
+        assert (await queue.peek()).id == high.id
+        assert [m.id for m in await queue.get_many(2)] == [high.id, low.id]
+
+
+class TestWaitTimeHistogram:
+    def test_snapshot_summarizes_observations(self):
+        histogram = WaitTimeHistogram()
+        assert histogram.percentile(50) is None
+        assert histogram.snapshot()["avg_ms"] == 0.0
+
+        for seconds in (0.0005, 0.003, 0.003, 0.2):
+            histogram.observe(seconds)
+        snapshot = histogram.snapshot()
+        assert snapshot["count"] == histogram.count == 4
+        assert snapshot["avg_ms"] == pytest.approx(51.625)
+        assert snapshot["p50_ms"] == 5.0
+        assert snapshot["p99_ms"] == 200.0  # capped at the largest wait seen
+        assert snapshot["max_ms"] == 200.0
+        assert snapshot["buckets"]["le_5ms"] == 2
+
+    def test_waits_beyond_the_last_bucket(self):
+        histogram = WaitTimeHistogram()
+        histogram.observe(120)
+        assert histogram.snapshot()["buckets"]["inf"] == 1
+        assert histogram.percentile(99) == 120000.0
+
+    async def test_metrics_report_waits_per_lane(self):
+        bus = MessageBus(enable_persistence=False)
+        await bus.publish(_request(priority=MessagePriority.LOW))
+        await bus.publish(_request())
+        await bus.main_queue.get_many(2)
+
+        metrics = await bus.get_metrics()
+        assert set(metrics["main_queue_wait_ms"]) == {"NORMAL", "LOW"}
+        assert metrics["main_queue_wait_ms"]["LOW"]["count"] == 1
+        assert metrics["main_queue_lanes"]["LOW"] == 0
+
+
+def _expired(**kwargs):
+    return _request(ttl=1, timestamp=datetime.now(timezone.utc) - timedelta(seconds=5), **kwargs)
+
+
+class FailingEvictionQueue(PersistentQueue):
+    """Main queue whose first eviction fails; dispatch never gets to read it."""
+
+    def __init__(self, **kwargs):
+        super().__init__("main", **kwargs)
+        self.evictions = 0
+
+    async def wait_not_empty(self, timeout=None):
+        await asyncio.Event().wait()
+
+    async def evict_expired(self, now=None, limit=1000):
+        self.evictions += 1
+        if self.evictions == 1:
+            raise RuntimeError("boom")
+        return await super().evict_expired(now, limit)
+
+
+class TestExpirySweep:
+    async def test_expired_messages_are_evicted_ahead_of_dispatch(self):
+        bus = MessageBus(
+            enable_persistence=False,
+            dispatch_concurrency=1,
+            expiry_sweep_interval=0.01,
+            expiry_batch_size=2,
+        )
+        release = asyncio.Event()
+
+        async def gated(message):
+            await release.wait()
+
+        await bus.subscribe("worker", gated, max_pending=1)
+        await bus.start()
+        try:
+            # Callback, mailbox and the blocked dispatcher hold one each
+            for _ in range(3):
+                await bus.publish(_request())
+            await _wait_for(lambda: len(bus.main_queue) == 0)
+
+            expired = [_expired() for _ in range(5)]
+            await bus.publish_many(expired, validate=False)
+            await bus.publish(_request(ttl=None))
+            await _wait_for(lambda: bus.metrics["messages_expired"] == len(expired))
+            assert len(bus.main_queue) == 1
+            dead = await bus.dead_letter_queue.get_many(10)
+            assert sorted(m.id for m in dead) == sorted(m.id for m in expired)
+            assert {m.metadata["dlq_reason"] for m in dead} == {"expired"}
+        finally:
+            release.set()
+            await bus.stop()
+
+    async def test_sweeper_survives_a_failed_eviction(self):
+        queue = FailingEvictionQueue()
+        bus = MessageBus(enable_persistence=False, transport=queue, expiry_sweep_interval=0.01)
+        await bus.publish(_expired(), validate=False)
+        await bus.start()
+        try:
+            await _wait_for(lambda: bus.metrics["messages_expired"] == 1)
+        finally:
+            await bus.stop()
+        assert queue.evictions >= 2
+
+    async def test_eviction_frees_capacity_for_waiting_producers(self):
+        queue = PersistentQueue("main", max_size=1)
+        await queue.put(_expired())
+        waiting = asyncio.ensure_future(queue.put(_request(), timeout=1.0))
+        await asyncio.sleep(0.01)
+        assert not waiting.done()
+
+        assert queue.next_expiry() <= datetime.now(timezone.utc).timestamp()
+        assert len(await queue.evict_expired()) == 1
+        await asyncio.wait_for(waiting, 1.0)
+        assert queue.next_expiry() is not None
+
+
+class TestBackpressure:
+    async def test_waiters_time_out(self):
+        waiters = CapacityWaiters()
+        assert await waiters.wait(lambda: True, 0)
+        assert not await waiters.wait(lambda: False, 0.01)
+        assert len(waiters) == 0
+
+    async def test_woken_producer_that_lost_the_slot_keeps_its_place(self):
+        waiters = CapacityWaiters()
+        free = []
+        order = []
+
+        async def produce(name):
+            assert await waiters.wait(lambda: bool(free), 1.0)
+            free.pop()
+            order.append(name)
+
+        first = asyncio.ensure_future(produce("first"))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(produce("second"))
+        await asyncio.sleep(0)
+
+        # A wakeup without a free slot puts the oldest producer back at the front
+        waiters.wake()
+        await asyncio.sleep(0.01)
+        assert len(waiters) == 2
+
+        free.append(1)
+        waiters.wake()
+        await asyncio.sleep(0.01)
+        free.append(1)
+        waiters.wake()
+        await asyncio.gather(first, second)
+        assert order == ["first", "second"]
+
+    async def test_cancelled_producer_leaves_the_line(self):
+        waiters = CapacityWaiters()
+        free = []
+        cancelled = asyncio.ensure_future(waiters.wait(lambda: bool(free), 1.0))
+        await asyncio.sleep(0)
+        other = asyncio.ensure_future(waiters.wait(lambda: bool(free), 1.0))
+        await asyncio.sleep(0)
+
+        cancelled.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await cancelled
+        assert len(waiters) == 1
+
+        free.append(1)
+        waiters.wake()
+        assert await asyncio.wait_for(other, 1.0)
+
+    async def test_publish_waits_for_room(self):
+        bus = MessageBus(enable_persistence=False, max_queue_size=1)
+        await bus.publish(_request())
+
+        with pytest.raises(QueueOverflowError):
+            await bus.publish(_request(), timeout=0.01)
+        assert bus.metrics["queue_overflows"] == 1
+
+        waiting = asyncio.ensure_future(bus.publish(_request(), timeout=1.0))
+        await asyncio.sleep(0.01)
+        assert not waiting.done()
+        await bus.main_queue.get()
+        await asyncio.wait_for(waiting, 1.0)
+        assert len(bus.main_queue) == 1
+
+    async def test_publish_waits_for_a_credit(self):
+        bus = MessageBus(enable_persistence=False, sender_credits=1)
+        first = _request()
+        await bus.publish(first)
+        with pytest.raises(FlowControlError):
+            await bus.publish(_request(), timeout=0.01)
+
+        waiting = asyncio.ensure_future(bus.publish(_request(), timeout=1.0))
+        await asyncio.sleep(0.01)
+        bus._release_credit(await bus.main_queue.get())
+        await asyncio.wait_for(waiting, 1.0)
+
+    async def test_credit_is_returned_when_the_queue_is_full(self):
+        bus = MessageBus(enable_persistence=False, sender_credits=2, max_queue_size=1)
+        await bus.publish(_request())
+        with pytest.raises(QueueOverflowError):
+            await bus.publish(_request(), timeout=0.01)
+        assert dict(bus._credits_used) == {"producer": 1}
+
+    async def test_invalid_message_is_rejected(self):
+        bus = MessageBus(enable_persistence=False)
+        with pytest.raises(MessageCorruptionError):
+            await bus.publish(_expired())
+        assert len(bus.main_queue) == 0
+
+
+class TestDeadLetterSpill:
+    def _dlq(self, tmp_path, max_size=2):
+        return DeadLetterQueue("dlq", max_size=max_size, spill_path=tmp_path / "spill")
+
+    async def test_overflow_is_spilled_and_read_back_in_order(self, tmp_path):
+        dlq = self._dlq(tmp_path)
+        messages = [_request() for _ in range(5)]
+        for message in messages[:3]:
+            await dlq.put(message)
+        # Once anything is spilled, batches go straight to the spool
+        assert await dlq.put_many(messages[3:]) == [None, None]
+        assert (len(dlq.head), dlq.spilled, await dlq.size()) == (2, 3, 5)
+        assert dlq.spilled_total == 3
+        assert await dlq.wait_not_empty(0)
+
+        received = [await dlq.get() for _ in range(len(messages))]
+        assert [m.id for m in received] == [m.id for m in messages]
+        assert await dlq.get() is None
+        assert len(dlq) == 0
+        await dlq.close()
+
+    async def test_batch_overflowing_the_head_is_spilled(self, tmp_path):
+        dlq = self._dlq(tmp_path)
+        messages = [_request() for _ in range(3)]
+        assert await dlq.put_many(messages) == [None] * 3
+        assert (len(dlq.head), dlq.spilled) == (2, 1)
+
+        await dlq.flush()
+        assert [m.id for m in await dlq.get_many(10)] == [m.id for m in messages]
+
+    async def test_clear_empties_the_spool(self, tmp_path):
+        dlq = self._dlq(tmp_path, max_size=1)
+        await dlq.put_many([_request() for _ in range(3)])
+        await dlq.clear()
+        assert len(dlq) == 0
+        assert not await dlq.wait_not_empty(0.01)
+
+    async def test_without_a_spill_path_a_full_queue_rejects(self):
+        dlq = DeadLetterQueue("dlq", max_size=1)
+        message = _request()
+        await dlq.put(message)
+        with pytest.raises(QueueOverflowError):
+            await dlq.put(_request())
+        errors = await dlq.put_many([_request()])
+        assert isinstance(errors[0], QueueOverflowError)
+
+        # A requeued message goes back into the head
+        taken = await dlq.get()
+        await dlq.requeue([taken])
+        assert [m.id for m in await dlq.get_many(10)] == [message.id]
+        await dlq.ack(taken)
+
+    async def test_undecodable_spooled_message_is_skipped(self, tmp_path):
+        dlq = self._dlq(tmp_path, max_size=1)
+        first, last = _request(), _request()
+        await dlq.put(first)
+        dlq.spool.append(b"not a message", 3, 1.0, 0.0, PAYLOAD_BINARY)
+        await dlq.put(last)
+
+        assert [m.id for m in await dlq.get_many(10)] == [first.id, last.id]
+
+    async def test_corrupt_spool_is_set_aside(self, tmp_path):
+        dlq = self._dlq(tmp_path, max_size=1)
+        await dlq.put_many([_request() for _ in range(3)])
+        await dlq.flush()
+        segment = next((tmp_path / "spill").glob("*.seg"))
+        segment.write_bytes(segment.read_bytes()[:-1] + b"X")
+
+        assert len(await dlq.get_many(10)) == 1  # the head only
+        assert list(tmp_path.glob("spill.corrupt-*"))
+        assert dlq.spilled == 0
+        await dlq.put(_request())
+        assert len(await dlq.get_many(10)) == 1
+
+
+class TestReplay:
+    async def _bus(self, **kwargs):
+        bus = MessageBus(enable_persistence=False, **kwargs)
+        messages = {
+            "timeout": _request(sender="a"),
+            "callback": _request(sender="b"),
+            "status": _status(),
+        }
+        for reason, message in messages.items():
+            await bus._send_to_dlq(message, f"{reason} error")
+        return bus, messages
+
+    async def _queued(self, bus):
+        return {m.id for m in await bus.main_queue.get_many(100)}
+
+    async def test_filters_select_what_is_replayed(self):
+        bus, messages = await self._bus()
+        assert await bus.replay_dlq(reasons=["timeout"]) == 1
+        assert await bus.replay_dlq(senders=["b"]) == 1
+        assert await bus.replay_dlq(message_types=["agent_request"]) == 0
+        assert await self._queued(bus) == {messages["timeout"].id, messages["callback"].id}
+
+        assert await bus.replay_dlq(predicate=lambda m: False) == 0
+        assert await bus.replay_dlq(message_types=["status"]) == 1
+        assert len(bus.dead_letter_queue) == 0
+
+        replayed = (await bus.main_queue.get_many(1))[0]
+        assert replayed.retry_count == 0
+        assert "dlq_reason" not in replayed.metadata
+
+    async def test_time_window_uses_the_dead_letter_time(self):
+        bus, messages = await self._bus()
+        now = datetime.now(timezone.utc)
+        assert await bus.replay_dlq(until=now - timedelta(minutes=1)) == 0
+        assert await bus.replay_dlq(since=now + timedelta(minutes=1)) == 0
+
+        # Naive datetimes are taken as UTC; without a valid stamp the message time counts
+        messages["status"].metadata["dlq_timestamp"] = "not a time"
+        naive = now.replace(tzinfo=None) - timedelta(minutes=1)
+        assert await bus.replay_dlq(since=naive, until=now + timedelta(minutes=1)) == 3
+
+    async def test_limit_and_progress(self):
+        bus, messages = await self._bus()
+        reports = []
+        replayed = await bus.replay_dlq(
+            limit=2, batch_size=1, rate=1000, progress=lambda p: reports.append(p.to_dict())
+        )
+        assert replayed == 2
+        assert [r["replayed"] for r in reports] == [1, 2]
+        assert reports[-1]["total"] == 3 and reports[-1]["rate"] > 0
+        assert len(bus.dead_letter_queue) == 1
+
+    async def test_skipped_messages_return_behind_the_scan_in_a_spooling_dlq(self, tmp_path):
+        bus = MessageBus(persistence_dir=tmp_path, max_dead_letter_size=1)
+        messages = [_request(sender=sender) for sender in "abab"]
+        for message in messages:
+            await bus._send_to_dlq(message, "failed")
+        assert bus.dead_letter_queue.spilled == 3
+
+        assert await bus.replay_dlq(senders=["a"], batch_size=1) == 2
+        remaining = await bus.dead_letter_queue.get_many(10)
+        assert [m.id for m in remaining] == [messages[1].id, messages[3].id]
+        await bus.stop()
+
+    async def test_message_that_cannot_be_republished_goes_back(self):
+        bus, messages = await self._bus(max_queue_size=1)
+        assert await bus.replay_dlq(max_queue_fill=None) == 1
+
+        dead = await bus.dead_letter_queue.get_many(10)
+        assert len(dead) == 2
+        assert all(m.metadata["dlq_reason"].startswith("replay failed") for m in dead)
+
+
+class TestRequestResponse:
+    async def _responder(self, bus, status_code=200):
+        async def respond(message):
+            response = AgentResponse(
+                sender="worker",
+                recipient=message.sender,
+                request_id=message.id,
+                status_code=status_code,
+            )
+            await bus.publish(response)
+
+        await bus.subscribe("worker", respond)
+
+    async def test_response_resolves_the_waiting_call(self):
+        bus = MessageBus(enable_persistence=False)
+        await self._responder(bus)
+        delivered = []
+        await bus.subscribe("producer", delivered.append)
+        await bus.start()
+        try:
+            request = _request()
+            response = await bus.request(request, timeout=1.0)
+        finally:
+            await bus.stop()
+
+        assert response.request_id == request.id and response.is_success
+        assert not delivered  # the response went to the caller only
+        assert (bus.metrics["requests_sent"], bus.metrics["responses_resolved"]) == (1, 1)
+        assert not bus._pending_requests
+
+    async def test_unsolicited_response_is_delivered_normally(self):
+        bus = MessageBus(enable_persistence=False)
+        await self._responder(bus)
+        delivered = []
+        await bus.subscribe("producer", delivered.append)
+        await bus.start()
+        try:
+            await bus.publish(_request())
+            await _wait_for(lambda: delivered)
+        finally:
+            await bus.stop()
+        assert isinstance(delivered[0], AgentResponse)
+
+    async def test_request_times_out(self):
+        bus = MessageBus(enable_persistence=False)
+        await bus.subscribe("worker", lambda message: None)
+        await bus.start()
+        try:
+            with pytest.raises(RequestTimeoutError):
+                await bus.request(_request(), timeout=0.05)
+        finally:
+            await bus.stop()
+        assert bus.metrics["requests_timed_out"] == 1
+        assert not bus._pending_requests
+
+    async def test_dead_lettered_request_fails_at_once(self):
+        bus = MessageBus(enable_persistence=False)
+        await bus.start()
+        try:
+            with pytest.raises(DeliveryError):
+                await bus.request(_request(max_retries=0), timeout=5.0)
+        finally:
+            await bus.stop()
+
+    async def test_invalid_requests_are_rejected(self):
+        bus = MessageBus(enable_persistence=False)
+        with pytest.raises(ValueError):
+            await bus.request(_request(requires_response=False))
+
+        request = _request()
+        waiting = asyncio.ensure_future(bus.request(request, timeout=1.0))
+        await asyncio.sleep(0.01)
+        with pytest.raises(ValueError):
+            await bus.request(request)
+        waiting.cancel()
+        await asyncio.gather(waiting, return_exceptions=True)
+
+
+class TestPointToPoint:
+    async def test_addressed_message_goes_to_its_recipient_only(self):
+        bus = MessageBus(enable_persistence=False)
+        worker, other = [], []
+        await bus.subscribe("worker", worker.append, message_types=["status"])
+        await bus.subscribe("other", other.append)
+        await bus.start()
+        try:
+            message = _request()
+            await bus.publish(message)
+            await _wait_for(lambda: worker)
+            await asyncio.sleep(0.01)
+        finally:
+            await bus.stop()
+
+        assert [m.id for m in worker] == [message.id]
+        assert not other
+
+    async def test_message_for_an_unknown_recipient_is_dead_lettered(self):
+        bus = MessageBus(enable_persistence=False, retry_base_delay=0)
+        await bus.subscribe("other", lambda message: None)
+        await bus.start()
+        try:
+            message = _request(recipient="nobody", max_retries=1)
+            await bus.publish(message)
+            await _wait_for(lambda: len(bus.dead_letter_queue) == 1)
+        finally:
+            await bus.stop()
+
+        assert bus.metrics["messages_retried"] == 1
+        dead = await bus.dead_letter_queue.get_many(1)
+        assert dead[0].metadata["dlq_reason"] == "No subscriber found for recipient: nobody"
+
+
+class ListQueue(QueueBackend):
+    """Minimal backend: an unbounded FIFO relying on the QueueBackend defaults."""
+
+    def __init__(self, name):
+        self.name = name
+        self.max_size = 100
+        self.messages = deque()
+        self.flushed = 0
+        self._not_empty = asyncio.Event()
+
+    async def put(self, message, timeout=None):
+        self.messages.append(message)
+        self._not_empty.set()
+
+    async def put_many(self, messages):
+        for message in messages:
+            await self.put(message)
+        return [None] * len(messages)
+
+    async def get(self):
+        if not self.messages:
+            self._not_empty.clear()
+            return None
+        return self.messages.popleft()
+
+    async def nack(self, message):
+        await self.put(message)
+
+    async def size(self):
+        return len(self.messages)
+
+    def __len__(self):
+        return len(self.messages)
+
+    async def wait_not_empty(self, timeout=None):
+        await asyncio.wait_for(self._not_empty.wait(), timeout)
+        return True
+
+    async def clear(self):
+        self.messages.clear()
+
+    async def flush(self):
+        self.flushed += 1
+
+
+class TestPluggableTransport:
+    async def test_bus_runs_on_a_minimal_backend(self):
+        main, dead = ListQueue("main"), ListQueue("dead")
+        bus = MessageBus(enable_persistence=False, transport=main, dead_letter_transport=dead)
+        received = []
+        await bus.subscribe("worker", received.append)
+        await bus.start()
+        try:
+            messages = [_request(), _request(recipient="nobody", max_retries=0)]
+            await bus.publish_many(messages)
+            await _wait_for(lambda: received and dead.messages)
+            metrics = await bus.get_metrics()
+        finally:
+            await bus.stop()
+
+        assert [m.id for m in received] == [messages[0].id]
+        assert [m.id for m in dead.messages] == [messages[1].id]
+        assert metrics["main_queue_lanes"] == {} and metrics["main_queue_wait_ms"] == {}
+        assert "dlq_spilled" not in metrics
+        # The bus flushes transports it was given but leaves closing them to their owner
+        assert (main.flushed, dead.flushed) == (1, 1)
+
+    async def test_replay_returns_skipped_messages_to_any_backend(self):
+        dead = ListQueue("dead")
+        bus = MessageBus(enable_persistence=False, dead_letter_transport=dead)
+        messages = [_request(sender=sender) for sender in "ab"]
+        for message in messages:
+            await bus._send_to_dlq(message, "failed")
+
+        assert await bus.replay_dlq(senders=["b"]) == 1
+        assert [m.id for m in dead.messages] == [messages[0].id]
+
+    async def test_defaults_have_no_expiry_index(self):
+        queue = ListQueue("main")
+        await queue.put(_expired())
+        assert queue.next_expiry() is None
+        assert await queue.evict_expired() == []
+        assert len(await queue.get_many(10)) == 1
+        await queue.close()
+        assert queue.flushed == 1
+
+
+class TestPublishMany:
+    async def test_failures_are_reported_per_message(self):
+        bus = MessageBus(enable_persistence=False, max_queue_size=3, sender_credits=2)
+        batch = [
+            _request(sender=""),  # fails validation
+            _request(sender="a"),
+            _request(sender="a"),
+            _request(sender="a"),  # sender "a" is out of credits
+            _request(sender="b"),
+            _request(sender="c"),  # the queue is full
+        ]
+        errors = await bus.publish_many(batch)
+
+        assert [type(e) if e else None for e in errors] == [
+            MessageCorruptionError,
+            None,
+            None,
+            FlowControlError,
+            None,
+            QueueOverflowError,
+        ]
+        assert [m.id for m in await bus.main_queue.get_many(10)] == [batch[i].id for i in (1, 2, 4)]
+        assert bus.metrics["messages_published"] == 3
+        assert bus.metrics["queue_overflows"] == 2
+
+    async def test_messages_the_queue_rejects_return_their_credits(self):
+        bus = MessageBus(enable_persistence=False, max_queue_size=2, sender_credits=3)
+        errors = await bus.publish_many([_request() for _ in range(3)])
+        assert [e is None for e in errors] == [True, True, False]
+        assert bus._credits_used["producer"] == 2
+
+        # The rejected message's credit is free again once the queue has room
+        await bus.clear_queue()
+        assert await bus.publish_many([_request() for _ in range(2)]) == [None, None]
+
+
+class TestBatchConsume:
+    async def test_batches_hold_up_to_max_batch_messages(self):
+        bus = MessageBus(enable_persistence=False, dispatch_concurrency=1)
+        batches = []
+
+        async def handler(messages):
+            batches.append([m.id for m in messages])
+
+        await bus.subscribe("worker", handler, max_batch=2, max_wait_ms=20)
+        messages = [_request() for _ in range(5)]
+        await bus.publish_many(messages)
+        await bus.start()
+        try:
+            await _wait_for(lambda: sum(map(len, batches)) == len(messages))
+        finally:
+            await bus.stop()
+
+        assert all(len(batch) <= 2 for batch in batches)
+        assert [i for batch in batches for i in batch] == [m.id for m in messages]
+        subscription = bus.subscriptions["worker"]
+        assert subscription.batch_count == len(batches)
+        assert subscription.message_count == len(messages)
+        assert bus.metrics["messages_delivered"] == len(messages)
+
+    async def test_partial_batch_is_delivered_after_max_wait(self):
+        bus = MessageBus(enable_persistence=False)
+        batches = []
+        await bus.subscribe("worker", batches.append, max_batch=10, max_wait_ms=20)
+        await bus.start()
+        try:
+            message = _request()
+            await bus.publish(message)
+            await _wait_for(lambda: batches)
+        finally:
+            await bus.stop()
+
+        # The sync callback ran on the executor with a list
+        assert [[m.id for m in batch] for batch in batches] == [[message.id]]
+
+    async def test_batch_being_collected_is_delivered_on_stop(self):
+        bus = MessageBus(enable_persistence=False)
+        batches = []
+        await bus.subscribe("worker", batches.append, max_batch=10, max_wait_ms=60_000)
+        await bus.start()
+        message = _request()
+        await bus.publish(message)
+        await _wait_for(lambda: bus.subscriptions["worker"].mailbox.empty())
+        await asyncio.sleep(0.01)
+        await asyncio.wait_for(bus.stop(), 1.0)
+
+        assert [[m.id for m in batch] for batch in batches] == [[message.id]]
+
+    async def test_failed_batch_fails_each_message(self):
+        bus = MessageBus(enable_persistence=False)
+
+        async def failing(messages):
+            raise ValueError("boom")
+
+        await bus.subscribe("worker", failing, max_batch=3, max_wait_ms=20)
+        messages = [_request(max_retries=0) for _ in range(3)]
+        await bus.publish_many(messages)
+        await bus.start()
+        try:
+            await _wait_for(lambda: len(bus.dead_letter_queue) == len(messages))
+        finally:
+            await bus.stop()
+
+        assert bus.subscriptions["worker"].error_count == 1
+        assert bus.metrics["delivery_errors"] == 1
+        assert bus.metrics["messages_failed"] == len(messages)
+
+
+class TestRetryScheduler:
+    def test_invalid_settings_are_rejected(self):
+        with pytest.raises(ValueError):
+            RetryScheduler(None, base_delay=2.0, max_delay=1.0)
+        with pytest.raises(ValueError):
+            RetryScheduler(None, multiplier=0.5)
+        with pytest.raises(ValueError):
+            RetryScheduler(None, jitter=2)
+
+    def test_backoff_grows_up_to_max_delay(self):
+        scheduler = RetryScheduler(None, base_delay=0.1, max_delay=0.5, jitter=0)
+        assert [scheduler.backoff(n) for n in range(1, 5)] == pytest.approx([0.1, 0.2, 0.4, 0.5])
+
+        jittered = RetryScheduler(None, base_delay=1.0, jitter=0.1)
+        assert all(0.9 <= jittered.backoff(1) <= 1.1 for _ in range(20))
+
+    async def test_messages_are_released_when_due(self):
+        released = []
+
+        async def release(message):
+            released.append(message.id)
+
+        scheduler = RetryScheduler(release, base_delay=0.05, jitter=0)
+        scheduler.start()
+        try:
+            late, early = _request(retry_count=1), _request()
+            assert scheduler.schedule(late) == pytest.approx(0.05)
+            # An earlier deadline re-arms the sleeping timer
+            scheduler.schedule(early, delay=0.01)
+            await _wait_for(lambda: len(released) == 2)
+        finally:
+            assert await scheduler.stop() == []
+
+        assert released == [early.id, late.id]
+        assert len(scheduler) == 0
+
+    async def test_failed_release_does_not_stop_the_timer(self):
+        released = []
+
+        async def release(message):
+            if not released:
+                released.append(None)
+                raise RuntimeError("boom")
+            released.append(message.id)
+
+        scheduler = RetryScheduler(release)
+        scheduler.start()
+        try:
+            scheduler.schedule(_request(), delay=0)
+            message = _request()
+            scheduler.schedule(message, delay=0.01)
+            await _wait_for(lambda: len(released) == 2)
+        finally:
+            await scheduler.stop()
+        assert released[1] == message.id
+
+    async def test_stop_returns_waiting_messages_in_due_order(self):
+        scheduler = RetryScheduler(None)
+        scheduler.start()
+        messages = [_request() for _ in range(3)]
+        for message, delay in zip(messages, (30, 10, 20)):
+            scheduler.schedule(message, delay=delay)
+
+        pending = await scheduler.stop()
+        assert [m.id for m in pending] == [messages[i].id for i in (1, 2, 0)]
+
+    async def test_retry_into_a_full_queue_is_dead_lettered(self):
+        bus = MessageBus(enable_persistence=False, max_queue_size=1)
+        message = _request()
+        await bus.publish(_request())
+        await bus._requeue_retry(message)
+
+        dead = await bus.dead_letter_queue.get_many(10)
+        assert [m.id for m in dead] == [message.id]
+        assert dead[0].metadata["dlq_reason"] == "queue overflow on retry"
+
+
+class TestSelfUnsubscribe:
+    async def test_callback_can_unsubscribe_itself(self):
+        bus = MessageBus(enable_persistence=False)
+        finished = []
+
+        async def once(message):
+            await bus.unsubscribe("worker")
+            finished.append(message)
+
+        await bus.subscribe("worker", once)
+        await bus.start()
+        try:
+            # The second message is still in the mailbox when the first callback runs
+            await bus.publish_many([_request(), _request()])
+            await _wait_for(lambda: "worker" not in bus.subscriptions)
+            await _wait_for(lambda: len(finished) == 1)
+            await _wait_for(lambda: len(bus.dead_letter_queue) == 1)
+        finally:
+            await asyncio.wait_for(bus.stop(), 2.0)
+
+    async def test_callback_can_replace_its_subscription(self):
+        bus = MessageBus(enable_persistence=False)
+        first, second = [], []
+
+        async def replace(message):
+            first.append(message)
+            await bus.subscribe("worker", second.append)
+
+        await bus.subscribe("worker", replace)
+        await bus.start()
+        try:
+            await bus.publish(_request())
+            await _wait_for(lambda: len(first) == 1)
+            await bus.publish(_request())
+            await _wait_for(lambda: len(second) == 1)
+            assert len(first) == 1
+        finally:
+            await asyncio.wait_for(bus.stop(), 2.0)
+
+
+class AckRecordingQueue(PersistentQueue):
+    def __init__(self):
+        super().__init__("main")
+        self.acked = []
+
+    async def ack(self, message):
+        self.acked.append(message.id)
+
+
+class TestAcknowledgement:
+    async def test_ack_waits_for_the_callback(self):
+        queue = AckRecordingQueue()
+        bus = MessageBus(enable_persistence=False, transport=queue)
+        release = asyncio.Event()
+        started = []
+
+        async def slow(message):
+            started.append(message)
+            await release.wait()
+
+        await bus.subscribe("worker", slow)
+        await bus.start()
+        try:
+            message = _request()
+            await bus.publish(message)
+            await _wait_for(lambda: started)
+            await asyncio.sleep(0.01)
+            assert queue.acked == []
+
+            release.set()
+            await _wait_for(lambda: queue.acked == [message.id])
+        finally:
+            await bus.stop()
+
+    async def test_broadcast_is_acked_after_every_subscriber(self):
+        queue = AckRecordingQueue()
+        bus = MessageBus(enable_persistence=False, transport=queue)
+        release = asyncio.Event()
+        fast = []
+
+        async def slow(message):
+            await release.wait()
+
+        await bus.subscribe("fast", fast.append)
+        await bus.subscribe("slow", slow)
+        await bus.start()
+        try:
+            message = StatusMessage(sender="producer", status="up", component="c", health_score=99)
+            await bus.publish(message)
+            await _wait_for(lambda: fast)
+            await asyncio.sleep(0.01)
+            assert queue.acked == []
+
+            release.set()
+            await _wait_for(lambda: queue.acked == [message.id])
+        finally:
+            await bus.stop()
+
+    async def test_failed_attempt_is_acked_once_its_retry_is_queued(self):
+        queue = AckRecordingQueue()
+        bus = MessageBus(enable_persistence=False, transport=queue, retry_base_delay=0.2)
+        attempts = []
+
+        def failing(message):
+            attempts.append(message.retry_count)
+            raise ValueError("boom")
+
+        await bus.subscribe("worker", failing)
+        await bus.start()
+        try:
+            message = _request(max_retries=1)
+            await bus.publish(message)
+            await _wait_for(lambda: bus.metrics["messages_retried"] == 1)
+            # Waiting out the backoff: the failed attempt stays unacked
+            await asyncio.sleep(0.05)
+            assert queue.acked == []
+
+            await _wait_for(lambda: attempts == [0, 1])
+            await _wait_for(lambda: queue.acked == [message.id, message.id])
+        finally:
+            await bus.stop()
+
+
+class TestStop:
+    async def _restart_contents(self, path):
+        bus = MessageBus(persistence_dir=path)
+        queued = []
+        while (message := await bus.main_queue.get()) is not None:
+            queued.append(message.id)
+        dead = [message.id for message in await bus.dead_letter_queue.get_many(100)]
+        return queued, dead
+
+    async def test_stop_delivers_what_dispatch_took(self, tmp_path):
+        bus = MessageBus(persistence_dir=tmp_path, dispatch_concurrency=1)
+        release = asyncio.Event()
+        delivered = []
+
+        async def gated(message):
+            await release.wait()
+            delivered.append(message.id)
+
+        await bus.subscribe("worker", gated, max_pending=1)
+        await bus.start()
+        messages = [_request() for _ in range(4)]
+        for message in messages:
+            await bus.publish(message)
+        # First in the callback, second in the mailbox, third held by the blocked dispatcher
+        await _wait_for(lambda: len(bus.main_queue) == 1)
+        await asyncio.sleep(0.01)
+
+        stopping = asyncio.ensure_future(bus.stop())
+        await asyncio.sleep(0.01)
+        release.set()
+        await asyncio.wait_for(stopping, 1.0)
+
+        assert delivered == [m.id for m in messages[:3]]
+        assert await self._restart_contents(tmp_path) == ([messages[3].id], [])
+
+    async def test_undelivered_messages_survive_a_restart(self, tmp_path):
+        bus = MessageBus(persistence_dir=tmp_path)
+        started = []
+
+        async def stuck(message):
+            started.append(message.id)
+            await asyncio.Event().wait()
+
+        await bus.subscribe("worker", stuck, max_pending=1)
+        await bus.start()
+        messages = [_request() for _ in range(5)]
+        for message in messages:
+            await bus.publish(message)
+        await _wait_for(lambda: started)
+        await asyncio.sleep(0.05)  # a dispatcher is now blocked on the full mailbox
+
+        loop = asyncio.get_running_loop()
+        stopping = loop.time()
+        await bus.stop(timeout=0.2)
+        assert loop.time() - stopping < 1.0
+
+        # The cancelled callback, the mailbox and the blocked dispatcher went to the DLQ
+        queued, dead = await self._restart_contents(tmp_path)
+        assert started[0] in dead
+        assert len(dead) >= 3
+        assert sorted(queued + dead) == sorted(m.id for m in messages)
@@ -0,0 +1,219 @@
+"""Unit tests for the binary message codec."""
+
+import struct
+from datetime import datetime, timezone
+
+import pytest
+
+from core.message_codec import (
+    CLASS_CODES,
+    CODEC_VERSION,
+    HEADERS,
+    JSON_FORM,
+    CodecError,
+    decode_message,
+    encode_message,
+)
+from core.message_types import (
+    AgentRequest,
+    AgentResponse,
+    ContextMessage,
+    ErrorMessage,
+    MessagePriority,
+    MessageType,
+    MessageValidator,
+    StandardMessage,
+    StatusMessage,
+)
+
+
+class AuditRequest(AgentRequest):
+    """Application-defined subclass without a wire code."""
+
+    audit_level: int = 1
+
+
+def _request(**kwargs):
+    return AgentRequest(sender="s", recipient="r", action="a", **kwargs)
+
+
+# One message per wire class, with optional fields set
+_COMMON = {
+    "sender": "agent.sender",
+    "recipient": "agent.recipient",
+    "priority": MessagePriority.HIGH,
+    "ttl": None,
+    "correlation_id": "corr-1",
+    "metadata": {"trace": [1, 2.5, None], "nested": {"k": "v"}},
+    "retry_count": 2,
+    "max_retries": 5,
+}
+MESSAGES = [
+    StandardMessage(type=MessageType.STATUS, **_COMMON),
+    AgentRequest(action="analyze", payload={"sql": "SELECT 1"}, timeout=5, **_COMMON),
+    AgentResponse(
+        request_id="req-1",
+        status_code=500,
+        result={"rows": [[1, "a"]]},
+        error={"reason": "partial"},
+        processing_time_ms=12.5,
+        **_COMMON,
+    ),
+    ErrorMessage(
+        error_code="E42",
+        error_type="ValueError",
+        error_message="bad input",
+        stack_trace="Traceback ...",
+        context={"line": 3},
+        recoverable=False,
+        **_COMMON,
+    ),
+    StatusMessage(
+        status="degraded",
+        component="planner",
+        health_score=42.5,
+        metrics={"qps": 10, "p99": 0.25},
+        details={"note": "ünïcode"},
+        **_COMMON,
+    ),
+    ContextMessage(
+        context_type="schema",
+        context_data={"tables": ["a", "b"]},
+        version=3,
+        merge_strategy="merge",
+        expires_at=datetime(2030, 1, 1, tzinfo=timezone.utc),
+        **_COMMON,
+    ),
+]
+
+
+def test_every_wire_class_is_covered():
+    assert {type(message) for message in MESSAGES} == set(CLASS_CODES)
+
+
+@pytest.mark.parametrize("message", MESSAGES, ids=lambda m: type(m).__name__)
+def test_message_round_trips(message):
+    data = encode_message(message)
+    assert data[0] == CODEC_VERSION
+
+    decoded = decode_message(data)
+    assert type(decoded) is type(message)
+    assert decoded.model_dump(mode="json") == message.model_dump(mode="json")
+
+
+@pytest.mark.parametrize("message", MESSAGES, ids=lambda m: type(m).__name__)
+def test_defaults_round_trip(message):
+    # Only the required fields set
+    required = {
+        name: getattr(message, name)
+        for name, field in type(message).model_fields.items()
+        if field.is_required()
+    }
+    minimal = type(message)(**required)
+
+    decoded = decode_message(encode_message(minimal))
+    assert decoded.model_dump(mode="json") == minimal.model_dump(mode="json")
+
+
+@pytest.mark.parametrize("message", MESSAGES, ids=lambda m: type(m).__name__)
+def test_json_form_round_trips(message):
+    data = encode_message(message, compact=False)
+    assert data[0] == JSON_FORM
+
+    decoded = decode_message(data)
+    assert type(decoded) is type(message)
+    assert decoded.model_dump(mode="json") == message.model_dump(mode="json")
+
+
+def test_non_uuid_id_round_trips():
+    message = _request(id="not-a-uuid")
+    assert decode_message(encode_message(message)).id == "not-a-uuid"
+
+
+@pytest.mark.parametrize("message", MESSAGES, ids=lambda m: type(m).__name__)
+def test_truncated_data_is_rejected(message):
+    data = encode_message(message)
+    for length in range(len(data)):
+        with pytest.raises(CodecError):
+            decode_message(data[:length])
+
+
+class TestJsonFallback:
+    def test_unknown_subclass_round_trips(self):
+        message = AuditRequest(sender="s", recipient="r", action="a", audit_level=3)
+        data = encode_message(message)
+
+        assert data[0] == JSON_FORM
+        decoded = decode_message(data)
+        assert type(decoded) is AuditRequest
+        assert decoded.model_dump(mode="json") == message.model_dump(mode="json")
+
+    def test_unknown_subclass_passes_validation(self):
+        message = AuditRequest(sender="s", recipient="r", action="a")
+        assert MessageValidator.validate_message(message) == []
+
+    @pytest.mark.parametrize(
+        "fields",
+        [
+            {"ttl": 2**31},
+            {"ttl": 2**63},
+            {"retry_count": 2**32},
+            {"correlation_id": "c" * 70000},
+        ],
+    )
+    def test_out_of_range_values_round_trip(self, fields):
+        message = _request(**fields)
+        decoded = decode_message(encode_message(message))
+        assert decoded.model_dump(mode="json") == message.model_dump(mode="json")
+
+    def test_large_ttl_stays_binary(self):
+        data = encode_message(_request(ttl=2**40))
+        assert data[0] == CODEC_VERSION
+        assert decode_message(data).ttl == 2**40
+
+    def test_unknown_class_name_is_rejected(self):
+        data = encode_message(AuditRequest(sender="s", recipient="r", action="a"))
+        name = b"tests.unit.test_message_codec.AuditRequest"
+        data = data.replace(name, name.replace(b"Audit", b"Other"))
+
+        with pytest.raises(CodecError, match="Unknown message class"):
+            decode_message(data)
+
+
+def test_version_1_header_is_still_decoded():
+    message = _request(ttl=60)
+    data = encode_message(message)
+
+    # Rewrite the header in the version 1 layout (int32 ttl)
+    fields = list(HEADERS[CODEC_VERSION].unpack_from(data, 0))
+    fields[0] = 1
+    legacy = HEADERS[1].pack(*fields) + data[HEADERS[CODEC_VERSION].size :]
+
+    assert decode_message(legacy).model_dump(mode="json") == message.model_dump(mode="json")
+
+
+def test_unknown_version_is_rejected():
+    data = bytes([99]) + encode_message(_request())[1:]
+    with pytest.raises(CodecError, match="Unsupported codec version"):
+        decode_message(data)
+
+
+def test_struct_layout_is_stable():
+    # Part of the on-disk format
+    assert HEADERS[1].size == struct.calcsize("<BBBBBqiII")
+    assert HEADERS[CODEC_VERSION].size == struct.calcsize("<BBBBBqqII")
+
+
+@pytest.mark.parametrize(
+    "timestamp",
+    [
+        datetime(2024, 5, 17, 12, 30, 45, 123457, tzinfo=timezone.utc),
+        datetime(2112, 9, 1, 23, 59, 59, 999999, tzinfo=timezone.utc),
+        datetime(1969, 12, 31, 23, 59, 59, 1, tzinfo=timezone.utc),
+        datetime(2024, 5, 17, 12, 30, 45, 7),
+    ],
+)
+def test_timestamps_round_trip_exactly(timestamp):
+    decoded = decode_message(encode_message(_request(timestamp=timestamp)))
+    assert decoded.timestamp == timestamp
+    assert (decoded.timestamp.tzinfo is None) == (timestamp.tzinfo is None)
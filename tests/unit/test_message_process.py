@@ -0,0 +1,324 @@
+"""Unit tests for process-pool delivery."""
+
+import asyncio
+import os
+import random
+import signal
+import struct
+import time
+from collections import deque
+
+import pytest
+
+from core.message_bus import MessageBus
+from core.message_codec import JSON_FORM
+from core.message_process import (
+    RECORD_HEADER,
+    RING_HEADER,
+    WRAP_MARKER,
+    ProcessDispatcher,
+    RingBuffer,
+)
+from core.message_types import AgentRequest
+
+
+def _request(action):
+    return AgentRequest(sender="s", recipient="worker", action=action)
+
+
+def _exit_on_crash(message):
+    # Module-level so spawned workers can import it
+    if message.action == "crash":
+        os._exit(3)
+    if message.action == "fail":
+        raise ValueError("callback failed")
+    if message.action == "hang":
+        time.sleep(60)
+
+
+def _ring(capacity):
+    return RingBuffer(memoryview(bytearray(RING_HEADER.size + capacity)))
+
+
+class TestRingBuffer:
+    def test_records_round_trip_in_order(self):
+        ring = _ring(256)
+        for seq, payload in enumerate([b"first", b"", b"third" * 10], 1):
+            assert ring.try_write(seq, payload)
+
+        assert [ring.read() for _ in range(3)] == [(1, b"first"), (2, b""), (3, b"third" * 10)]
+        assert ring.read_pos == ring.write_pos
+
+    def test_full_ring_rejects_writes_until_read(self):
+        record = RECORD_HEADER.size + 16
+        ring = _ring(2 * record)
+        assert ring.try_write(1, b"a" * 16)
+        assert ring.try_write(2, b"b" * 16)
+        assert not ring.try_write(3, b"c" * 16)
+
+        assert ring.read() == (1, b"a" * 16)
+        assert ring.try_write(3, b"c" * 16)
+        assert [ring.read() for _ in range(2)] == [(2, b"b" * 16), (3, b"c" * 16)]
+
+    def test_fits(self):
+        ring = _ring(64)
+        assert ring.fits(64 - RECORD_HEADER.size)
+        assert not ring.fits(64 - RECORD_HEADER.size + 1)
+
+    def test_wrap_marker_skips_the_tail(self):
+        record = RECORD_HEADER.size + 16
+        ring = _ring(2 * record + 8)
+        for seq in (1, 2):
+            assert ring.try_write(seq, bytes([seq]) * 16)
+            ring.read()
+
+        # 8 bytes left at the end: too short for the record, long enough for a marker
+        assert ring.try_write(3, b"c" * 16)
+        marker_offset = RING_HEADER.size + 2 * record
+        assert struct.unpack_from("<I", ring.buffer, marker_offset)[0] == WRAP_MARKER
+        assert ring.read() == (3, b"c" * 16)
+        assert ring.read_pos == ring.write_pos == 3 * record + 8
+
+    def test_tail_too_short_for_a_marker_is_skipped(self):
+        record = RECORD_HEADER.size + 16
+        ring = _ring(2 * record + 2)
+        for seq in (1, 2):
+            assert ring.try_write(seq, bytes([seq]) * 16)
+            ring.read()
+
+        assert ring.try_write(3, b"c" * 16)
+        assert ring.read() == (3, b"c" * 16)
+        assert ring.read_pos == ring.write_pos
+
+    def test_interleaved_writes_and_reads_stay_fifo(self):
+        rng = random.Random(7)
+        ring = _ring(500)
+        expected = deque()
+        seq = 0
+        for _ in range(5000):
+            if rng.random() < 0.55:
+                payload = bytes(rng.randrange(256) for _ in range(rng.randrange(120)))
+                if ring.try_write(seq + 1, payload):
+                    seq += 1
+                    expected.append((seq, payload))
+                else:
+                    # An empty ring always has room for a record this small
+                    assert expected
+            elif expected:
+                assert ring.read() == expected.popleft()
+
+        while expected:
+            assert ring.read() == expected.popleft()
+        assert ring.read_pos == ring.write_pos
+
+
+class TestProcessDispatcher:
+    async def test_results_are_reported(self):
+        dispatcher = ProcessDispatcher(_exit_on_crash, workers=1)
+        dispatcher.start()
+        try:
+            ok, failing = _request("ok"), _request("fail")
+            await dispatcher.submit(ok)
+            await dispatcher.submit(failing)
+
+            results = []
+            while len(results) < 2:
+                results.extend(await asyncio.wait_for(dispatcher.completed(), 30))
+            assert [(m.id, error) for m, error in results] == [
+                (ok.id, None),
+                (failing.id, "callback failed"),
+            ]
+            assert len(dispatcher) == 0
+        finally:
+            await dispatcher.stop()
+
+    async def test_dead_worker_fails_its_message_and_is_replaced(self):
+        dispatcher = ProcessDispatcher(_exit_on_crash, workers=1)
+        dispatcher.start()
+        try:
+            crash = _request("crash")
+            await dispatcher.submit(crash)
+            ((message, error),) = await asyncio.wait_for(dispatcher.completed(), 30)
+            assert message.id == crash.id
+            assert "exited with code 3" in error
+            assert len(dispatcher) == 0
+
+            # The replacement worker takes the next message
+            after = _request("ok")
+            await dispatcher.submit(after)
+            ((message, error),) = await asyncio.wait_for(dispatcher.completed(), 30)
+            assert (message.id, error) == (after.id, None)
+        finally:
+            assert await dispatcher.stop() == []
+
+    async def test_killed_worker_does_not_stall_the_others(self):
+        dispatcher = ProcessDispatcher(_exit_on_crash, workers=2)
+        dispatcher.start()
+        try:
+            hang = _request("hang")
+            await dispatcher.submit(hang)
+            # Wait until a worker is running it
+            while 1 not in dispatcher._taken:
+                await asyncio.sleep(0.01)
+            busy = list(dispatcher._taken).index(1)
+
+            others = [_request(str(i)) for i in range(6)]
+            for message in others:
+                await dispatcher.submit(message)
+            os.kill(dispatcher._processes[busy].pid, signal.SIGKILL)
+
+            results = {}
+            while len(results) < 7:
+                for message, error in await asyncio.wait_for(dispatcher.completed(), 30):
+                    results[message.id] = error
+            assert "exited with code -9" in results[hang.id]
+            # Including the messages queued behind the killed worker
+            assert all(results[m.id] is None for m in others)
+        finally:
+            assert await dispatcher.stop() == []
+
+    async def test_worker_killed_between_claiming_and_removing_a_record(self):
+        dispatcher = ProcessDispatcher(_exit_on_crash, workers=1)
+        dispatcher.start()
+        try:
+            worker = dispatcher._processes[0]
+            os.kill(worker.pid, signal.SIGSTOP)
+            # Run again, it would keep the replacement busy past the timeout
+            claimed, queued = _request("hang"), _request("queued")
+            await dispatcher.submit(claimed)
+            await dispatcher.submit(queued)
+            # The worker has read the first record's sequence number, then dies
+            dispatcher._taken[0] = 1
+            os.kill(worker.pid, signal.SIGKILL)
+
+            results = {}
+            while len(results) < 2:
+                for message, error in await asyncio.wait_for(dispatcher.completed(), 30):
+                    results[message.id] = error
+            assert "exited with code -9" in results[claimed.id]
+            assert results[queued.id] is None
+            assert dispatcher._rings[0].empty
+        finally:
+            assert await dispatcher.stop() == []
+
+    async def test_messages_cross_the_ring_in_json_form(self):
+        dispatcher = ProcessDispatcher(_exit_on_crash, workers=1)
+        dispatcher.start()
+        try:
+            os.kill(dispatcher._processes[0].pid, signal.SIGSTOP)
+            await dispatcher.submit(_request("ok"))
+            _, payload, _ = dispatcher._rings[0].peek()
+            assert payload[0] == JSON_FORM
+        finally:
+            os.kill(dispatcher._processes[0].pid, signal.SIGCONT)
+            await dispatcher.stop()
+
+
+class TestProcessDispatcherLimits:
+    def test_invalid_settings_are_rejected(self):
+        with pytest.raises(ValueError):
+            ProcessDispatcher(_exit_on_crash, workers=0)
+        with pytest.raises(ValueError):
+            ProcessDispatcher(_exit_on_crash, ring_size=RING_HEADER.size)
+
+    async def test_submit_checks_the_dispatcher_and_the_message(self):
+        dispatcher = ProcessDispatcher(_exit_on_crash, workers=1, ring_size=256)
+        with pytest.raises(RuntimeError):
+            await dispatcher.submit(_request("ok"))
+        assert await dispatcher.stop() == []
+
+        dispatcher.start()
+        dispatcher.start()  # already running
+        try:
+            with pytest.raises(ValueError):
+                await dispatcher.submit(_request("x" * 300))
+        finally:
+            await dispatcher.stop()
+
+    async def test_submit_waits_for_room_in_the_rings(self):
+        message = _request("ok")
+        ring_size = RING_HEADER.size + RECORD_HEADER.size + len(message.to_bytes(compact=False))
+        dispatcher = ProcessDispatcher(_exit_on_crash, workers=1, ring_size=ring_size)
+        dispatcher.start()
+        worker = dispatcher._processes[0]
+        try:
+            os.kill(worker.pid, signal.SIGSTOP)
+            await dispatcher.submit(message)
+            waiting = asyncio.ensure_future(dispatcher.submit(_request("ok")))
+            await asyncio.sleep(0.05)
+            assert not waiting.done()
+
+            os.kill(worker.pid, signal.SIGCONT)
+            await asyncio.wait_for(waiting, 30)
+            results = []
+            while len(results) < 2:
+                results.extend(await asyncio.wait_for(dispatcher.completed(), 30))
+        finally:
+            os.kill(worker.pid, signal.SIGCONT)
+            await dispatcher.stop()
+
+    async def test_stop_gives_up_on_a_stuck_worker(self):
+        message = _request("ok")
+        ring_size = RING_HEADER.size + RECORD_HEADER.size + len(message.to_bytes(compact=False))
+        dispatcher = ProcessDispatcher(_exit_on_crash, workers=1, ring_size=ring_size)
+        dispatcher.start()
+        os.kill(dispatcher._processes[0].pid, signal.SIGSTOP)
+        await dispatcher.submit(message)
+
+        # No room for the stop record either; the worker is terminated
+        started = time.monotonic()
+        results = await dispatcher.stop(timeout=0.2)
+        assert time.monotonic() - started < 10
+        assert [(m.id, error) for m, error in results] == [
+            (message.id, "worker process stopped before delivery")
+        ]
+        assert not dispatcher.running
+
+
+class TestProcessSubscription:
+    def _bus(self):
+        return MessageBus(enable_persistence=False)
+
+    async def test_invalid_settings_are_rejected(self):
+        bus = self._bus()
+
+        async def handler(message):
+            pass
+
+        with pytest.raises(ValueError):
+            await bus.subscribe("worker", _exit_on_crash, process_workers=0)
+        with pytest.raises(ValueError):
+            await bus.subscribe("worker", handler, process_workers=1)
+        with pytest.raises(ValueError):
+            await bus.subscribe("worker", _exit_on_crash, process_workers=1, max_batch=10)
+
+    async def test_outcomes_are_recorded(self):
+        bus = self._bus()
+        await bus.subscribe("worker", _exit_on_crash, process_workers=1)
+        await bus.start()
+        try:
+            await bus.publish(_request("ok"))
+            failing = AgentRequest(sender="s", recipient="worker", action="fail", max_retries=0)
+            await bus.publish(failing)
+            deadline = time.monotonic() + 30
+            while not (bus.metrics["messages_delivered"] and len(bus.dead_letter_queue)):
+                assert time.monotonic() < deadline
+                await asyncio.sleep(0.01)
+        finally:
+            await bus.stop()
+
+        subscription = bus.subscriptions["worker"]
+        assert (subscription.message_count, subscription.error_count) == (1, 1)
+        assert subscription.last_message_time is not None
+        assert not subscription.process_deliveries
+        (dead,) = await bus.dead_letter_queue.get_many(1)
+        assert dead.id == failing.id
+        assert dead.metadata["dlq_reason"] == "Process callback error: callback failed"
+
+    async def test_unsubscribe_stops_the_workers(self):
+        bus = self._bus()
+        await bus.subscribe("worker", _exit_on_crash, process_workers=1)
+        pool = bus.subscriptions["worker"].process_pool
+        assert pool.running
+        await bus.unsubscribe("worker")
+        assert not pool.running
@@ -0,0 +1,268 @@
+"""Unit tests for the Redis Streams transport, against an in-memory fake Redis."""
+
+import asyncio
+
+import pytest
+
+from core.message_bus import MessageBus, QueueOverflowError
+from core.message_codec import JSON_FORM
+from core.message_types import AgentRequest, MessagePriority
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from core.message_transport import RedisStreamQueue  # noqa: E402
+
+
+def _request(action="a", **kwargs):
+    return AgentRequest(sender="s", recipient="worker", action=action, **kwargs)
+
+
+@pytest.fixture
+def server():
+    return fakeredis.FakeServer()
+
+
+def _queue(server, consumer="a", **kwargs):
+    kwargs.setdefault("block_ms", 10)
+    client = fakeredis.FakeAsyncRedis(server=server)
+    return RedisStreamQueue("test", client=client, consumer=consumer, **kwargs)
+
+
+class TestRedisStreamQueue:
+    async def test_put_get_ack(self, server):
+        queue = _queue(server)
+        low = _request("low", priority=MessagePriority.LOW)
+        high = _request("high", priority=MessagePriority.HIGH)
+        await queue.put(low)
+        await queue.put(high)
+        assert await queue.size() == 2
+
+        # Higher priority lanes are read first
+        first = await queue.get()
+        assert first.id == high.id
+        await queue.ack(first)
+        await queue.flush()
+        assert len(queue) == 1
+        assert await queue.size() == 1
+
+        second = await queue.get()
+        assert second.id == low.id
+        await queue.ack(second)
+        await queue.flush()
+        assert len(queue) == 0
+        assert await queue.get() is None
+
+    async def test_nacked_message_is_handed_out_again(self, server):
+        queue = _queue(server)
+        message = _request()
+        await queue.put(message)
+
+        await queue.nack(await queue.get())
+        assert (await queue.get()).id == message.id
+
+    async def test_capacity_counts_in_flight_messages(self, server):
+        queue = _queue(server, max_size=3)
+        errors = await queue.put_many([_request(str(i)) for i in range(4)])
+        assert [e is None for e in errors] == [True, True, True, False]
+        assert isinstance(errors[3], QueueOverflowError)
+
+        # Read but not yet acked: still counted
+        message = await queue.get()
+        with pytest.raises(QueueOverflowError):
+            await queue.put(_request())
+
+        await queue.ack(message)
+        await queue.flush()
+        await queue.put(_request())
+        assert await queue.size() == 3
+
+    async def test_capacity_is_shared_between_processes(self, server):
+        first = _queue(server, consumer="a", max_size=2)
+        second = _queue(server, consumer="b", max_size=2)
+        await first.put(_request())
+        await second.put(_request())
+
+        with pytest.raises(QueueOverflowError):
+            await first.put(_request())
+
+    async def test_unacked_entries_are_taken_back_on_restart(self, server):
+        queue = _queue(server)
+        message = _request()
+        await queue.put(message)
+        assert (await queue.get()).id == message.id
+
+        # Same consumer name after a crash
+        restarted = _queue(server)
+        assert (await restarted.get()).id == message.id
+
+    async def test_idle_entries_are_reclaimed_from_other_consumers(self, server):
+        crashed = _queue(server, consumer="a", claim_idle=0.01)
+        message = _request()
+        await crashed.put(message)
+        assert (await crashed.get()).id == message.id
+
+        other = _queue(server, consumer="b", claim_idle=0.01)
+        await asyncio.sleep(0.02)
+        assert await other.wait_not_empty(timeout=1.0)
+        assert (await other.get()).id == message.id
+
+    async def test_each_message_goes_to_one_consumer(self, server):
+        first = _queue(server, consumer="a", read_count=1)
+        second = _queue(server, consumer="b", read_count=1)
+        await first.put_many([_request(str(i)) for i in range(4)])
+
+        received = []
+        for queue in (first, second, first, second):
+            received.append((await queue.get()).action)
+        assert sorted(received) == ["0", "1", "2", "3"]
+
+    async def test_messages_sharing_an_id_are_acked_separately(self, server):
+        queue = _queue(server)
+        message = _request()
+        await queue.put_many([message, message])
+
+        first, second = await queue.get(), await queue.get()
+        await queue.ack(first)
+        await queue.flush()
+        assert await queue.size() == 1
+        await queue.ack(second)
+        await queue.flush()
+        assert await queue.size() == 0
+
+    async def test_entries_are_stored_in_json_form(self, server):
+        queue = _queue(server)
+        await queue.put(_request())
+
+        client = fakeredis.FakeAsyncRedis(server=server)
+        entries = [e for key in queue._keys for e in await client.xrange(key)]
+        assert [fields[b"m"][0] for _, fields in entries] == [JSON_FORM]
+
+
+class TestRedisStreamQueueEdges:
+    def test_invalid_settings_are_rejected(self, server):
+        with pytest.raises(ValueError):
+            _queue(server, read_count=0)
+        with pytest.raises(ValueError):
+            _queue(server, claim_idle=0)
+
+    async def test_put_waits_for_capacity_freed_elsewhere(self, server):
+        queue = _queue(server, max_size=1)
+        other = _queue(server, consumer="b", max_size=1)
+        assert await queue.put_many([]) == []
+        await queue.put(_request())
+        with pytest.raises(QueueOverflowError):
+            await queue.put(_request(), timeout=0.01)
+
+        waiting = asyncio.ensure_future(queue.put(_request(), timeout=2.0))
+        await asyncio.sleep(0.01)
+        await other.ack(await other.get())
+        await other.flush()
+        await asyncio.wait_for(waiting, 2.0)
+        assert await queue.size() == 1
+
+    async def test_sizes_and_wait_times(self, server):
+        queue = _queue(server)
+        await queue.put(_request(priority=MessagePriority.HIGH))
+        await queue.put(_request())
+        assert await queue.size() == 2
+        assert queue.lane_sizes()["HIGH"] == 1
+
+        await queue.ack(await queue.get())
+        await queue.flush()
+        assert queue.lane_sizes()["HIGH"] == 0
+        assert queue.wait_times()[int(MessagePriority.HIGH)].count == 1
+
+    async def test_wait_not_empty_times_out(self, server):
+        queue = _queue(server)
+        assert not await queue.wait_not_empty(timeout=0.02)
+
+    async def test_unknown_messages_are_ignored(self, server):
+        queue = _queue(server)
+        await queue.ack(_request())
+        await queue.nack(_request())
+        assert await queue.get() is None
+
+    async def test_acks_are_sent_in_batches_and_on_close(self, server):
+        queue = _queue(server, read_count=2)
+        await queue.put_many([_request(str(i)) for i in range(3)])
+        for _ in range(2):
+            await queue.ack(await queue.get())
+        # read_count acks are sent at once
+        assert await queue.size() == 1
+
+        await queue.ack(await queue.get())
+        await queue.close()
+        assert await _queue(server).size() == 0
+
+    async def test_undecodable_entries_are_dropped(self, server):
+        queue = _queue(server)
+        client = fakeredis.FakeAsyncRedis(server=server)
+        await client.xadd(queue._keys[0], {"m": b"not a message"})
+        message = _request(priority=MessagePriority.CRITICAL)
+        await queue.put(message)
+
+        assert (await queue.get()).id == message.id
+        assert await queue.get() is None
+        await queue.flush()
+        assert await queue.size() == 1  # the message itself, not yet acked
+
+    async def test_clear_removes_queued_and_in_flight_messages(self, server):
+        queue = _queue(server, read_count=1)
+        await queue.put_many([_request(str(i)) for i in range(2)])
+        assert await queue.get() is not None
+
+        await queue.clear()
+        assert await queue.size() == 0
+        assert queue.lane_sizes()["NORMAL"] == 0
+        # The streams and the group are recreated on the next use
+        message = _request()
+        await queue.put(message)
+        assert (await queue.get()).id == message.id
+
+
+class TestRetries:
+    async def test_retry_waiting_out_its_backoff_survives_a_crash(self, server):
+        bus = MessageBus(enable_persistence=False, transport=_queue(server), retry_base_delay=10.0)
+
+        def failing(message):
+            raise ValueError("boom")
+
+        await bus.subscribe("worker", failing)
+        await bus.start()
+        try:
+            message = _request()
+            await bus.publish(message)
+            deadline = asyncio.get_running_loop().time() + 2.0
+            while not bus.metrics["messages_retried"]:
+                assert asyncio.get_running_loop().time() < deadline
+                await asyncio.sleep(0.01)
+            await asyncio.sleep(0.05)  # the dispatcher's next read would send pending acks
+
+            # The process dies here; its consumer name comes back after a restart
+            restarted = _queue(server)
+            assert (await restarted.get()).id == message.id
+        finally:
+            await bus.stop()
+
+
+class TestReplayPacing:
+    async def test_replay_drains_through_the_transport(self, server):
+        bus = MessageBus(enable_persistence=False, transport=_queue(server, max_size=4))
+        messages = [_request(str(i)) for i in range(6)]
+        for message in messages:
+            await bus._send_to_dlq(message, "failed")
+
+        received = []
+        await bus.subscribe("worker", received.append)
+        await bus.start()
+        try:
+            replayed = await asyncio.wait_for(bus.replay_dlq(batch_size=2, max_queue_fill=0.5), 5.0)
+            assert replayed == len(messages)
+            deadline = asyncio.get_running_loop().time() + 2.0
+            while len(received) < len(messages):
+                assert asyncio.get_running_loop().time() < deadline
+                await asyncio.sleep(0.01)
+        finally:
+            await bus.stop()
+
+        assert sorted(m.action for m in received) == [m.action for m in messages]
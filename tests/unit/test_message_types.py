@@ -0,0 +1,143 @@
+"""Unit tests for message models and validation."""
+
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from core.message_types import (
+    AgentRequest,
+    AgentResponse,
+    ContextMessage,
+    ErrorMessage,
+    MessageType,
+    MessageValidator,
+    StandardMessage,
+    StatusMessage,
+    create_message,
+)
+
+
+def _request(**kwargs):
+    return AgentRequest(sender="s", recipient="r", action="a", **kwargs)
+
+
+class TestInPlaceChanges:
+    def test_encoding_follows_in_place_changes(self):
+        message = _request()
+        before = message.to_bytes()
+        message.metadata["key"] = "value"
+
+        assert message.to_bytes() != before
+        assert StandardMessage.from_bytes(message.to_bytes()).metadata == {"key": "value"}
+
+    def test_size_check_follows_in_place_changes(self):
+        message = _request()
+        assert MessageValidator.validate_message(message) == []
+
+        message.payload["blob"] = "x" * 2000
+        errors = MessageValidator.validate_message(message)
+        assert len(errors) == 1 and "exceeds 1KB limit" in errors[0]
+
+    def test_size_limit_applies_to_the_json_form(self):
+        message = _request()
+        assert message.get_size_bytes() == len(message.serialize())
+
+    def test_field_checks_follow_reassignment(self):
+        message = _request()
+        assert MessageValidator.validate_message(message) == []
+
+        message.recipient = None
+        assert MessageValidator.validate_message(message) == [
+            "Request requiring response must have specific recipient"
+        ]
+
+    def test_repeated_validation_follows_metadata_changes(self):
+        # Dead-lettering and replay change metadata in place between publishes
+        message = _request()
+        assert MessageValidator.is_valid(message)
+
+        message.metadata["dlq_reason"] = "x" * 1100
+        assert not MessageValidator.is_valid(message)
+
+        message.metadata.pop("dlq_reason")
+        assert MessageValidator.is_valid(message)
+
+    def test_sender_check_follows_reassignment(self):
+        message = _request()
+        assert MessageValidator.is_valid(message)
+
+        message.sender = ""
+        assert MessageValidator.validate_message(message) == ["Message must have a sender"]
+
+
+class TestValidation:
+    def test_expired_message_is_invalid(self):
+        message = _request(ttl=1, timestamp=datetime.now(timezone.utc) - timedelta(seconds=5))
+        assert MessageValidator.validate_message(message) == ["Message has expired"]
+        assert not _request(ttl=None).is_expired()
+
+    def test_type_specific_checks(self):
+        response = AgentResponse(sender="s", request_id="", status_code=200)
+        assert MessageValidator.validate_message(response) == [
+            "Response must reference a request ID"
+        ]
+        assert response.is_success and not response.is_error
+
+        error = ErrorMessage(
+            sender="s", error_code="", error_type="t", error_message=" bad ", stack_trace=None
+        )
+        assert MessageValidator.validate_message(error) == ["Error message must have error code"]
+        assert error.error_message == "bad"
+
+    def test_field_validators_reject_bad_values(self):
+        with pytest.raises(ValueError):
+            _request(metadata={"blob": "x" * 600})
+        with pytest.raises(ValueError):
+            ErrorMessage(sender="s", error_code="e", error_type="t", error_message="  ")
+        with pytest.raises(ValueError):
+            ContextMessage(
+                sender="s", context_type="t", context_data={}, version=1, merge_strategy="x"
+            )
+        with pytest.raises(ValueError):
+            ContextMessage(
+                sender="s", context_type="t", context_data={"blob": "x" * 11000}, version=1
+            )
+
+    def test_stack_traces_lose_their_paths(self):
+        error = ErrorMessage(
+            sender="s",
+            error_code="e",
+            error_type="t",
+            error_message="m",
+            stack_trace='File "/srv/app/core/bus.py", line 3',
+        )
+        assert error.stack_trace == 'File "bus.py", line 3'
+
+    def test_context_validity_follows_its_expiry(self):
+        context = ContextMessage(sender="s", context_type="t", context_data={}, version=1)
+        assert context.is_valid()
+        context.expires_at = datetime.now(timezone.utc) - timedelta(seconds=1)
+        assert not context.is_valid()
+
+
+class TestCreateMessage:
+    def test_type_selects_the_model(self):
+        message = create_message(
+            {
+                "type": MessageType.STATUS,
+                "sender": "s",
+                "status": "up",
+                "component": "c",
+                "health_score": 50,
+            }
+        )
+        assert isinstance(message, StatusMessage)
+        assert isinstance(
+            create_message({"type": "agent_request", "sender": "s", "action": "a"}), AgentRequest
+        )
+
+    def test_missing_or_unknown_type_is_rejected(self):
+        with pytest.raises(ValueError):
+            create_message({"sender": "s"})
+        with pytest.raises(ValueError):
+            create_message({"type": "unknown", "sender": "s"})
@@ -0,0 +1,538 @@
+"""Unit tests for the segmented write-ahead log and its recovery."""
+
+import asyncio
+import os
+import threading
+
+import pytest
+
+from core.message_bus import DeadLetterQueue, MessageBus, PersistentQueue
+from core.message_types import AgentRequest
+from core.message_wal import (
+    RECORD_HEADER,
+    SEGMENT_HEADER,
+    SEGMENT_MAGIC,
+    SEGMENT_SUFFIX,
+    SEGMENT_VERSION,
+    FsyncPolicy,
+    RecordKind,
+    SegmentSpool,
+    WALError,
+    WALRecord,
+    WriteAheadLog,
+    iter_log,
+    read_spool_cursor,
+)
+
+
+def _segments(directory):
+    return sorted(directory.glob(f"*{SEGMENT_SUFFIX}"))
+
+
+def _fill(wal, count, size=32):
+    return [wal.append_enqueue(bytes([i % 256]) * size, 3, 1.0, 0.0) for i in range(count)]
+
+
+class TestWriteAheadLog:
+    def test_round_trip(self, tmp_path):
+        wal = WriteAheadLog(tmp_path, FsyncPolicy.NEVER)
+        wal.recover()
+        seqs = _fill(wal, 5)
+        wal.append_ack(seqs[1])
+        wal.close()
+
+        reopened = WriteAheadLog(tmp_path, FsyncPolicy.NEVER)
+        records = reopened.recover()
+        assert [r.seq for r in records] == [seqs[0], seqs[2], seqs[3], seqs[4]]
+        assert reopened.read_payload(seqs[2]) == bytes([2]) * 32
+        assert reopened.recovery_errors == []
+
+        # Sequence numbers continue after the recovered ones
+        assert reopened.append_enqueue(b"next", 3, 1.0, 0.0) == seqs[-1] + 1
+
+    def test_append_many_matches_single_appends(self, tmp_path):
+        wal = WriteAheadLog(tmp_path, FsyncPolicy.NEVER)
+        wal.recover()
+        seqs = wal.append_enqueue_many([(b"a", 1, 1.0, 0.0), (b"bb", 5, 2.0, 9.0)])
+        wal.close()
+
+        records = list(iter_log(tmp_path, with_payload=True))
+        assert [(r.seq, r.priority, r.payload, r.expires_at) for r in records] == [
+            (seqs[0], 1, b"a", 0.0),
+            (seqs[1], 5, b"bb", 9.0),
+        ]
+
+    def test_torn_tail_is_truncated(self, tmp_path):
+        wal = WriteAheadLog(tmp_path, FsyncPolicy.NEVER)
+        wal.recover()
+        seqs = _fill(wal, 3)
+        wal.close()
+
+        (path,) = _segments(tmp_path)
+        intact_size = path.stat().st_size
+        with open(path, "ab") as f:
+            f.write(b"\x01\x03\x00\x00partial record")
+
+        reopened = WriteAheadLog(tmp_path, FsyncPolicy.NEVER)
+        assert [r.seq for r in reopened.recover()] == seqs
+        assert path.stat().st_size == intact_size
+        assert reopened.recovery_errors == []
+
+    def test_corrupt_record_mid_log_keeps_the_rest(self, tmp_path):
+        wal = WriteAheadLog(tmp_path, FsyncPolicy.NEVER, segment_max_bytes=200)
+        wal.recover()
+        seqs = _fill(wal, 8)
+        wal.close()
+
+        paths = _segments(tmp_path)
+        assert len(paths) > 2
+        # Flip a payload byte of the second record in the first segment
+        first = paths[0]
+        data = bytearray(first.read_bytes())
+        data[SEGMENT_HEADER.size + 2 * (36 + 32) + 40] ^= 0xFF
+        first.write_bytes(bytes(data))
+
+        reopened = WriteAheadLog(tmp_path, FsyncPolicy.NEVER, segment_max_bytes=200)
+        recovered = [r.seq for r in reopened.recover()]
+
+        # Only the records of the first segment from the corrupt one on are lost
+        first_segment_seqs = [seq for seq in seqs if seq <= 3]
+        assert recovered == [seq for seq in seqs if seq not in first_segment_seqs[2:]]
+        assert first.with_suffix(".corrupt").read_bytes() == bytes(data)
+        assert len(reopened.recovery_errors) == 1
+
+    def test_unreadable_segment_is_set_aside(self, tmp_path):
+        wal = WriteAheadLog(tmp_path, FsyncPolicy.NEVER, segment_max_bytes=200)
+        wal.recover()
+        seqs = _fill(wal, 8)
+        wal.close()
+
+        first = _segments(tmp_path)[0]
+        first.write_bytes(b"XXXX" + first.read_bytes()[4:])
+
+        reopened = WriteAheadLog(tmp_path, FsyncPolicy.NEVER, segment_max_bytes=200)
+        recovered = [r.seq for r in reopened.recover()]
+        assert recovered and recovered == seqs[-len(recovered) :]
+        assert seqs[0] not in recovered
+        assert first.with_suffix(".corrupt").exists()
+        assert not first.exists()
+        assert len(reopened.recovery_errors) == 1
+
+    def test_acked_head_segments_are_dropped(self, tmp_path):
+        wal = WriteAheadLog(tmp_path, FsyncPolicy.NEVER, segment_max_bytes=200)
+        wal.recover()
+        seqs = _fill(wal, 8)
+        peak = len(_segments(tmp_path))
+        for seq in seqs:
+            wal.append_ack(seq)
+        assert wal.live_count == 0
+        # Ack records may have rolled into a new segment, but consumed ones are gone
+        assert wal.segment_count <= 2 < peak
+        assert len(_segments(tmp_path)) == wal.segment_count
+
+    async def test_batched_sync_runs_after_idle(self, tmp_path, monkeypatch):
+        synced = []
+        real_fsync = os.fsync
+        monkeypatch.setattr(os, "fsync", lambda fd: (synced.append(fd), real_fsync(fd)))
+
+        wal = WriteAheadLog(tmp_path, FsyncPolicy.BATCHED, fsync_interval=0.02)
+        wal.recover()
+        wal.sync()
+        synced.clear()
+
+        # A single write right after a sync is below both thresholds
+        wal.append_enqueue(b"last", 3, 1.0, 0.0)
+        assert synced == []
+
+        await asyncio.sleep(0.05)
+        assert len(synced) == 1
+        assert wal._unsynced == 0
+        wal.close()
+
+    async def test_spool_batched_sync_runs_after_idle(self, tmp_path, monkeypatch):
+        synced = []
+        real_fsync = os.fsync
+        monkeypatch.setattr(os, "fsync", lambda fd: (synced.append(fd), real_fsync(fd)))
+
+        spool = SegmentSpool(tmp_path, FsyncPolicy.BATCHED, fsync_interval=0.02)
+        spool.sync()
+        synced.clear()
+        spool.append(b"last", 3, 1.0, 0.0)
+        await asyncio.sleep(0.05)
+        assert synced
+        spool.close()
+
+
+class TestBackgroundIO:
+    async def test_fsyncs_run_off_the_event_loop(self, tmp_path, monkeypatch):
+        threads = []
+        real_fsync = os.fsync
+        monkeypatch.setattr(
+            os, "fsync", lambda fd: (threads.append(threading.get_ident()), real_fsync(fd))
+        )
+
+        queue = PersistentQueue(
+            "main", persist_path=tmp_path / "q", fsync_policy=FsyncPolicy.ALWAYS
+        )
+        await queue.put(AgentRequest(sender="s", recipient="r", action="a"))
+        # Durable before put() returned, but not synced by the loop's thread
+        assert threads
+        assert threading.get_ident() not in threads
+        await queue.close()
+
+    async def test_concurrent_puts_share_fsyncs(self, tmp_path, monkeypatch):
+        synced = []
+        real_fsync = os.fsync
+        monkeypatch.setattr(os, "fsync", lambda fd: (synced.append(fd), real_fsync(fd)))
+
+        queue = PersistentQueue(
+            "main", persist_path=tmp_path / "q", fsync_policy=FsyncPolicy.ALWAYS
+        )
+        messages = [AgentRequest(sender="s", recipient="r", action=str(i)) for i in range(50)]
+        await asyncio.gather(*(queue.put(message) for message in messages))
+        assert 0 < len(synced) < len(messages)
+        await queue.close()
+
+        reopened = PersistentQueue("main", persist_path=tmp_path / "q")
+        assert len(reopened) == len(messages)
+
+    async def test_compaction_runs_in_the_background(self, tmp_path, monkeypatch):
+        wal = WriteAheadLog(tmp_path, FsyncPolicy.NEVER, segment_max_bytes=300)
+        wal.recover()
+        release = threading.Event()
+        write_compacted = wal._write_compacted
+
+        def blocked(job):
+            release.wait(5)
+            return write_compacted(job)
+
+        monkeypatch.setattr(wal, "_write_compacted", blocked)
+        seqs = _fill(wal, 12)
+        for seq in seqs[:8]:
+            wal.append_ack(seq)
+        while wal._compaction is None:
+            seqs.append(wal.append_enqueue(b"more", 3, 1.0, 0.0))
+
+        # The loop keeps appending and acking while the compaction is written
+        for seq in seqs[8:10]:
+            wal.append_ack(seq)
+        await asyncio.sleep(0.01)
+        assert wal._compaction is not None
+
+        release.set()
+        deadline = asyncio.get_running_loop().time() + 2.0
+        while wal._compaction is not None:
+            assert asyncio.get_running_loop().time() < deadline
+            await asyncio.sleep(0.01)
+        assert wal.compactions == 1
+
+        live = seqs[10:]
+        assert [wal.read_payload(seq)[:1] for seq in live[:2]] == [bytes([10]), bytes([11])]
+        wal.close()
+        reopened = WriteAheadLog(tmp_path, FsyncPolicy.NEVER, segment_max_bytes=300)
+        assert [record.seq for record in reopened.recover()] == live
+        assert not list(tmp_path.glob("*.compact"))
+
+
+class TestSegmentFormat:
+    def test_segments_start_with_a_versioned_header(self, tmp_path):
+        wal = WriteAheadLog(tmp_path, FsyncPolicy.NEVER)
+        wal.recover()
+        _fill(wal, 1)
+        wal.close()
+
+        (path,) = _segments(tmp_path)
+        data = path.read_bytes()
+        assert SEGMENT_HEADER.unpack_from(data) == (SEGMENT_MAGIC, SEGMENT_VERSION, 0)
+        assert len(data) == SEGMENT_HEADER.size + RECORD_HEADER.size + 32
+
+    def test_record_fields_round_trip(self, tmp_path):
+        wal = WriteAheadLog(tmp_path, FsyncPolicy.NEVER)
+        wal.recover()
+        seq = wal.append_enqueue(b"payload", 1, 1700000000.25, 1700000060.5, flags=1)
+        wal.append_ack(seq)
+        wal.close()
+
+        enqueue, ack = iter_log(tmp_path, with_payload=True)
+        assert (enqueue.kind, enqueue.seq, enqueue.priority, enqueue.flags) == (
+            RecordKind.ENQUEUE,
+            seq,
+            1,
+            1,
+        )
+        assert (enqueue.enqueued_at, enqueue.expires_at, enqueue.payload) == (
+            1700000000.25,
+            1700000060.5,
+            b"payload",
+        )
+        assert (ack.kind, ack.seq) == (RecordKind.ACK, seq)
+
+    def test_unknown_version_is_rejected(self, tmp_path):
+        wal = WriteAheadLog(tmp_path, FsyncPolicy.NEVER)
+        wal.recover()
+        _fill(wal, 2)
+        wal.close()
+
+        (path,) = _segments(tmp_path)
+        data = path.read_bytes()
+        path.write_bytes(SEGMENT_HEADER.pack(SEGMENT_MAGIC, SEGMENT_VERSION + 1, 0) + data[8:])
+
+        with pytest.raises(WALError, match="Unsupported segment format"):
+            list(iter_log(tmp_path))
+
+        # Recovery sets the segment aside instead of failing
+        reopened = WriteAheadLog(tmp_path, FsyncPolicy.NEVER)
+        assert reopened.recover() == []
+        assert path.with_suffix(".corrupt").exists()
+        assert len(reopened.recovery_errors) == 1
+
+
+class TestSegmentSpool:
+    def test_round_trip_across_segments(self, tmp_path):
+        spool = SegmentSpool(tmp_path, FsyncPolicy.NEVER, segment_max_bytes=200)
+        payloads = [bytes([i]) * 40 for i in range(10)]
+        for payload in payloads:
+            spool.append(payload, 3, 1.0, 0.0)
+        assert len(_segments(tmp_path)) > 2
+        assert len(spool) == 10
+
+        assert [r.payload for r in spool.read(4)] == payloads[:4]
+        assert [r.payload for r in spool.read(100)] == payloads[4:]
+        assert len(spool) == 0
+
+        spool.commit()
+        spool.sync()  # consumed segments are deleted on the I/O thread
+        assert len(_segments(tmp_path)) == 1
+        spool.close()
+
+    def test_committed_position_survives_a_crash(self, tmp_path):
+        spool = SegmentSpool(tmp_path, FsyncPolicy.NEVER)
+        for i in range(5):
+            spool.append(bytes([i]), 3, 1.0, 0.0)
+        spool.read(2)
+        spool.commit()
+        spool.read(2)  # not committed, so read again after the crash
+        spool.sync()
+
+        # No close(): the process died here
+        reopened = SegmentSpool(tmp_path, FsyncPolicy.NEVER)
+        assert len(reopened) == 3
+        assert [r.payload for r in reopened.read(10)] == [bytes([i]) for i in range(2, 5)]
+        reopened.close()
+
+    def test_unread_records_are_streamed_from_the_cursor(self, tmp_path):
+        spool = SegmentSpool(tmp_path, FsyncPolicy.NEVER, segment_max_bytes=200)
+        payloads = [bytes([i]) * 40 for i in range(10)]
+        for payload in payloads:
+            spool.append(payload, 3, 1.0, 0.0)
+        assert read_spool_cursor(tmp_path) is None
+
+        spool.read(5)
+        spool.commit()
+        spool.sync()
+        cursor = read_spool_cursor(tmp_path)
+        assert cursor is not None
+        records = iter_log(tmp_path, with_payload=True, start=cursor)
+        assert [r.payload for r in records] == payloads[5:]
+        spool.close()
+
+    def test_torn_tail_is_truncated(self, tmp_path):
+        spool = SegmentSpool(tmp_path, FsyncPolicy.NEVER)
+        for i in range(3):
+            spool.append(bytes([i]) * 8, 3, 1.0, 0.0)
+        spool.sync()
+        (path,) = _segments(tmp_path)
+        intact_size = path.stat().st_size
+        with open(path, "ab") as f:
+            f.write(b"\x01\x03\x00\x00partial record")
+
+        reopened = SegmentSpool(tmp_path, FsyncPolicy.NEVER)
+        assert path.stat().st_size == intact_size
+        assert [r.payload for r in reopened.read(10)] == [bytes([i]) * 8 for i in range(3)]
+
+        # Appends continue right after the last intact record
+        reopened.append(b"next", 3, 1.0, 0.0)
+        assert [r.payload for r in reopened.read(10)] == [b"next"]
+        reopened.close()
+
+
+class TestQueueRecovery:
+    async def test_queue_survives_restart(self, tmp_path):
+        queue = PersistentQueue("main", persist_path=tmp_path / "q")
+        messages = [AgentRequest(sender="s", recipient="r", action=f"a{i}") for i in range(3)]
+        for message in messages:
+            await queue.put(message)
+        first = await queue.get()
+        assert first.id == messages[0].id
+        await queue.ack(first)
+        await queue.close()
+
+        reopened = PersistentQueue("main", persist_path=tmp_path / "q")
+        assert len(reopened) == 2
+        assert [(await reopened.get()).id for _ in range(2)] == [m.id for m in messages[1:]]
+
+    async def test_messages_taken_but_not_acked_are_recovered(self, tmp_path):
+        queue = PersistentQueue("main", persist_path=tmp_path / "q")
+        messages = [AgentRequest(sender="s", recipient="r", action=f"a{i}") for i in range(3)]
+        await queue.put_many(messages)
+        first, second = await queue.get(), await queue.get()
+        await queue.ack(second)
+        assert len(queue) == 1
+        await queue.close()
+
+        # The crash happened before `first` was acked
+        reopened = PersistentQueue("main", persist_path=tmp_path / "q")
+        assert len(reopened) == 2
+        assert [(await reopened.get()).id for _ in range(2)] == [first.id, messages[2].id]
+
+    async def test_nack_keeps_the_original_record(self, tmp_path):
+        queue = PersistentQueue("main", persist_path=tmp_path / "q")
+        message = AgentRequest(sender="s", recipient="r", action="a")
+        await queue.put(message)
+        taken = await queue.get()
+        await queue.nack(taken)
+        await queue.nack(taken)  # a second nack of the same copy is just a put
+        assert len(queue) == 2
+
+        again = await queue.get()
+        await queue.ack(again)
+        await queue.ack(again)  # acking twice only removes the record once
+        await queue.close()
+
+        reopened = PersistentQueue("main", persist_path=tmp_path / "q")
+        assert len(reopened) == 1
+
+    async def test_evicted_messages_stay_logged_until_acked(self, tmp_path):
+        queue = PersistentQueue("main", persist_path=tmp_path / "q")
+        kept, dropped = (
+            AgentRequest(sender="s", recipient="r", action=action, ttl=1) for action in "ab"
+        )
+        await queue.put_many([kept, dropped])
+        evicted = await queue.evict_expired(now=kept.timestamp.timestamp() + 5)
+        assert {m.id for m in evicted} == {kept.id, dropped.id}
+        await queue.ack(next(m for m in evicted if m.id == dropped.id))
+        await queue.close()
+
+        reopened = PersistentQueue("main", persist_path=tmp_path / "q")
+        assert [(await reopened.get()).id] == [kept.id]
+
+    async def test_recovered_messages_are_evicted_once_expired(self, tmp_path):
+        directory = tmp_path / "q"
+        message = AgentRequest(sender="s", recipient="r", action="a", ttl=1)
+        expires_at = message.timestamp.timestamp() + 1
+        wal = WriteAheadLog(directory, FsyncPolicy.NEVER)
+        wal.recover()
+        wal.append_enqueue(b"not a message", 3, 1.0, expires_at, flags=1)
+        wal.append_enqueue(message.to_bytes(), 3, 1.0, expires_at, flags=1)
+        wal.close()
+
+        queue = PersistentQueue("main", persist_path=directory)
+        evicted = await queue.evict_expired(now=expires_at + 5)
+        assert [m.id for m in evicted] == [message.id]
+        assert len(queue) == 0
+        await queue.ack(evicted[0])
+        await queue.close()
+
+        assert len(PersistentQueue("main", persist_path=directory)) == 0
+
+    async def test_dead_letter_requeue_moves_head_messages_to_the_spool(self, tmp_path):
+        dlq = DeadLetterQueue(
+            "dlq", max_size=2, persist_path=tmp_path / "dlq", spill_path=tmp_path / "spill"
+        )
+        messages = [AgentRequest(sender="s", recipient="r", action=f"a{i}") for i in range(2)]
+        await dlq.put_many(messages)
+        await dlq.requeue([await dlq.get()])
+        await dlq.close()
+
+        reopened = DeadLetterQueue(
+            "dlq", max_size=2, persist_path=tmp_path / "dlq", spill_path=tmp_path / "spill"
+        )
+        assert (len(reopened.head), reopened.spilled) == (1, 1)
+        assert [m.id for m in await reopened.get_many(2)] == [m.id for m in messages[::-1]]
+
+    async def test_logs_of_the_former_sharded_queue_are_absorbed(self, tmp_path):
+        messages = [AgentRequest(sender="s", recipient=f"r{i}", action="a") for i in range(4)]
+        for index, message in enumerate(messages):
+            shard = PersistentQueue("main", persist_path=tmp_path / "q" / f"shard-{index % 2:02d}")
+            await shard.put(message)
+            await shard.close()
+
+        queue = PersistentQueue("main", persist_path=tmp_path / "q")
+        assert not list((tmp_path / "q").glob("shard-*"))
+        await queue.close()
+
+        reopened = PersistentQueue("main", persist_path=tmp_path / "q")
+        assert [(await reopened.get()).id for _ in range(4)] == [m.id for m in messages]
+
+    async def test_damaged_segment_does_not_empty_the_queue(self, tmp_path):
+        directory = tmp_path / "q"
+        wal = WriteAheadLog(directory, FsyncPolicy.NEVER, segment_max_bytes=300)
+        wal.recover()
+        messages = [AgentRequest(sender="s", recipient="r", action=f"a{i}") for i in range(6)]
+        for message in messages:
+            wal.append_enqueue(message.to_bytes(), 3, 1.0, 0.0, flags=1)
+        wal.close()
+
+        paths = _segments(directory)
+        assert len(paths) > 1
+        paths[0].write_bytes(b"XXXX" + paths[0].read_bytes()[4:])
+
+        queue = PersistentQueue("main", persist_path=directory)
+        assert 0 < len(queue) < len(messages)
+        assert queue._wal.recovery_errors
+        assert list(directory.glob("*.corrupt"))
+
+    async def test_recovered_messages_are_decoded_on_demand(self, tmp_path):
+        queue = PersistentQueue("main", persist_path=tmp_path / "q")
+        messages = [AgentRequest(sender="s", recipient="r", action=f"a{i}") for i in range(2)]
+        await queue.put_many(messages)
+        await queue.close()
+
+        reopened = PersistentQueue("main", persist_path=tmp_path / "q")
+        lane = reopened._lanes[int(messages[0].priority)]
+        assert all(isinstance(entry[2], WALRecord) for entry in lane)
+
+        # Peeking decodes the head in place, the rest stays on disk
+        assert (await reopened.peek()).id == messages[0].id
+        assert [isinstance(entry[2], WALRecord) for entry in lane] == [False, True]
+        assert [(await reopened.get()).id for _ in range(2)] == [m.id for m in messages]
+
+    async def test_undecodable_record_is_dropped_from_the_log(self, tmp_path):
+        directory = tmp_path / "q"
+        message = AgentRequest(sender="s", recipient="r", action="a")
+        wal = WriteAheadLog(directory, FsyncPolicy.NEVER)
+        wal.recover()
+        wal.append_enqueue(b"not a message", 3, 1.0, 0.0, flags=1)
+        wal.append_enqueue(message.to_bytes(), 3, 1.0, 0.0, flags=1)
+        wal.close()
+
+        queue = PersistentQueue("main", persist_path=directory)
+        assert len(queue) == 2
+        assert (await queue.peek()).id == message.id
+        assert len(queue) == 1
+        await queue.close()
+
+        reopened = PersistentQueue("main", persist_path=directory)
+        assert len(reopened) == 1
+        assert (await reopened.get()).id == message.id
+        assert await reopened.peek() is None
+
+    async def test_stop_closes_the_logs(self, tmp_path):
+        bus = MessageBus(persistence_dir=tmp_path)
+        await bus.start()
+        await bus.publish(AgentRequest(sender="s", recipient="nobody", action="a"))
+        await bus.stop()
+
+        assert bus.main_queue._wal._file is None
+        assert bus.dead_letter_queue.head._wal._file is None
+
+        # The bus can be started again on the same logs
+        await bus.start()
+        await bus.publish(AgentRequest(sender="s", recipient="r", action="b"))
+        await bus.stop()
+
+
+def test_record_kinds_are_stable():
+    # Part of the on-disk format
+    assert RecordKind.ENQUEUE == 1
+    assert RecordKind.ACK == 2